@@ -0,0 +1,355 @@
+#!/usr/bin/python3
+
+"""
+Columnar Snapshot
+
+This application exports a snapshot database into a columnar Arrow/Parquet
+dataset partitioned by site, device identifier and object type.  Each value
+is stored in a typed column according to its kind so queries across many
+sites can be run vectorized without unpickling every row, and the
+ColumnarSnapshot reader provides the same items() interface as db.Snapshot
+so dump.py can be used on the dataset.
+"""
+
+import os
+import pickle
+
+import pyarrow
+import pyarrow.dataset
+import pyarrow.compute
+
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger
+from bacpypes.consolelogging import ArgumentParser
+
+from db import Snapshot, value_contents, encoder
+from db import is_filter, is_objid_filter, parse_ranges, parse_objid
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+# rows written at a time
+BATCH_SIZE = 10000
+
+# the dataset is partitioned into directories like site=x/devid=n/objtype=t
+partition_schema = pyarrow.schema(
+    [
+        ("site", pyarrow.string()),
+        ("devid", pyarrow.int64()),
+        ("objtype", pyarrow.string()),
+    ]
+)
+
+# the columns of the data files, the value is in the column for its kind
+# and the pickle is kept for values that do not have a simple type
+value_schema = pyarrow.schema(
+    [
+        ("objid", pyarrow.string()),
+        ("objinst", pyarrow.int64()),
+        ("propid", pyarrow.string()),
+        ("kind", pyarrow.string()),
+        ("value_bool", pyarrow.bool_()),
+        ("value_int", pyarrow.int64()),
+        ("value_real", pyarrow.float64()),
+        ("value_str", pyarrow.string()),
+        ("value_json", pyarrow.string()),
+        ("value_pickle", pyarrow.binary()),
+    ]
+)
+
+dataset_schema = pyarrow.schema(list(partition_schema) + list(value_schema))
+
+# kind of value and the column it is stored in
+kind_columns = {
+    "bool": "value_bool",
+    "int": "value_int",
+    "real": "value_real",
+    "str": "value_str",
+    "json": "value_json",
+}
+
+# limits of the value_int column
+INT64_MIN = -(1 << 63)
+INT64_MAX = (1 << 63) - 1
+
+
+def split_objid(objid):
+    """Split an object identifier like 'analogValue:1' into its type and
+    instance, the device properties have '-' for both."""
+    objtype, _, objinst = objid.partition(":")
+    try:
+        return objtype, int(objinst)
+    except ValueError:
+        return objtype, None
+
+
+def value_kind(value):
+    """Return the kind of the value."""
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, int) and (INT64_MIN <= value <= INT64_MAX):
+        return "int"
+    if isinstance(value, float):
+        return "real"
+    if isinstance(value, str):
+        return "str"
+    return "json"
+
+
+def record_batches(snapshot, site):
+    """Generate record batches from the rows of a snapshot."""
+    if _debug:
+        _log.debug("record_batches %r %r", snapshot, site)
+
+    columns = {field.name: [] for field in dataset_schema}
+
+    def batch():
+        record_batch = pyarrow.RecordBatch.from_arrays(
+            [
+                pyarrow.array(columns[field.name], type=field.type)
+                for field in dataset_schema
+            ],
+            schema=dataset_schema,
+        )
+        for column in columns.values():
+            del column[:]
+        return record_batch
+
+    for (devid, objid, propid, value) in snapshot.items():
+        objtype, objinst = split_objid(objid)
+        kind = value_kind(value)
+
+        columns["site"].append(site)
+        columns["devid"].append(int(devid))
+        columns["objtype"].append(objtype)
+        columns["objid"].append(objid)
+        columns["objinst"].append(objinst)
+        columns["propid"].append(propid)
+        columns["kind"].append(kind)
+        for value_kind_name, column_name in kind_columns.items():
+            if value_kind_name != kind:
+                columns[column_name].append(None)
+            elif kind == "json":
+                columns[column_name].append(encoder.encode(value_contents(value)))
+            else:
+                columns[column_name].append(value)
+        columns["value_pickle"].append(pickle.dumps(value) if kind == "json" else None)
+
+        if len(columns["devid"]) >= BATCH_SIZE:
+            yield batch()
+
+    if columns["devid"]:
+        yield batch()
+
+
+def export(snapshot, root, site):
+    """Write the contents of the snapshot into the dataset, replacing the
+    partitions of this site that are already there."""
+    if _debug:
+        _log.debug("export %r %r %r", snapshot, root, site)
+
+    pyarrow.dataset.write_dataset(
+        record_batches(snapshot, site),
+        root,
+        schema=dataset_schema,
+        format="parquet",
+        partitioning=pyarrow.dataset.partitioning(partition_schema, flavor="hive"),
+        basename_template="part-{i}.parquet",
+        existing_data_behavior="delete_matching",
+        max_partitions=1 << 20,
+    )
+
+
+#
+#   ColumnarSnapshot
+#
+
+
+@bacpypes_debugging
+class ColumnarSnapshot:
+    def __init__(self, root, site=None):
+        if _debug:
+            ColumnarSnapshot._debug("__init__ %r site=%r", root, site)
+
+        self.root = root
+        self.site = site
+
+        self.dataset = pyarrow.dataset.dataset(
+            root,
+            schema=dataset_schema,
+            format="parquet",
+            partitioning=pyarrow.dataset.partitioning(partition_schema, flavor="hive"),
+        )
+
+    def filter(self, devid=None, objid=None, propid=None):
+        """Return a filter expression for the scan with the same filters as
+        Snapshot.where(), the object type is included so only the matching
+        partitions are read."""
+        field = pyarrow.dataset.field
+        expressions = []
+
+        def any_range(name, ranges):
+            expression = None
+            for low, high in ranges:
+                term = (field(name) >= low) & (field(name) <= high)
+                expression = term if expression is None else (expression | term)
+            return expression
+
+        if self.site is not None:
+            expressions.append(field("site") == self.site)
+
+        if is_filter(devid, ",-"):
+            expressions.append(any_range("devid", parse_ranges(devid)))
+        elif devid is not None:
+            expressions.append(field("devid") == int(devid))
+
+        if is_objid_filter(objid):
+            objtype, instances = parse_objid(objid)
+            if objtype is not None:
+                expressions.append(field("objtype") == objtype)
+            if instances is not None:
+                expressions.append(any_range("objinst", instances))
+        elif objid is not None:
+            expressions.append(field("objtype") == split_objid(objid)[0])
+            expressions.append(field("objid") == objid)
+
+        if is_filter(propid, ",*"):
+            propids = [term.strip() for term in propid.split(",")]
+            if "*" not in propids:
+                expressions.append(field("propid").isin(propids))
+        elif propid is not None:
+            expressions.append(field("propid") == propid)
+
+        if not expressions:
+            return None
+
+        expression = expressions[0]
+        for next_expression in expressions[1:]:
+            expression = expression & next_expression
+        return expression
+
+    def scan(self, columns=None, filter=None, devid=None, objid=None, propid=None):
+        """Return a table of the matching rows for vectorized queries, the
+        filter is an additional dataset expression."""
+        if _debug:
+            ColumnarSnapshot._debug(
+                "scan %r %r %r %r %r", columns, filter, devid, objid, propid
+            )
+
+        expression = self.filter(devid, objid, propid)
+        if filter is not None:
+            expression = filter if expression is None else (expression & filter)
+
+        return self.dataset.to_table(columns=columns, filter=expression)
+
+    def __getitem__(self, item):
+        if _debug:
+            ColumnarSnapshot._debug("__getitem__ %r", item)
+
+        for row in self.items(*item):
+            return row[3]
+        return None
+
+    def named(self, devid, objid, name):
+        """Return the set of (devid, objid) that have an objectName that
+        matches the LIKE pattern."""
+        table = self.scan(
+            columns=["devid", "objid", "value_str"],
+            devid=devid,
+            objid=objid,
+            propid="objectName",
+        )
+        table = table.filter(
+            pyarrow.compute.match_like(table["value_str"], name, ignore_case=True)
+        )
+        return set(
+            zip(table.column("devid").to_pylist(), table.column("objid").to_pylist())
+        )
+
+    def items(self, devid=None, objid=None, propid=None, name=None):
+        if _debug:
+            ColumnarSnapshot._debug("items %r %r %r %r", devid, objid, propid, name)
+
+        expression = self.filter(devid, objid, propid)
+        if name is not None:
+            named = self.named(devid, objid, name)
+            objids = pyarrow.dataset.field("objid").isin(
+                sorted(set(named_objid for _, named_objid in named))
+            )
+            expression = objids if expression is None else (expression & objids)
+
+        scanner = self.dataset.scanner(
+            columns=["devid", "objid", "propid", "kind"]
+            + list(kind_columns.values())
+            + ["value_pickle"],
+            filter=expression,
+            batch_size=BATCH_SIZE,
+        )
+        for record_batch in scanner.to_batches():
+            columns = record_batch.to_pydict()
+            for i, kind in enumerate(columns["kind"]):
+                if (name is not None) and (
+                    (columns["devid"][i], columns["objid"][i]) not in named
+                ):
+                    continue
+                if kind == "json":
+                    value = pickle.loads(columns["value_pickle"][i])
+                else:
+                    value = columns[kind_columns[kind]][i]
+                yield (
+                    str(columns["devid"][i]),
+                    columns["objid"][i],
+                    columns["propid"][i],
+                    value,
+                )
+
+    def devices(self, devid=None):
+        if _debug:
+            ColumnarSnapshot._debug("devices %r", devid)
+
+        table = self.scan(columns=["devid"], devid=devid)
+        return sorted(set(str(devid) for devid in table.column("devid").to_pylist()))
+
+    def close(self):
+        if _debug:
+            ColumnarSnapshot._debug("close")
+
+
+#
+#   __main__
+#
+
+
+def main():
+    # parse the command line arguments
+    parser = ArgumentParser(description=__doc__)
+
+    parser.add_argument("dbname", help="database file name")
+    parser.add_argument("root", help="dataset directory")
+    parser.add_argument(
+        "--site", help="site name, default is the database file name",
+    )
+
+    args = parser.parse_args()
+
+    if _debug:
+        _log.debug("initialization")
+    if _debug:
+        _log.debug("    - args: %r", args)
+
+    site = args.site or os.path.splitext(os.path.basename(args.dbname))[0]
+
+    # the rows are read by the dataset writer thread
+    snapshot = Snapshot(args.dbname, check_same_thread=False)
+
+    _log.debug("running")
+
+    export(snapshot, args.root, site)
+
+    _log.debug("fini")
+
+    snapshot.close()
+
+
+if __name__ == "__main__":
+    main()
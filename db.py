@@ -1,21 +1,148 @@
+import json
+import queue
 import pickle
+import time
 import sqlite3
+import hashlib
+import threading
+
+from collections import OrderedDict, namedtuple
 
 from bacpypes.debugging import bacpypes_debugging, ModuleLogger
+from bacpypes.pdu import Address
+from bacpypes.app import DeviceInfo, DeviceInfoCache
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 # some debugging
 _debug = 0
 _log = ModuleLogger(globals())
 
+# the first bytes of a zstd frame, pickles start with b"\x80"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# rows rewritten at a time when the values are compressed or decompressed
+PACK_BATCH_SIZE = 10000
+
+# layouts, the values are in the snapshot rows or in the value_store table
+# and the rows have the hash of the pickled value
+ROWS_LAYOUT = "rows"
+DEDUP_LAYOUT = "dedup"
+
+# selecting the rows, the key is the same for the same stored value
+select_rows = {
+    ROWS_LAYOUT: "select devid, objid, propid, value as key, value from snapshot",
+    DEDUP_LAYOUT: "select devid, objid, propid, snapshot.value as key, value_store.value from snapshot join value_store on (value_store.hash = snapshot.value)",
+}
+
+# selecting the rows with the stored values
+select_raw = {
+    ROWS_LAYOUT: "select devid, objid, propid, value from snapshot",
+    DEDUP_LAYOUT: "select devid, objid, propid, value_store.value from snapshot join value_store on (value_store.hash = snapshot.value)",
+}
+
+# decoded values kept during a scan
+CACHE_SIZE = 100000
+
+# writes committed at a time by the writer thread
+WRITE_BATCH_SIZE = 1000
+
+# round trip time estimator gains and variation multiplier (RFC 6298)
+RTT_ALPHA = 0.125
+RTT_BETA = 0.25
+RTT_K = 4
+
+# limits of the APDU timeout derived from the round trip time (milliseconds),
+# the timeout doubles for each request that is not answered up to the limit
+MIN_APDU_TIMEOUT = 500
+MAX_APDU_TIMEOUT = 30000
+MAX_RTT_BACKOFF = 64
+
+# round trip time samples between saving the estimate of a device
+RTT_SAVE_INTERVAL = 32
+
+
+def value_hash(data):
+    """Return the hash of a pickled value."""
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def value_contents(value):
+    """Return a value as something JSON can encode."""
+    if hasattr(value, "dict_contents"):
+        try:
+            return value.dict_contents(as_class=OrderedDict)
+        except Exception as err:
+            return "!" + str(err)
+    elif isinstance(value, list):
+        return [value_contents(x) for x in value]
+    else:
+        return value
+
+
+def encode_default(value):
+    """Encode the things JSON does not know about, like addresses."""
+    if isinstance(value, (bytes, bytearray)):
+        return value.hex()
+    return str(value)
+
+
+# one encoder for all of the rows
+encoder = json.JSONEncoder(default=encode_default)
+
+
+def parse_ranges(spec):
+    """Parse a list of numbers and ranges like '1,5,10-20' into a list of
+    (low, high) tuples, a ValueError is raised if it is not valid."""
+    ranges = []
+    for term in spec.split(","):
+        low, dash, high = term.strip().partition("-")
+        if not low.isdigit() or (dash and not high.isdigit()):
+            raise ValueError("invalid range: %r" % (term,))
+        ranges.append((int(low), int(high) if dash else int(low)))
+    return ranges
+
+
+def is_filter(spec, special):
+    """Return true if the identifier is a filter with one of the special
+    characters rather than a value to match exactly."""
+    return isinstance(spec, str) and any(c in spec for c in special)
+
+
+def is_objid_filter(spec):
+    """Return true if the object identifier has a '*' or instance ranges."""
+    return is_filter(spec, "*") or (
+        is_filter(spec, ":") and is_filter(spec.partition(":")[2], ",-")
+    )
+
+
+def parse_objid(spec):
+    """Parse an object identifier filter like 'analogInput:*' or
+    'analogInput:1000-1999' into the object type (None for '*') and the
+    instance ranges (None for '*')."""
+    objtype, colon, instances = spec.partition(":")
+    if not colon:
+        instances = "*"
+    if objtype == "*":
+        objtype = None
+    if instances == "*":
+        return objtype, None
+    return objtype, parse_ranges(instances)
+
 
 @bacpypes_debugging
 class Snapshot:
-    def __init__(self, filename):
+    def __init__(self, filename, check_same_thread=True):
         if _debug:
             Snapshot._debug("__init__ %r", filename)
 
         # make a connection, get a cursor
-        self.connection = sqlite3.connect(filename)
+        self.connection = sqlite3.connect(
+            filename, check_same_thread=check_same_thread
+        )
         self.cursor = self.connection.cursor()
 
         # make sure the table exists
@@ -23,66 +150,553 @@ class Snapshot:
             "create table if not exists snapshot(devid text, objid text, propid text, value, primary key (devid, objid, propid))"
         )
 
+        # indexes for the device ranges, object types and properties
+        self.cursor.execute(
+            "create index if not exists snapshot_devnum on snapshot(cast(devid as integer))"
+        )
+        self.cursor.execute(
+            "create index if not exists snapshot_objid on snapshot(objid, propid)"
+        )
+        self.cursor.execute(
+            "create index if not exists snapshot_propid on snapshot(propid)"
+        )
+
+        # compression dictionaries and other settings
+        self.cursor.execute(
+            "create table if not exists metadata(key text primary key, value)"
+        )
+        self.load_dictionaries()
+
+        # the hash of a stored value, for changing layouts and loading
+        self.connection.create_function(
+            "value_hash",
+            1,
+            lambda data: value_hash(self.unpack(data)),
+            deterministic=True,
+        )
+        self.layout = self.get_metadata("layout", ROWS_LAYOUT)
+        if self.layout == DEDUP_LAYOUT:
+            self.create_value_store()
+
+        # object names for LIKE patterns, filled in from existing snapshots
+        self.cursor.execute(
+            "create table if not exists objectname(devid text, objid text, name text collate nocase, primary key (devid, objid))"
+        )
+        self.cursor.execute(
+            "create index if not exists objectname_name on objectname(name)"
+        )
+        self.cursor.execute("select count(*) from objectname")
+        if not self.cursor.fetchone()[0]:
+            self.update_names()
+        self.connection.commit()
+
+    def get_metadata(self, key, default=None):
+        self.cursor.execute("select value from metadata where key = ?", (key,))
+        row = self.cursor.fetchone()
+        return row[0] if row else default
+
+    def set_metadata(self, key, value):
+        if value is None:
+            self.cursor.execute("delete from metadata where key = ?", (key,))
+        else:
+            self.cursor.execute(
+                "insert or replace into metadata values (?, ?)", (key, value)
+            )
+
+    def load_dictionaries(self):
+        """Load the compression dictionaries, there can be more than one when
+        snapshots have been merged, and the compressor for new values."""
+        if _debug:
+            Snapshot._debug("load_dictionaries")
+
+        self.decompressors = {}
+        self.compressor = None
+
+        self.cursor.execute(
+            "select key, value from metadata where key like 'dictionary:%'"
+        )
+        dictionaries = self.cursor.fetchall()
+        if not dictionaries:
+            return
+        if zstandard is None:
+            raise RuntimeError("compressed snapshot, zstandard is required")
+
+        for key, data in dictionaries:
+            dict_id = int(key.partition(":")[2])
+            self.decompressors[dict_id] = zstandard.ZstdDecompressor(
+                dict_data=zstandard.ZstdCompressionDict(data)
+            )
+
+        dict_id = self.get_metadata("compression")
+        if dict_id is not None:
+            self.compressor = zstandard.ZstdCompressor(
+                level=self.get_metadata("compression_level", 3),
+                dict_data=zstandard.ZstdCompressionDict(
+                    self.get_metadata("dictionary:%d" % (dict_id,))
+                ),
+                write_checksum=False,
+            )
+
+    def create_value_store(self):
+        self.cursor.execute(
+            "create table if not exists value_store(hash blob primary key, value)"
+        )
+
+    def set_layout(self, layout):
+        """Change the layout of the snapshot, with the dedup layout each
+        distinct value is stored once in the value_store table."""
+        if _debug:
+            Snapshot._debug("set_layout %r", layout)
+
+        if layout == self.layout:
+            return
+        if layout == DEDUP_LAYOUT:
+            self.create_value_store()
+            self.cursor.execute(
+                "insert or ignore into value_store select value_hash(value), value from snapshot"
+            )
+            self.cursor.execute("update snapshot set value = value_hash(value)")
+        elif layout == ROWS_LAYOUT:
+            self.cursor.execute(
+                "update snapshot set value = (select value_store.value from value_store where value_store.hash = snapshot.value)"
+            )
+            self.cursor.execute("drop table value_store")
+        else:
+            raise ValueError("unknown layout: %r" % (layout,))
+
+        self.set_metadata("layout", layout)
+        self.connection.commit()
+        self.layout = layout
+
+    def prune(self):
+        """Remove the values that are no longer referenced by a row."""
+        if _debug:
+            Snapshot._debug("prune")
+
+        if self.layout == DEDUP_LAYOUT:
+            self.cursor.execute(
+                "delete from value_store where hash not in (select value from snapshot)"
+            )
+            self.connection.commit()
+
+    def store(self, value):
+        """Store a value and return what goes in the row."""
+        data = pickle.dumps(value)
+        if self.layout == DEDUP_LAYOUT:
+            key = value_hash(data)
+            self.cursor.execute(
+                "insert or ignore into value_store values (?, ?)",
+                (key, self.pack(data)),
+            )
+            return key
+        return self.pack(data)
+
+    def pack(self, data):
+        """Compress a pickled value when there is a dictionary and it is
+        smaller."""
+        if self.compressor:
+            compressed = self.compressor.compress(data)
+            if len(compressed) < len(data):
+                return compressed
+        return data
+
+    def unpack(self, data):
+        """Return the pickled value, decompressed with the dictionary it was
+        compressed with."""
+        if data[:4] == ZSTD_MAGIC:
+            dict_id = zstandard.get_frame_parameters(data).dict_id
+            return self.decompressors[dict_id].decompress(data)
+        return data
+
+    def loads(self, data):
+        return pickle.loads(self.unpack(data))
+
+    def repack(self):
+        """Rewrite all of the values with the current compressor."""
+        if _debug:
+            Snapshot._debug("repack")
+
+        table = "value_store" if self.layout == DEDUP_LAYOUT else "snapshot"
+
+        rowid = -1
+        while True:
+            self.cursor.execute(
+                "select rowid, value from "
+                + table
+                + " where rowid > ? order by rowid limit ?",
+                (rowid, PACK_BATCH_SIZE),
+            )
+            rows = self.cursor.fetchall()
+            if not rows:
+                break
+            self.cursor.executemany(
+                "update " + table + " set value = ? where rowid = ?",
+                [(self.pack(self.unpack(data)), rowid) for rowid, data in rows],
+            )
+            rowid = rows[-1][0]
+        self.connection.commit()
+
+    def compress(self, dict_size=16384, sample_count=100000, level=3):
+        """Train a dictionary on a sample of the values in the snapshot and
+        compress all of the values with it."""
+        if _debug:
+            Snapshot._debug("compress %r %r %r", dict_size, sample_count, level)
+        if zstandard is None:
+            raise RuntimeError("zstandard is required")
+
+        table = "value_store" if self.layout == DEDUP_LAYOUT else "snapshot"
+        self.cursor.execute(
+            "select value from " + table + " order by random() limit ?",
+            (sample_count,),
+        )
+        samples = [self.unpack(row[0]) for row in self.cursor.fetchall()]
+        dictionary = zstandard.train_dictionary(dict_size, samples, level=level)
+
+        dict_id = dictionary.dict_id()
+        self.set_metadata("dictionary:%d" % (dict_id,), dictionary.as_bytes())
+        self.set_metadata("compression", dict_id)
+        self.set_metadata("compression_level", level)
+        self.load_dictionaries()
+
+        self.repack()
+
+    def decompress(self):
+        """Decompress all of the values, the dictionaries are removed."""
+        if _debug:
+            Snapshot._debug("decompress")
+
+        self.compressor = None
+        self.repack()
+
+        self.cursor.execute("delete from metadata where key like 'dictionary:%'")
+        self.set_metadata("compression", None)
+        self.set_metadata("compression_level", None)
+        self.connection.commit()
+        self.load_dictionaries()
+
+    def update_names(self):
+        """Rebuild the object names from the objectName properties."""
+        if _debug:
+            Snapshot._debug("update_names")
+
+        self.cursor.execute("delete from objectname")
+        self.cursor.execute(
+            select_rows[self.layout] + " where propid = 'objectName'"
+        )
+        self.cursor.executemany(
+            "insert or replace into objectname values (?, ?, ?)",
+            [
+                (devid, objid, str(self.loads(value)))
+                for devid, objid, _, _, value in self.cursor.fetchall()
+            ],
+        )
+        self.connection.commit()
+
+    def load(self, filename, devid=None, replace=True):
+        """Copy the rows of another snapshot database into this one with a
+        set based INSERT ... SELECT, optionally limited to the devices that
+        match the device identifier filter.  When the rows are already in
+        this snapshot they are replaced or, if replace is false, kept.  The
+        snapshots do not need to have the same layout.  Returns the number
+        of rows copied."""
+        if _debug:
+            Snapshot._debug("load %r %r replace=%r", filename, devid, replace)
+
+        where_str, query_args = self.where(devid)
+
+        self.connection.commit()
+        self.cursor.execute("attach database ? as source", (filename,))
+        try:
+            # the values may be compressed with the dictionaries of the source
+            source_layout = ROWS_LAYOUT
+            self.cursor.execute(
+                "select count(*) from source.sqlite_master where name = 'metadata'"
+            )
+            if self.cursor.fetchone()[0]:
+                self.cursor.execute(
+                    "insert or ignore into main.metadata select key, value"
+                    " from source.metadata where key like 'dictionary:%'"
+                )
+                self.cursor.execute(
+                    "select value from source.metadata where key = 'layout'"
+                )
+                row = self.cursor.fetchone()
+                if row:
+                    source_layout = row[0]
+            self.load_dictionaries()
+
+            # the rows of the source with the stored values
+            if source_layout == DEDUP_LAYOUT:
+                source_str = (
+                    "select s.devid, s.objid, s.propid, v.value from source.snapshot"
+                    " as s join source.value_store as v on (v.hash = s.value)"
+                )
+            else:
+                source_str = (
+                    "select devid, objid, propid, value from source.snapshot"
+                )
+            source_str += where_str
+
+            insert_str = "insert or " + ("replace" if replace else "ignore")
+            if self.layout == DEDUP_LAYOUT:
+                self.cursor.execute(
+                    "insert or ignore into main.value_store"
+                    " select value_hash(value), value from (" + source_str + ")",
+                    query_args,
+                )
+                self.cursor.execute(
+                    insert_str
+                    + " into main.snapshot select devid, objid, propid,"
+                    + " value_hash(value) from ("
+                    + source_str
+                    + ")",
+                    query_args,
+                )
+            else:
+                self.cursor.execute(
+                    insert_str + " into main.snapshot " + source_str, query_args
+                )
+            row_count = self.cursor.rowcount
+
+            # the device registry of the source goes along
+            self.cursor.execute(
+                "select count(*) from source.sqlite_master where name = 'device'"
+            )
+            if self.cursor.fetchone()[0]:
+                DeviceRegistry.create_table(self.cursor)
+
+                # older sources do not have all of the columns
+                columns = ", ".join(
+                    DeviceRegistry.table_columns(self.cursor, "source")
+                )
+                self.cursor.execute(
+                    insert_str
+                    + " into main.device ("
+                    + columns
+                    + ") select "
+                    + columns
+                    + " from source.device"
+                    + where_str,
+                    query_args,
+                )
+
+            # and so do the routes it found
+            self.cursor.execute(
+                "select count(*) from source.sqlite_master where name = 'route'"
+            )
+            if self.cursor.fetchone()[0]:
+                NetworkTopology.create_table(self.cursor)
+                self.cursor.execute(
+                    insert_str + " into main.route select * from source.route"
+                )
+            self.connection.commit()
+        finally:
+            self.cursor.execute("detach database source")
+
+        return row_count
+
     def __getitem__(self, item):
         if _debug:
             Snapshot._debug("__getitem__ %r", item)
 
         self.cursor.execute(
-            "select value from snapshot where (devid = ?) and (objid = ?) and (propid = ?)",
+            select_rows[self.layout]
+            + " where (devid = ?) and (objid = ?) and (propid = ?)",
             item,
         )
         row = self.cursor.fetchone()
         if not row:
             return None
 
-        return pickle.loads(row[0])
+        return self.loads(row[4])
 
     def __setitem__(self, item, value):
         if _debug:
             Snapshot._debug("__setitem__ %r %r", item, value)
 
+        self.write(item, value)
+        self.connection.commit()
+
+    def update(self, rows):
+        """Write a batch of (item, value) rows and commit them together."""
+        if _debug:
+            Snapshot._debug("update %r", rows)
+
+        for item, value in rows:
+            self.write(item, value)
+        self.connection.commit()
+
+    def write(self, item, value):
+        """Write a value without committing it."""
+        data = self.store(value)
         try:
             self.cursor.execute(
                 "insert into snapshot values (?, ?, ?, ?)",
-                item + (pickle.dumps(value),),
+                item + (data,),
             )
-            self.connection.commit()
         except sqlite3.IntegrityError:
             self.cursor.execute(
                 "update snapshot set value = ? where (devid = ?) and (objid = ?) and (propid = ?)",
-                (pickle.dumps(value),) + item,
+                (data,) + item,
+            )
+        if item[2] == "objectName":
+            self.cursor.execute(
+                "insert or replace into objectname values (?, ?, ?)",
+                item[:2] + (str(value),),
             )
-            self.connection.commit()
 
-    def items(self, devid=None, objid=None, propid=None):
+    def execute(self, sql, rows):
+        """Run a statement for each of a list of parameter rows and commit
+        them together, for the tables other than the snapshot rows."""
         if _debug:
-            Snapshot._debug("items %r %r %r", devid, objid, propid)
+            Snapshot._debug("execute %r %r", sql, len(rows))
+
+        self.cursor.executemany(sql, rows)
+        self.connection.commit()
+
+    def flush(self):
+        """The writes are committed when they are made."""
 
-        query_str = "select devid, objid, propid, value from snapshot"
-        query_vars = []
+    def where(self, devid=None, objid=None, propid=None, name=None):
+        """Return the where clause and its arguments for the filters.  The
+        device identifier may be a list of identifiers and ranges like
+        '2000-2099,3000', the object identifier may have a '*' for the type
+        or instance or instance ranges like 'analogInput:1000-1999', the
+        property identifier may be a list and the name is a LIKE pattern
+        for the objectName.  A ValueError is raised for an invalid filter."""
+        query_terms = []
         query_args = []
 
-        if devid is not None:
-            query_vars.append("devid")
+        if is_filter(devid, ",-"):
+            terms = []
+            for low, high in parse_ranges(devid):
+                if low == high:
+                    terms.append("(devid = ?)")
+                    query_args.append(str(low))
+                else:
+                    terms.append("(cast(devid as integer) between ? and ?)")
+                    query_args.extend((low, high))
+            query_terms.append("(" + " or ".join(terms) + ")")
+        elif devid is not None:
+            query_terms.append("(devid = ?)")
             query_args.append(devid)
 
-        if objid is not None:
-            query_vars.append("objid")
+        if is_objid_filter(objid):
+            objtype, instances = parse_objid(objid)
+            if objtype is not None:
+                # a range of the index, ';' is the character after ':'
+                query_terms.append("(objid >= ?) and (objid < ?)")
+                query_args.extend((objtype + ":", objtype + ";"))
+            else:
+                query_terms.append("(instr(objid, ':') > 0)")
+            if instances is not None:
+                terms = []
+                for low, high in instances:
+                    if (objtype is not None) and (low == high):
+                        terms.append("(objid = ?)")
+                        query_args.append("%s:%d" % (objtype, low))
+                    else:
+                        terms.append(
+                            "(cast(substr(objid, instr(objid, ':') + 1) as integer) between ? and ?)"
+                        )
+                        query_args.extend((low, high))
+                query_terms.append("(" + " or ".join(terms) + ")")
+        elif objid is not None:
+            query_terms.append("(objid = ?)")
             query_args.append(objid)
 
-        if propid is not None:
-            query_vars.append("propid")
+        if is_filter(propid, ",*"):
+            propids = [term.strip() for term in propid.split(",")]
+            if "*" not in propids:
+                query_terms.append(
+                    "(propid in (" + ", ".join("?" for _ in propids) + "))"
+                )
+                query_args.extend(propids)
+        elif propid is not None:
+            query_terms.append("(propid = ?)")
             query_args.append(propid)
 
-        if query_vars:
-            query_str += " where " + " and ".join(
-                "(" + var_name + " = ?)" for var_name in query_vars
+        if name is not None:
+            query_terms.append(
+                "((devid, objid) in (select devid, objid from objectname where name like ?))"
             )
+            query_args.append(name)
 
-        self.cursor.execute(query_str, tuple(query_args))
-        for row in self.cursor.fetchall():
-            value = pickle.loads(row[3])
-            yield row[:3] + (value,)
+        if not query_terms:
+            return "", ()
+
+        return " where " + " and ".join(query_terms), tuple(query_args)
+
+    def items(self, devid=None, objid=None, propid=None, name=None, cache=True):
+        """Generate the rows with the decoded values, sorted by device,
+        object and property identifier like raw_items().  With the cache the
+        same stored value is only decoded once and the rows share the
+        decoded value, so the values must not be changed."""
+        if _debug:
+            Snapshot._debug(
+                "items %r %r %r %r cache=%r", devid, objid, propid, name, cache
+            )
+
+        where_str, query_args = self.where(devid, objid, propid, name)
+        query_str = (
+            select_rows[self.layout] + where_str + " order by devid, objid, propid"
+        )
+        if _debug:
+            Snapshot._debug("    - query_str: %r", query_str)
+
+        # a cursor of its own so the rows are streamed
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(query_str, query_args)
+            if not cache:
+                for row in cursor:
+                    yield row[:3] + (self.loads(row[4]),)
+                return
+
+            decoded = {}
+            for row in cursor:
+                value = decoded.get(row[3], decoded)
+                if value is decoded:
+                    if len(decoded) >= CACHE_SIZE:
+                        decoded.clear()
+                    value = decoded[row[3]] = self.loads(row[4])
+                yield row[:3] + (value,)
+        finally:
+            cursor.close()
+
+    def raw_items(self, devid=None, objid=None, propid=None, name=None):
+        """Generate the rows with the values as they are stored, pickled and
+        maybe compressed (see loads()), sorted by device, object and
+        property identifier."""
+        if _debug:
+            Snapshot._debug("raw_items %r %r %r %r", devid, objid, propid, name)
+
+        where_str, query_args = self.where(devid, objid, propid, name)
+        query_str = (
+            select_raw[self.layout] + where_str + " order by devid, objid, propid"
+        )
+
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(query_str, query_args)
+            yield from cursor
+        finally:
+            cursor.close()
+
+    def devices(self, devid=None):
+        if _debug:
+            Snapshot._debug("devices %r", devid)
+
+        where_str, query_args = self.where(devid)
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(
+                "select distinct devid from snapshot" + where_str + " order by devid",
+                query_args,
+            )
+            return [row[0] for row in cursor]
+        finally:
+            cursor.close()
 
     def close(self):
         if _debug:
@@ -90,3 +704,864 @@ class Snapshot:
 
         self.cursor.close()
         self.connection.close()
+
+
+#
+#   ThreadedSnapshot
+#
+
+# a statement and its parameter rows queued for the writer thread
+Statement = namedtuple("Statement", ("sql", "rows"))
+
+
+@bacpypes_debugging
+class ThreadedSnapshot(Snapshot):
+    """A snapshot where the writes are queued for a writer thread with its
+    own connection that commits them in batches, so the caller never waits
+    for the disk.  Values that have been written but not committed are read
+    from the pending writes, flush() waits for the writes to be committed
+    and close() waits for the writer thread to finish."""
+
+    def __init__(self, filename, batch_size=WRITE_BATCH_SIZE):
+        if _debug:
+            ThreadedSnapshot._debug("__init__ %r", filename)
+        Snapshot.__init__(self, filename)
+
+        # readers are not blocked by the writer
+        self.cursor.execute("pragma journal_mode=wal")
+        self.cursor.fetchall()
+
+        self.batch_size = batch_size
+
+        # writes that have not been committed, item: (sequence, value)
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        self.sequence = 0
+
+        # writes, flush events and None to stop
+        self.queue = queue.Queue()
+        self.error = None
+
+        self.writer = threading.Thread(
+            target=self.write_loop, args=(filename,), name="snapshot-writer"
+        )
+        self.writer.daemon = True
+        self.writer.start()
+
+    @staticmethod
+    def key(item):
+        # device identifiers are stored as text
+        return (str(item[0]),) + tuple(item[1:])
+
+    def __getitem__(self, item):
+        if _debug:
+            ThreadedSnapshot._debug("__getitem__ %r", item)
+
+        with self.pending_lock:
+            pending = self.pending.get(self.key(item))
+        if pending:
+            return pending[1]
+
+        return Snapshot.__getitem__(self, item)
+
+    def __setitem__(self, item, value):
+        if _debug:
+            ThreadedSnapshot._debug("__setitem__ %r %r", item, value)
+        if self.error:
+            raise self.error
+
+        item = self.key(item)
+        with self.pending_lock:
+            self.sequence += 1
+            self.pending[item] = (self.sequence, value)
+            self.queue.put((item, self.sequence, value))
+
+    def update(self, rows):
+        if _debug:
+            ThreadedSnapshot._debug("update %r", rows)
+        if self.error:
+            raise self.error
+
+        with self.pending_lock:
+            for item, value in rows:
+                item = self.key(item)
+                self.sequence += 1
+                self.pending[item] = (self.sequence, value)
+                self.queue.put((item, self.sequence, value))
+
+    def execute(self, sql, rows):
+        """Queue a statement for the writer thread, it is committed with the
+        next batch of writes."""
+        if _debug:
+            ThreadedSnapshot._debug("execute %r %r", sql, len(rows))
+        if self.error:
+            raise self.error
+
+        self.queue.put(Statement(sql, list(rows)))
+
+    def items(self, *args, **kwargs):
+        self.flush()
+        return Snapshot.items(self, *args, **kwargs)
+
+    def raw_items(self, *args, **kwargs):
+        self.flush()
+        return Snapshot.raw_items(self, *args, **kwargs)
+
+    def flush(self):
+        """Wait for the pending writes to be committed."""
+        if _debug:
+            ThreadedSnapshot._debug("flush")
+
+        event = threading.Event()
+        self.queue.put(event)
+        event.wait()
+
+        if self.error:
+            raise self.error
+
+    def write_loop(self, filename):
+        """Commit the writes in batches until there is a None in the queue,
+        after an error the writes are dropped."""
+        if _debug:
+            ThreadedSnapshot._debug("write_loop %r", filename)
+
+        try:
+            snapshot = Snapshot(filename)
+        except Exception as err:
+            ThreadedSnapshot._exception("open error: %r", err)
+            snapshot = None
+            self.error = err
+
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            events = []
+            written = []
+            executed = False
+            for op in batch:
+                if op is None:
+                    running = False
+                elif isinstance(op, threading.Event):
+                    events.append(op)
+                elif self.error:
+                    pass
+                elif isinstance(op, Statement):
+                    try:
+                        snapshot.cursor.executemany(op.sql, op.rows)
+                        executed = True
+                    except Exception as err:
+                        ThreadedSnapshot._exception("execute error: %r", err)
+                        self.error = err
+                else:
+                    item, sequence, value = op
+                    try:
+                        snapshot.write(item, value)
+                        written.append((item, sequence))
+                    except Exception as err:
+                        ThreadedSnapshot._exception("write error: %r", err)
+                        self.error = err
+
+            if self.error:
+                if snapshot:
+                    snapshot.connection.rollback()
+                del written[:]
+            elif written or executed:
+                snapshot.connection.commit()
+
+            # the committed values are read from the database
+            with self.pending_lock:
+                for item, sequence in written:
+                    if self.pending.get(item, (None,))[0] == sequence:
+                        del self.pending[item]
+
+            for event in events:
+                event.set()
+
+        if snapshot:
+            snapshot.close()
+
+    def close(self):
+        if _debug:
+            ThreadedSnapshot._debug("close")
+
+        self.queue.put(None)
+        self.writer.join()
+
+        Snapshot.close(self)
+        if self.error:
+            raise self.error
+
+
+#
+#   RegisteredDevice
+#
+
+
+class RegisteredDevice(DeviceInfo):
+    """Device information that is kept in the registry, the same records are
+    in the device information cache of an application."""
+
+    _debug_contents = DeviceInfo._debug_contents + (
+        "rpm",
+        "lastSeen",
+        "srtt",
+        "rttvar",
+        "rttBackoff",
+    )
+
+    def __init__(self, device_identifier, address):
+        DeviceInfo.__init__(self, device_identifier, address)
+
+        # None until the services supported have been read
+        self.rpm = None
+        self.lastSeen = None
+
+        # smoothed round trip time and its variation in seconds, None until
+        # the first sample, and the timeout multiplier after no response
+        self.srtt = None
+        self.rttvar = None
+        self.rttBackoff = 1
+        self.rttSamples = 0
+
+    def round_trip(self, rtt):
+        """Update the estimate with a new round trip time sample."""
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2.0
+        else:
+            self.rttvar = (1 - RTT_BETA) * self.rttvar + RTT_BETA * abs(
+                self.srtt - rtt
+            )
+            self.srtt = (1 - RTT_ALPHA) * self.srtt + RTT_ALPHA * rtt
+
+        # an answer ends the back off
+        self.rttBackoff = 1
+        self.rttSamples += 1
+
+    def apdu_timing(self, apdu_timeout, retries):
+        """Return the APDU timeout (in milliseconds) and the number of
+        retries for a request to this device given the configured values.
+        The number of retries is reduced for slow devices so the total time
+        waiting for a device that does not answer stays about the same."""
+        if self.srtt is None:
+            return apdu_timeout, retries
+
+        timeout = (self.srtt + RTT_K * self.rttvar) * 1000.0 * self.rttBackoff
+        timeout = int(min(max(timeout, MIN_APDU_TIMEOUT), MAX_APDU_TIMEOUT))
+
+        budget = apdu_timeout * (retries + 1)
+        retries = max(0, min(retries, budget // timeout - 1))
+
+        return timeout, retries
+
+
+#
+#   RegistryDeviceInfoCache
+#
+
+
+@bacpypes_debugging
+class RegistryDeviceInfoCache(DeviceInfoCache):
+    """The segmentation state machines acquire the record they found rather
+    than looking it up by its key, which the base class does not accept."""
+
+    def acquire(self, key):
+        if _debug:
+            RegistryDeviceInfoCache._debug("acquire %r", key)
+
+        if isinstance(key, DeviceInfo):
+            key._ref_count += 1
+            return key
+
+        return DeviceInfoCache.acquire(self, key)
+
+
+#
+#   DeviceRegistry
+#
+
+
+@bacpypes_debugging
+class DeviceRegistry:
+    """The address and capabilities of the devices, loaded from the device
+    table of a snapshot database and updated as devices are found, so they
+    do not have to be read from the snapshot rows for each request or
+    probed again the next time."""
+
+    # record attribute and column
+    columns = (
+        ("address", "address"),
+        ("maxApduLengthAccepted", "max_apdu"),
+        ("segmentationSupported", "segmentation"),
+        ("maxSegmentsAccepted", "max_segments"),
+        ("vendorID", "vendor_id"),
+        ("rpm", "rpm"),
+        ("lastSeen", "last_seen"),
+        ("srtt", "srtt"),
+        ("rttvar", "rttvar"),
+    )
+
+    def __init__(self, snapshot):
+        if _debug:
+            DeviceRegistry._debug("__init__ %r", snapshot)
+
+        self.snapshot = snapshot
+        self.cursor = snapshot.connection.cursor()
+        self.create_table(self.cursor)
+
+        # device identifier: RegisteredDevice
+        self.devices = {}
+
+        # the cache that is kept up to date, see seed()
+        self.device_info_cache = None
+
+        # devices with round trip time samples that have not been saved
+        self.unsaved = set()
+
+        self.cursor.execute(
+            "select devid, "
+            + ", ".join(column for _, column in self.columns)
+            + " from device"
+        )
+        for row in self.cursor.fetchall():
+            device_info = RegisteredDevice(int(row[0]), None)
+            for (attr, _), value in zip(self.columns, row[1:]):
+                setattr(device_info, attr, value)
+            if device_info.address is not None:
+                device_info.address = Address(device_info.address)
+            if device_info.rpm is not None:
+                device_info.rpm = bool(device_info.rpm)
+            self.devices[device_info.deviceIdentifier] = device_info
+
+        # databases from before the registry have the device rows
+        if not self.devices:
+            self.load_snapshot()
+
+    @staticmethod
+    def create_table(cursor, schema="main"):
+        cursor.execute(
+            "create table if not exists "
+            + schema
+            + ".device(devid text primary key, address text, max_apdu integer, segmentation text, max_segments integer, vendor_id integer, rpm integer, last_seen real, srtt real, rttvar real)"
+        )
+
+        # tables from before the round trip times
+        table_columns = DeviceRegistry.table_columns(cursor, schema)
+        for column in ("srtt", "rttvar"):
+            if column not in table_columns:
+                cursor.execute(
+                    "alter table " + schema + ".device add column " + column + " real"
+                )
+
+    @staticmethod
+    def table_columns(cursor, schema="main"):
+        """Return the list of the columns of a device table."""
+        cursor.execute("pragma " + schema + ".table_info(device)")
+        return [row[1] for row in cursor.fetchall()]
+
+    def load_snapshot(self):
+        """Fill in the registry from the address and capability rows."""
+        if _debug:
+            DeviceRegistry._debug("load_snapshot")
+
+        for devid, _, propid, value in self.snapshot.items(
+            None, "-", "address,maxAPDULengthAccepted,segmentationSupported"
+        ):
+            if propid == "address":
+                self.update(int(devid), address=value)
+            elif propid == "maxAPDULengthAccepted":
+                self.update(int(devid), maxApduLengthAccepted=value)
+            elif propid == "segmentationSupported":
+                self.update(int(devid), segmentationSupported=value)
+
+    def __contains__(self, devid):
+        return int(devid) in self.devices
+
+    def __iter__(self):
+        return iter(self.devices.values())
+
+    def get(self, devid):
+        """Return the RegisteredDevice or None."""
+        return self.devices.get(int(devid))
+
+    def address(self, devid):
+        """Return the address of the device or None."""
+        device_info = self.devices.get(int(devid))
+        return device_info.address if device_info else None
+
+    def supports_rpm(self, devid):
+        """Return true or false if it is known that the device supports
+        Read-Property-Multiple, None if it is not known."""
+        device_info = self.devices.get(int(devid))
+        return device_info.rpm if device_info else None
+
+    def update(self, devid, **kwargs):
+        """Update the attributes of a device, like address=..., and save the
+        record."""
+        if _debug:
+            DeviceRegistry._debug("update %r %r", devid, kwargs)
+
+        devid = int(devid)
+        device_info = self.devices.get(devid)
+        if not device_info:
+            device_info = self.devices[devid] = RegisteredDevice(devid, None)
+
+        for attr, value in kwargs.items():
+            setattr(device_info, attr, value)
+
+        # keep the cache keys up to date
+        if self.device_info_cache is not None:
+            self.cache(self.device_info_cache, device_info)
+
+        self.save(device_info)
+
+        return device_info
+
+    def save(self, device_info):
+        """Save the record of a device."""
+        if _debug:
+            DeviceRegistry._debug("save %r", device_info)
+
+        row = [str(device_info.deviceIdentifier)]
+        for attr, _ in self.columns:
+            value = getattr(device_info, attr)
+            if (attr == "address") and (value is not None):
+                value = str(value)
+            row.append(value)
+
+        self.unsaved.discard(device_info.deviceIdentifier)
+
+        # a threaded snapshot commits it in the writer thread
+        self.snapshot.execute(
+            "insert or replace into device ("
+            + ", ".join(["devid"] + [column for _, column in self.columns])
+            + ") values ("
+            + ", ".join("?" * len(row))
+            + ")",
+            [row],
+        )
+
+    def round_trip(self, devid, rtt):
+        """Update the round trip time estimate of a device with a sample in
+        seconds, the estimate is saved every so often (see close())."""
+        if _debug:
+            DeviceRegistry._debug("round_trip %r %r", devid, rtt)
+
+        device_info = self.devices.get(int(devid))
+        if not device_info:
+            return
+
+        device_info.round_trip(rtt)
+        if device_info.rttSamples % RTT_SAVE_INTERVAL == 1:
+            self.save(device_info)
+        else:
+            self.unsaved.add(device_info.deviceIdentifier)
+
+    def no_response(self, devid):
+        """A request to the device was not answered, double the timeout of
+        the next ones until there is an answer."""
+        if _debug:
+            DeviceRegistry._debug("no_response %r", devid)
+
+        device_info = self.devices.get(int(devid))
+        if not device_info:
+            return
+
+        device_info.rttBackoff = min(device_info.rttBackoff * 2, MAX_RTT_BACKOFF)
+
+    def apdu_timing(self, devid, apdu_timeout, retries):
+        """Return the APDU timeout and retries for a request to a device."""
+        device_info = self.devices.get(int(devid))
+        if not device_info:
+            return apdu_timeout, retries
+        return device_info.apdu_timing(apdu_timeout, retries)
+
+    def close(self):
+        """Save the round trip time estimates that changed since they were
+        last saved."""
+        if _debug:
+            DeviceRegistry._debug("close")
+
+        for devid in list(self.unsaved):
+            self.save(self.devices[devid])
+
+    def cache(self, device_info_cache, device_info):
+        """Put a record in a device information cache by its identifier and
+        address."""
+        cache = device_info_cache.cache
+
+        # remove the old keys
+        for key in getattr(device_info, "_cache_keys", ()):
+            if cache.get(key) is device_info:
+                del cache[key]
+
+        cache[device_info.deviceIdentifier] = device_info
+        if device_info.address is not None:
+            cache[device_info.address] = device_info
+        device_info._cache_keys = (device_info.deviceIdentifier, device_info.address)
+        if not hasattr(device_info, "_ref_count"):
+            device_info._ref_count = 0
+
+    def seed(self, device_info_cache):
+        """Put the records in the device information cache of an application
+        and keep them up to date, so the segmentation state machines know
+        the capabilities of the devices without asking again.  The cache
+        should be a RegistryDeviceInfoCache."""
+        if _debug:
+            DeviceRegistry._debug("seed %r", device_info_cache)
+
+        self.device_info_cache = device_info_cache
+        for device_info in self.devices.values():
+            self.cache(device_info_cache, device_info)
+
+
+#
+#   NetworkTopology
+#
+
+
+@bacpypes_debugging
+class NetworkTopology:
+    """The routers and the networks they can reach, from the
+    I-Am-Router-To-Network messages and routing tables found during
+    discovery, kept in the route table of a snapshot database.  The routes
+    are also kept in memory so they can be read before a threaded snapshot
+    has committed them."""
+
+    def __init__(self, snapshot):
+        if _debug:
+            NetworkTopology._debug("__init__ %r", snapshot)
+
+        self.snapshot = snapshot
+        self.cursor = snapshot.connection.cursor()
+        self.create_table(self.cursor)
+
+        # (router, net): (port_id, port_info)
+        self.cursor.execute("select router, net, port_id, port_info from route")
+        self.table = {tuple(row[:2]): tuple(row[2:]) for row in self.cursor.fetchall()}
+
+    @staticmethod
+    def create_table(cursor):
+        cursor.execute(
+            "create table if not exists route(router text, net integer, port_id integer, port_info blob, last_seen real, primary key (router, net))"
+        )
+
+    def add_routes(self, router, networks):
+        """The router can reach the networks."""
+        if _debug:
+            NetworkTopology._debug("add_routes %r %r", router, networks)
+
+        router = str(router)
+        for net in networks:
+            self.table.setdefault((router, net), (None, None))
+
+        now = time.time()
+        self.snapshot.execute(
+            "insert into route values (?, ?, null, null, ?) on conflict (router, net) do update set last_seen = excluded.last_seen",
+            [(router, net, now) for net in networks],
+        )
+
+    def set_routing_table(self, router, entries):
+        """The entries of the routing table of a router are a list of
+        (net, port_id, port_info)."""
+        if _debug:
+            NetworkTopology._debug("set_routing_table %r %r", router, entries)
+
+        router = str(router)
+        for net, port_id, port_info in entries:
+            self.table[router, net] = (port_id, port_info)
+
+        now = time.time()
+        self.snapshot.execute(
+            "insert or replace into route values (?, ?, ?, ?, ?)",
+            [
+                (router, net, port_id, port_info, now)
+                for net, port_id, port_info in entries
+            ],
+        )
+
+    def routers(self):
+        """Return the list of router addresses."""
+        return [Address(router) for router in sorted(set(r for r, _ in self.table))]
+
+    def networks(self):
+        """Return the sorted list of the networks that can be reached."""
+        return sorted(set(net for _, net in self.table))
+
+    def routes(self):
+        """Return the list of (router, net, port_id, port_info)."""
+        return [
+            (Address(router), net) + self.table[router, net]
+            for router, net in sorted(self.table)
+        ]
+
+
+#
+#   TimeSeries
+#
+
+
+@bacpypes_debugging
+class TimeSeries:
+    """Samples of polled property values, appended to the sample table of a
+    snapshot database.  Each (devid, objid, propid) is a row in the point
+    table and the samples refer to it by number, the value is in the
+    value_real column for real numbers and the value_int column for the
+    others (booleans, enumerations and bit strings as integers).  The rows
+    are written with Snapshot.execute(), so a threaded snapshot commits them
+    in its writer thread."""
+
+    def __init__(self, snapshot, batch_size=WRITE_BATCH_SIZE):
+        if _debug:
+            TimeSeries._debug("__init__ %r", snapshot)
+
+        self.snapshot = snapshot
+        self.batch_size = batch_size
+        self.cursor = snapshot.connection.cursor()
+        self.create_table(self.cursor)
+
+        # (devid, objid, propid): point number
+        self.cursor.execute("select devid, objid, propid, point from point")
+        self.points = {tuple(row[:3]): row[3] for row in self.cursor.fetchall()}
+        self.next_point = max(self.points.values(), default=0) + 1
+
+        # points and samples that have not been written
+        self.new_points = []
+        self.rows = []
+
+    @staticmethod
+    def create_table(cursor):
+        cursor.execute(
+            "create table if not exists point(point integer primary key, devid integer, objid text, propid text, unique (devid, objid, propid))"
+        )
+        cursor.execute(
+            "create table if not exists sample(point integer, time real, value_real real, value_int integer)"
+        )
+
+    def point(self, devid, objid, propid):
+        """Return the number of a point, adding it if it is new, new points
+        are written with the next samples."""
+        key = (int(devid), objid, propid)
+        point = self.points.get(key)
+        if point is None:
+            point = self.points[key] = self.next_point
+            self.next_point += 1
+            self.new_points.append((point,) + key)
+        return point
+
+    def extend(self, rows):
+        """Add a list of (point, time, value_real, value_int) samples."""
+        self.rows.extend(rows)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if _debug:
+            TimeSeries._debug("flush %r", len(self.rows))
+
+        if self.new_points:
+            self.snapshot.execute(
+                "insert into point values (?, ?, ?, ?)", self.new_points
+            )
+            self.new_points = []
+        if self.rows:
+            self.snapshot.execute("insert into sample values (?, ?, ?, ?)", self.rows)
+            self.rows = []
+
+    def samples(self, devid, objid, propid):
+        """Return the list of (time, value) samples of a point."""
+        self.flush()
+        self.snapshot.flush()
+        self.cursor.execute(
+            "select time, coalesce(value_real, value_int) from sample where point = (select point from point where devid = ? and objid = ? and propid = ?) order by time",
+            (int(devid), objid, propid),
+        )
+        return self.cursor.fetchall()
+
+    def close(self):
+        self.flush()
+
+
+#
+#   TrendHistory
+#
+
+
+@bacpypes_debugging
+class TrendHistory:
+    """The records of the log buffers of trend log and trend log multiple
+    objects, read with ReadRange and kept in the history table of a snapshot
+    database.  There is a row for each record, or for each item of the log
+    data of a trend log multiple record, the kind is the name of the choice
+    of the datum (realValue, enumValue, logStatus, failure, ...) and the
+    value is in the value_real, value_int or value_text column."""
+
+    def __init__(self, snapshot, batch_size=WRITE_BATCH_SIZE):
+        if _debug:
+            TrendHistory._debug("__init__ %r", snapshot)
+
+        self.snapshot = snapshot
+        self.batch_size = batch_size
+        self.cursor = snapshot.connection.cursor()
+        self.create_table(self.cursor)
+
+        # records that have not been written
+        self.rows = []
+
+        # (devid, objid) -> captured runs of sequence numbers, see captured()
+        self.sequences = {}
+
+    @staticmethod
+    def create_table(cursor):
+        cursor.execute(
+            "create table if not exists history(devid integer, objid text, sequence integer, item integer, time real, kind text, value_real real, value_int integer, value_text text, status_flags integer, primary key (devid, objid, sequence, item)) without rowid"
+        )
+        cursor.execute(
+            "create table if not exists history_archive(reset real, devid integer, objid text, sequence integer, item integer, time real, kind text, value_real real, value_int integer, value_text text, status_flags integer)"
+        )
+
+    def captured(self, devid, objid):
+        """Return the sorted list of [first, last] runs of the sequence
+        numbers of a log that have been captured.  They are loaded from the
+        database the first time the log is used and kept up to date by
+        add(), so this does not wait for the writer of a threaded snapshot
+        which would stall the application."""
+        key = (int(devid), objid)
+        runs = self.sequences.get(key)
+        if runs is not None:
+            return runs
+        if _debug:
+            TrendHistory._debug("captured %r %r", devid, objid)
+
+        runs = self.sequences[key] = []
+        self.cursor.execute(
+            "select min(sequence), max(sequence) from history where devid = ? and objid = ?",
+            key,
+        )
+        lowest, highest = self.cursor.fetchone()
+        if lowest is None:
+            return runs
+
+        self.cursor.execute(
+            "select sequence + 1, next - 1 from (select sequence, lead(sequence) over (order by sequence) as next from (select distinct sequence from history where devid = ? and objid = ?)) where next > sequence + 1",
+            key,
+        )
+        for gap_first, gap_last in self.cursor.fetchall():
+            runs.append([lowest, gap_first - 1])
+            lowest = gap_last + 1
+        runs.append([lowest, highest])
+
+        return runs
+
+    def last_sequence(self, devid, objid):
+        """Return the sequence number of the last record of a log that has
+        been captured, or None."""
+        runs = self.captured(devid, objid)
+        return runs[-1][1] if runs else None
+
+    def missing(self, devid, objid, first=None, last=None):
+        """Return the list of (first, last) ranges of the sequence numbers
+        of a log from first to last that have not been captured, like the
+        pages that could not be read.  The default first and last are the
+        first and last records that have been captured."""
+        runs = self.captured(devid, objid)
+        if not runs:
+            return [] if (first is None) or (last is None) else [(first, last)]
+        if first is None:
+            first = runs[0][0]
+        if last is None:
+            last = runs[-1][1]
+
+        ranges = []
+        for run_first, run_last in runs:
+            if run_last < first:
+                continue
+            if run_first > last:
+                break
+            if run_first > first:
+                ranges.append((first, run_first - 1))
+            first = run_last + 1
+        if first <= last:
+            ranges.append((first, last))
+
+        return ranges
+
+    def add(self, devid, objid, rows):
+        """Add a list of (sequence, item, time, kind, value_real, value_int,
+        value_text, status_flags) rows to the history of a log, records that
+        have already been captured are skipped.  They are written in batches
+        with Snapshot.execute(), see flush()."""
+        if _debug:
+            TrendHistory._debug("add %r %r %r", devid, objid, len(rows))
+
+        runs = self.captured(devid, objid)
+        for sequence in sorted(set(row[0] for row in rows)):
+            # merge the sequence number into the runs it touches
+            first = last = sequence
+            merged = []
+            for run in runs:
+                if (run[1] + 1 < first) or (run[0] > last + 1):
+                    merged.append(run)
+                else:
+                    first, last = min(first, run[0]), max(last, run[1])
+            merged.append([first, last])
+            merged.sort()
+            runs[:] = merged
+
+        key = (int(devid), objid)
+        self.rows.extend(key + tuple(row) for row in rows)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def reset(self, devid, objid):
+        """The log buffer of a log has been cleared and the sequence numbers
+        start over, move the records that have been captured to the
+        history_archive table with the time of the reset so the new ones
+        are not mistaken for them."""
+        if _debug:
+            TrendHistory._debug("reset %r %r", devid, objid)
+
+        # write the pending records first, the statements run in order
+        self.flush()
+
+        key = (int(devid), objid)
+        self.snapshot.execute(
+            "insert into history_archive select ?, * from history where devid = ? and objid = ?",
+            [(time.time(),) + key],
+        )
+        self.snapshot.execute(
+            "delete from history where devid = ? and objid = ?",
+            [key],
+        )
+        self.sequences[key] = []
+
+    def flush(self):
+        if _debug:
+            TrendHistory._debug("flush %r", len(self.rows))
+
+        if self.rows:
+            self.snapshot.execute(
+                "insert or ignore into history values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                self.rows,
+            )
+            self.rows = []
+
+    def records(self, devid, objid):
+        """Return the list of (sequence, item, time, kind, value_real,
+        value_int, value_text, status_flags) rows of a log."""
+        self.flush()
+        self.snapshot.flush()
+        self.cursor.execute(
+            "select sequence, item, time, kind, value_real, value_int, value_text, status_flags from history where devid = ? and objid = ? order by sequence, item",
+            (int(devid), objid),
+        )
+        return self.cursor.fetchall()
+
+    def close(self):
+        self.flush()
@@ -0,0 +1,223 @@
+#!/usr/bin/python3
+
+"""
+Snapshot Diff
+
+This application compares two snapshot databases and writes the changes as
+one JSON object per line: devices and objects that were added or removed,
+and properties that were added, removed, or have a different value.  Both
+tables are read in (devid, objid, propid) order and merged, the stored
+values are compared first and only decoded when they are different.
+"""
+
+import sys
+import pickle
+
+from collections import Counter
+
+from bacpypes.debugging import ModuleLogger
+from bacpypes.consolelogging import ArgumentParser
+
+from db import Snapshot, value_contents, encoder
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+# lines written at a time
+BATCH_SIZE = 10000
+
+# past the end of the rows
+END = None
+
+
+def same_value(old_value, new_value):
+    """Return true if the decoded values are the same, constructed values
+    are compared by their contents."""
+    if type(old_value) is not type(new_value):
+        return False
+    try:
+        if old_value == new_value:
+            return True
+    except Exception:
+        pass
+    return value_contents(old_value) == value_contents(new_value)
+
+
+def diff(old_rows, new_rows, old_loads=pickle.loads, new_loads=pickle.loads):
+    """Merge the sorted rows of the old and new snapshots and generate the
+    changes as (change, devid, objid, propid, old value, new value) tuples.
+    The rows have the values as they are stored and are only decoded with
+    the loads functions when the stored values are different, the values
+    in the changes are None when they do not apply.  When a device or
+    object is added or removed there is one change for it rather than one
+    for each of its properties."""
+    old_rows = iter(old_rows)
+    new_rows = iter(new_rows)
+
+    old_row = next(old_rows, END)
+    new_row = next(new_rows, END)
+
+    # the last row consumed from each side
+    old_last = new_last = (None, None, None, None)
+
+    # the device or object that was just reported
+    reported = None
+
+    def present(key, row, last):
+        """The key (a device or an object) is in the other snapshot if the
+        current row or the last row consumed from it matches."""
+        size = len(key)
+        return ((row is not END) and (row[:size] == key)) or (last[:size] == key)
+
+    while (old_row is not END) or (new_row is not END):
+        # most of the rows are the same
+        if old_row == new_row:
+            old_last, old_row = old_row, next(old_rows, END)
+            new_last, new_row = new_row, next(new_rows, END)
+            continue
+
+        if new_row is END:
+            compare = -1
+        elif old_row is END:
+            compare = 1
+        else:
+            old_key = old_row[:3]
+            new_key = new_row[:3]
+            compare = -1 if old_key < new_key else (1 if old_key > new_key else 0)
+
+        if compare == 0:
+            devid, objid, propid, old_value = old_row
+            new_value = new_row[3]
+            if old_value != new_value:
+                old_value = old_loads(old_value)
+                new_value = new_loads(new_value)
+                if not same_value(old_value, new_value):
+                    yield ("changed", devid, objid, propid, old_value, new_value)
+
+            old_last, old_row = old_row, next(old_rows, END)
+            new_last, new_row = new_row, next(new_rows, END)
+            continue
+
+        if compare < 0:
+            row, other_row, other_last = old_row, new_row, new_last
+            kind = "removed"
+        else:
+            row, other_row, other_last = new_row, old_row, old_last
+            kind = "added"
+        devid, objid, propid, value = row
+
+        if not present((devid,), other_row, other_last):
+            if reported != (devid,):
+                reported = (devid,)
+                yield ("device-" + kind, devid, None, None, None, None)
+        elif not present((devid, objid), other_row, other_last):
+            if reported != (devid, objid):
+                reported = (devid, objid)
+                yield ("object-" + kind, devid, objid, None, None, None)
+        elif compare < 0:
+            yield (kind, devid, objid, propid, old_loads(value), None)
+        else:
+            yield (kind, devid, objid, propid, None, new_loads(value))
+
+        if compare < 0:
+            old_last, old_row = old_row, next(old_rows, END)
+        else:
+            new_last, new_row = new_row, next(new_rows, END)
+
+
+def write_changes(changes, output):
+    """Write the changes as JSON lines."""
+    encode = encoder.encode
+
+    batch = []
+    for (change, devid, objid, propid, old_value, new_value) in changes:
+        record = {"change": change, "devid": devid}
+        if objid is not None:
+            record["objid"] = objid
+        if propid is not None:
+            record["propid"] = propid
+        if change in ("changed", "removed"):
+            record["old"] = value_contents(old_value)
+        if change in ("changed", "added"):
+            record["new"] = value_contents(new_value)
+
+        batch.append(encode(record))
+        batch.append("\n")
+        if len(batch) >= 2 * BATCH_SIZE:
+            output.write("".join(batch))
+            del batch[:]
+    output.write("".join(batch))
+
+
+#
+#   __main__
+#
+
+
+def main():
+    # parse the command line arguments
+    parser = ArgumentParser(description=__doc__)
+
+    parser.add_argument("old", help="old database file name")
+    parser.add_argument("new", help="new database file name")
+    parser.add_argument("devid", help="device identifier", nargs="?", default="-")
+    parser.add_argument("objid", help="object identifier", nargs="?", default="-")
+    parser.add_argument("propid", help="property identifier", nargs="?", default="-")
+
+    parser.add_argument("--output", help="output file name, default is stdout")
+    parser.add_argument(
+        "--summary",
+        action="store_true",
+        help="only print the number of each kind of change",
+    )
+
+    args = parser.parse_args()
+
+    if _debug:
+        _log.debug("initialization")
+    if _debug:
+        _log.debug("    - args: %r", args)
+
+    query = (
+        args.devid if args.devid != "-" else None,
+        args.objid if args.objid != "-" else None,
+        args.propid if args.propid != "-" else None,
+    )
+
+    old_snapshot = Snapshot(args.old)
+    new_snapshot = Snapshot(args.new)
+
+    _log.debug("running")
+
+    # check the filters before starting
+    try:
+        old_snapshot.where(*query)
+    except ValueError as err:
+        parser.error(str(err))
+
+    changes = diff(
+        old_snapshot.raw_items(*query),
+        new_snapshot.raw_items(*query),
+        old_snapshot.loads,
+        new_snapshot.loads,
+    )
+
+    if args.summary:
+        counts = Counter(change[0] for change in changes)
+        for change, count in sorted(counts.items()):
+            sys.stdout.write("{} {}\n".format(change, count))
+    elif args.output:
+        with open(args.output, "w") as output:
+            write_changes(changes, output)
+    else:
+        write_changes(changes, sys.stdout)
+
+    _log.debug("fini")
+
+    old_snapshot.close()
+    new_snapshot.close()
+
+
+if __name__ == "__main__":
+    main()
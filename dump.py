@@ -1,55 +1,305 @@
 #!/usr/bin/python3
 
+import io
+import os
 import sys
+import csv
+import multiprocessing
 
 from bacpypes.debugging import ModuleLogger
 from bacpypes.consolelogging import ArgumentParser
 
-from db import Snapshot
+from db import Snapshot, value_contents, encoder
+from db import is_filter, is_objid_filter, parse_ranges, parse_objid
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+    from columnar import ColumnarSnapshot
+except ImportError:
+    pyarrow = None
 
 # some debugging
 _debug = 0
 _log = ModuleLogger(globals())
 
-# parse the command line arguments
-parser = ArgumentParser(description=__doc__)
+# rows written at a time
+BATCH_SIZE = 10000
+
+
+def write_text(rows, output):
+    for (devid, objid, propid, value) in rows:
+        if _debug:
+            _log.debug("    - objid, value: %r, %r (%r)", objid, value, type(value))
+        if hasattr(value, "debug_contents"):
+            output.write("{} {} {}\n".format(devid, objid, propid))
+            value.debug_contents(file=output)
+        elif isinstance(value, list) and value:
+            output.write("{} {} {}\n".format(devid, objid, propid))
+            for i, x in enumerate(value):
+                output.write("    [{}]: {}\n".format(i, x))
+                if hasattr(x, "debug_contents"):
+                    x.debug_contents(file=output, indent=4)
+        else:
+            output.write("{} {} {} {!r}\n".format(devid, objid, propid, value))
+
+
+def write_jsonl(rows, output):
+    encode = encoder.encode
+    batch = []
+    for (devid, objid, propid, value) in rows:
+        batch.append(
+            encode(
+                {
+                    "devid": devid,
+                    "objid": objid,
+                    "propid": propid,
+                    "value": value_contents(value),
+                }
+            )
+        )
+        batch.append("\n")
+        if len(batch) >= 2 * BATCH_SIZE:
+            output.write("".join(batch))
+            del batch[:]
+    output.write("".join(batch))
+
+
+def write_csv(rows, output, header=True):
+    encode = encoder.encode
+    writer = csv.writer(output, lineterminator="\n")
+    if header:
+        writer.writerow(("devid", "objid", "propid", "value"))
+
+    batch = []
+    for (devid, objid, propid, value) in rows:
+        value = value_contents(value)
+        if not isinstance(value, (str, int, float)) or isinstance(value, bool):
+            value = encode(value)
+        batch.append((devid, objid, propid, value))
+        if len(batch) >= BATCH_SIZE:
+            writer.writerows(batch)
+            del batch[:]
+    writer.writerows(batch)
+
+
+def parquet_schema():
+    return pyarrow.schema(
+        [
+            ("devid", pyarrow.string()),
+            ("objid", pyarrow.string()),
+            ("propid", pyarrow.string()),
+            ("value", pyarrow.string()),
+        ]
+    )
+
+
+def parquet_tables(rows):
+    """Generate tables of at most BATCH_SIZE rows."""
+    encode = encoder.encode
+    schema = parquet_schema()
+
+    def table():
+        return pyarrow.Table.from_arrays(
+            [pyarrow.array(column, type=pyarrow.string()) for column in columns],
+            schema=schema,
+        )
+
+    columns = ([], [], [], [])
+    for (devid, objid, propid, value) in rows:
+        columns[0].append(str(devid))
+        columns[1].append(objid)
+        columns[2].append(propid)
+        columns[3].append(encode(value_contents(value)))
+        if len(columns[0]) >= BATCH_SIZE:
+            yield table()
+            columns = ([], [], [], [])
+    if columns[0]:
+        yield table()
+
+
+def write_parquet(rows, output):
+    with pyarrow.parquet.ParquetWriter(output, parquet_schema()) as writer:
+        for table in parquet_tables(rows):
+            writer.write_table(table)
+
+
+writers = {
+    "text": write_text,
+    "jsonl": write_jsonl,
+    "csv": write_csv,
+    "parquet": write_parquet,
+}
+
+# the snapshot and format in each worker process
+worker_snapshot = None
+worker_format = None
+
+
+def open_snapshot(dbname, site=None):
+    """Return a snapshot database or a columnar dataset."""
+    if os.path.isdir(dbname):
+        return ColumnarSnapshot(dbname, site=site)
+    else:
+        return Snapshot(dbname)
+
+
+def worker_init(dbname, site, output_format):
+    global worker_snapshot, worker_format
 
-# database file name
-parser.add_argument("dbname", help="database file name")
-parser.add_argument("devid", help="device identifier", nargs="?", default="-")
-parser.add_argument("objid", help="object identifier", nargs="?", default="-")
-parser.add_argument("propid", help="property identifier", nargs="?", default="-")
+    worker_snapshot = open_snapshot(dbname, site)
+    worker_format = output_format
 
-args = parser.parse_args()
 
-if _debug:
-    _log.debug("initialization")
-if _debug:
-    _log.debug("    - args: %r", args)
+def worker_dump(query):
+    """Decode and format the rows of one device, the output is text or a
+    list of tables for parquet."""
+    devid, objid, propid, name = query
+    rows = worker_snapshot.items(devid=devid, objid=objid, propid=propid, name=name)
 
-snapshot = Snapshot(args.dbname)
+    if worker_format == "parquet":
+        return list(parquet_tables(rows))
 
-_log.debug("running")
+    output = io.StringIO()
+    if worker_format == "csv":
+        write_csv(rows, output, header=False)
+    else:
+        writers[worker_format](rows, output)
+    return output.getvalue()
+
+
+def parallel_dump(args, snapshot, devid, objid, propid, output):
+    """Partition the rows by device, decode and format the partitions in a
+    pool of processes and write the results in device order."""
+    if _debug:
+        _log.debug("parallel_dump %r %r %r %r", args.jobs, devid, objid, propid)
+
+    queries = [
+        (device, objid, propid, args.name) for device in snapshot.devices(devid)
+    ]
+
+    with multiprocessing.Pool(
+        args.jobs,
+        initializer=worker_init,
+        initargs=(args.dbname, args.site, args.format),
+    ) as pool:
+        results = pool.imap(worker_dump, queries)
+
+        if args.format == "parquet":
+            with pyarrow.parquet.ParquetWriter(output, parquet_schema()) as writer:
+                for tables in results:
+                    for table in tables:
+                        writer.write_table(table)
+        else:
+            if args.format == "csv":
+                write_csv((), output)
+            for chunk in results:
+                output.write(chunk)
+
+
+def main():
+    # parse the command line arguments
+    parser = ArgumentParser(description=__doc__)
+
+    # database file name and filters
+    parser.add_argument("dbname", help="database file name or dataset directory")
+    parser.add_argument(
+        "devid",
+        help="device identifier, or a list and ranges like 2000-2099,3000",
+        nargs="?",
+        default="-",
+    )
+    parser.add_argument(
+        "objid",
+        help="object identifier, or a type with instance ranges like analogInput:*",
+        nargs="?",
+        default="-",
+    )
+    parser.add_argument(
+        "propid",
+        help="property identifier, or a list like presentValue,units",
+        nargs="?",
+        default="-",
+    )
+    parser.add_argument("--name", help="objectName LIKE pattern, like 'AHU-%%'")
+
+    # output options
+    parser.add_argument(
+        "--format", help="output format", choices=sorted(writers), default="text"
+    )
+    parser.add_argument("--output", help="output file name, default is stdout")
+
+    # dataset options
+    parser.add_argument("--site", help="site name in a columnar dataset")
 
-for (devid, objid, propid, value) in snapshot.items(
-    devid=args.devid if args.devid != "-" else None,
-    objid=args.objid if args.objid != "-" else None,
-    propid=args.propid if args.propid != "-" else None,
-):
+    # parallel decoding
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="number of processes decoding and formatting, default 1",
+    )
+
+    args = parser.parse_args()
+
+    if _debug:
+        _log.debug("initialization")
     if _debug:
-        _log.debug("    - objid, value: %r, %r (%r)", objid, value, type(value))
-    if hasattr(value, "debug_contents"):
-        print("{} {} {}".format(devid, objid, propid))
-        value.debug_contents(file=sys.stdout)
-    elif isinstance(value, list) and value:
-        print("{} {} {}".format(devid, objid, propid))
-        for i, x in enumerate(value):
-            print("    [{}]: {}".format(i, x))
-            if hasattr(x, "debug_contents"):
-                x.debug_contents(file=sys.stdout, indent=4)
+        _log.debug("    - args: %r", args)
+
+    if args.format == "parquet":
+        if pyarrow is None:
+            parser.error("parquet format requires pyarrow")
+        if not args.output:
+            parser.error("parquet format requires an output file")
+    if os.path.isdir(args.dbname):
+        if pyarrow is None:
+            parser.error("columnar datasets require pyarrow")
+    elif args.site:
+        parser.error("--site requires a columnar dataset")
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+
+    devid = args.devid if args.devid != "-" else None
+    objid = args.objid if args.objid != "-" else None
+    propid = args.propid if args.propid != "-" else None
+
+    # check the filters before starting
+    try:
+        if devid is not None:
+            parse_ranges(devid)
+        if is_objid_filter(objid):
+            parse_objid(objid)
+    except ValueError as err:
+        parser.error(str(err))
+
+    snapshot = open_snapshot(args.dbname, args.site)
+
+    _log.debug("running")
+
+    if args.jobs > 1 and (devid is None or is_filter(devid, ",-")):
+        if args.format == "parquet":
+            parallel_dump(args, snapshot, devid, objid, propid, args.output)
+        elif args.output:
+            with open(args.output, "w", newline="") as output:
+                parallel_dump(args, snapshot, devid, objid, propid, output)
+        else:
+            parallel_dump(args, snapshot, devid, objid, propid, sys.stdout)
     else:
-        print("{} {} {} {!r}".format(devid, objid, propid, value))
+        rows = snapshot.items(devid=devid, objid=objid, propid=propid, name=args.name)
+
+        if args.format == "parquet":
+            write_parquet(rows, args.output)
+        elif args.output:
+            with open(args.output, "w", newline="") as output:
+                writers[args.format](rows, output)
+        else:
+            writers[args.format](rows, sys.stdout)
+
+    _log.debug("fini")
+
+    snapshot.close()
 
-_log.debug("fini")
 
-snapshot.close()
+if __name__ == "__main__":
+    main()
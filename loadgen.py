@@ -0,0 +1,574 @@
+#!/usr/bin/python3
+
+"""
+Load Generator
+
+This application replays devices from a snapshot database the same way as
+replay.py, but everything is on in-process VLANs so no network interface is
+needed.  A client on the "local" network sends a mix of Read-Property,
+Read-Property-Multiple, Write-Property and Who-Is requests to the replayed
+devices at a target rate and reports the latency percentiles, throughput and
+error counts.
+"""
+
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import subprocess
+
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger
+from bacpypes.consolelogging import ArgumentParser
+
+from bacpypes.core import run, stop, deferred
+from bacpypes.comm import bind
+from bacpypes.task import FunctionTask, RecurringTask
+from bacpypes.iocb import IOCB
+
+from bacpypes.pdu import Address, LocalBroadcast
+from bacpypes.netservice import NetworkServiceAccessPoint, NetworkServiceElement
+from bacpypes.vlan import Network, Node
+
+from bacpypes.app import ApplicationIOController
+from bacpypes.appservice import StateMachineAccessPoint, ApplicationServiceAccessPoint
+from bacpypes.local.device import LocalDeviceObject
+
+from bacpypes.apdu import (
+    WhoIsRequest,
+    ReadPropertyRequest,
+    ReadPropertyMultipleRequest,
+    ReadAccessSpecification,
+    PropertyReference,
+    WritePropertyRequest,
+)
+from bacpypes.primitivedata import Real
+from bacpypes.constructeddata import Any
+from bacpypes.object import get_datatype
+
+import replay
+from replay import ReplayApplication, ConfigurationError, build_topology
+from db import Snapshot, DeviceRegistry
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+# globals
+args = None
+
+# kinds of requests
+REQUEST_KINDS = ("rp", "rpm", "wp", "whois")
+
+# the client network and address of the router on it
+CLIENT_NETWORK = 1
+ROUTER_ADDRESS = Address(1)
+CLIENT_ADDRESS = Address(2)
+
+
+#
+#   LoadClient
+#
+
+
+@bacpypes_debugging
+class LoadClient(ApplicationIOController):
+    """
+    An application on the client network that sends the requests, the I-Am
+    responses are lined up with the outstanding Who-Is requests.
+    """
+
+    def __init__(self, device_instance, lan):
+        if _debug:
+            LoadClient._debug("__init__ %r %r", device_instance, lan)
+
+        local_device = LocalDeviceObject(
+            objectName="loadgen",
+            objectIdentifier=("device", device_instance),
+            vendorIdentifier=15,
+        )
+        ApplicationIOController.__init__(self, local_device)
+
+        # same stack as the replay applications
+        self.asap = ApplicationServiceAccessPoint()
+        self.smap = StateMachineAccessPoint(local_device)
+        self.smap.deviceInfoCache = self.deviceInfoCache
+        self.nsap = NetworkServiceAccessPoint()
+        self.nse = NetworkServiceElement()
+        bind(self.nse, self.nsap)
+        bind(self, self.asap, self.smap, self.nsap)
+
+        # attach to the client network
+        self.node = Node(CLIENT_ADDRESS)
+        lan.add_node(self.node)
+        self.nsap.bind(self.node, address=CLIENT_ADDRESS)
+
+        # device instance to a list of callback functions
+        self.i_am_waiting = {}
+
+    def do_IAmRequest(self, apdu):
+        if _debug:
+            LoadClient._debug("do_IAmRequest %r", apdu)
+
+        waiting = self.i_am_waiting.get(apdu.iAmDeviceIdentifier[1])
+        if waiting:
+            waiting.pop(0)(None)
+
+
+#
+#   LoadGenerator
+#
+
+
+@bacpypes_debugging
+class LoadGenerator(RecurringTask):
+    """
+    Every interval send enough requests to keep up with the target rate, as
+    long as the number of outstanding requests is below the window.  The
+    requests that could not be sent are counted as throttled.
+    """
+
+    def __init__(self, client, targets, mix, rate, duration, window, timeout, seed):
+        if _debug:
+            LoadGenerator._debug(
+                "__init__ %r %r %r %r %r", mix, rate, duration, window, timeout
+            )
+        RecurringTask.__init__(self, 50)
+
+        self.client = client
+        self.targets = targets
+        self.rate = rate
+        self.duration = duration
+        self.window = window
+        self.timeout = timeout
+        self.random = random.Random(seed)
+
+        # weighted choice of the request kinds
+        self.kinds = [kind for kind in REQUEST_KINDS if mix.get(kind)]
+        self.weights = [mix[kind] for kind in self.kinds]
+
+        # writes need something to write to
+        self.writable = [
+            (address, device_id, objid)
+            for address, device_id, objids, writable in targets
+            for objid in writable
+        ]
+        if not self.writable and "wp" in self.kinds:
+            i = self.kinds.index("wp")
+            del self.kinds[i]
+            del self.weights[i]
+        if not self.kinds:
+            raise ConfigurationError("nothing in the request mix")
+
+        # results
+        self.latencies = {kind: [] for kind in REQUEST_KINDS}
+        self.errors = {kind: {} for kind in REQUEST_KINDS}
+        self.sent = 0
+        self.throttled = 0
+        self.outstanding = 0
+
+        self.start_time = None
+        self.stop_time = None
+
+    def start(self):
+        if _debug:
+            LoadGenerator._debug("start")
+
+        self.start_time = time.perf_counter()
+        self.install_task()
+
+    def process_task(self):
+        now = time.perf_counter()
+        elapsed = now - self.start_time
+
+        # done sending, wait for the stragglers
+        if elapsed >= self.duration:
+            self.suspend_task()
+            self.stop_time = now
+            FunctionTask(self.finish).install_task(delta=0.1)
+            return
+
+        due = int(self.rate * elapsed) - self.sent - self.throttled
+        for _ in range(due):
+            if self.outstanding >= self.window:
+                self.throttled += 1
+                continue
+            self.send(self.random.choices(self.kinds, self.weights)[0])
+
+    def send(self, kind):
+        address, device_id, objids, _ = self.random.choice(self.targets)
+
+        if kind == "rp":
+            request = ReadPropertyRequest(
+                objectIdentifier=self.random.choice(objids),
+                propertyIdentifier="presentValue",
+            )
+        elif kind == "rpm":
+            request = ReadPropertyMultipleRequest(
+                listOfReadAccessSpecs=[
+                    ReadAccessSpecification(
+                        objectIdentifier=objid,
+                        listOfPropertyReferences=[
+                            PropertyReference(propertyIdentifier="presentValue"),
+                            PropertyReference(propertyIdentifier="statusFlags"),
+                        ],
+                    )
+                    for objid in self.random.sample(objids, min(5, len(objids)))
+                ]
+            )
+        elif kind == "wp":
+            address, device_id, objid = self.random.choice(self.writable)
+            request = WritePropertyRequest(
+                objectIdentifier=objid, propertyIdentifier="presentValue"
+            )
+            request.propertyValue = Any()
+            request.propertyValue.cast_in(Real(self.random.uniform(0.0, 100.0)))
+        elif kind == "whois":
+            request = WhoIsRequest(
+                deviceInstanceRangeLowLimit=device_id,
+                deviceInstanceRangeHighLimit=device_id,
+            )
+        request.pduDestination = address
+
+        self.sent += 1
+        self.outstanding += 1
+        start = time.perf_counter()
+
+        if kind == "whois":
+            # the I-Am completes it, or it times out
+            def i_am_received(error, kind=kind, start=start):
+                if waiting_task.isScheduled:
+                    waiting_task.suspend_task()
+                self.completed(kind, start, error)
+
+            def i_am_timeout(device_id=device_id, callback=i_am_received):
+                waiting = self.client.i_am_waiting[device_id]
+                waiting.remove(callback)
+                callback("timeout")
+
+            waiting_task = FunctionTask(i_am_timeout)
+            waiting_task.install_task(delta=self.timeout)
+            self.client.i_am_waiting.setdefault(device_id, []).append(i_am_received)
+
+            self.client.request(request)
+        else:
+            iocb = IOCB(request)
+            iocb.add_callback(
+                lambda iocb, kind=kind, start=start: self.completed(
+                    kind,
+                    start,
+                    None if iocb.ioResponse else (iocb.ioError or "no response"),
+                )
+            )
+            self.client.request_io(iocb)
+
+    def completed(self, kind, start, error):
+        self.outstanding -= 1
+
+        if error is None:
+            self.latencies[kind].append(time.perf_counter() - start)
+        else:
+            error = getattr(error, "errorCode", None) or str(error)
+            self.errors[kind][error] = self.errors[kind].get(error, 0) + 1
+
+    def finish(self):
+        if _debug:
+            LoadGenerator._debug("finish")
+
+        # give the outstanding requests a chance
+        if self.outstanding and (
+            time.perf_counter() - self.stop_time < self.timeout + 1.0
+        ):
+            FunctionTask(self.finish).install_task(delta=0.1)
+            return
+
+        stop()
+
+    def report(self):
+        """Return the results as a dictionary."""
+        duration = (self.stop_time or time.perf_counter()) - self.start_time
+
+        def summary(latencies, errors):
+            latencies = sorted(latencies)
+            result = {
+                "completed": len(latencies),
+                "errors": sum(errors.values()),
+                "throughput": round(len(latencies) / duration, 1),
+            }
+            for percent in (50, 95, 99):
+                result["p{}_ms".format(percent)] = (
+                    round(percentile(latencies, percent) * 1000.0, 3)
+                    if latencies
+                    else None
+                )
+            return result
+
+        requests = {}
+        for kind in self.kinds:
+            requests[kind] = summary(self.latencies[kind], self.errors[kind])
+            if self.errors[kind]:
+                requests[kind]["error_counts"] = self.errors[kind]
+
+        total = summary(
+            [latency for kind in self.kinds for latency in self.latencies[kind]],
+            {
+                kind: sum(self.errors[kind].values())
+                for kind in self.kinds
+                if self.errors[kind]
+            },
+        )
+        total.update(
+            {
+                "sent": self.sent,
+                "throttled": self.throttled,
+                "outstanding": self.outstanding,
+                "duration": round(duration, 3),
+            }
+        )
+
+        return {"total": total, "requests": requests}
+
+
+def percentile(values, percent):
+    """Nearest rank percentile of a sorted list."""
+    rank = max(1, int(round(percent / 100.0 * len(values) + 0.5)))
+    return values[min(rank, len(values)) - 1]
+
+
+def load_targets(topology, router_device_id):
+    """
+    Return a list of (address, device identifier, object identifiers,
+    writable object identifiers) tuples for the devices in the topology as
+    seen from the client network.
+    """
+    if _debug:
+        _log.debug("load_targets %r %r", topology, router_device_id)
+
+    devices = [(ROUTER_ADDRESS, router_device_id)]
+    for network_number, node_list in topology.items():
+        for node_address, device_id in node_list[1:]:
+            devices.append(
+                (Address("{}:{}".format(network_number, node_address)), device_id)
+            )
+
+    targets = []
+    for address, device_id in devices:
+        objids = []
+        writable = []
+        present_values = replay.snapshot.items(device_id, None, "presentValue")
+        for _, objid, _, _ in present_values:
+            object_type, object_instance = objid.split(":")
+            objid = (object_type, int(object_instance))
+            objids.append(objid)
+
+            datatype = get_datatype(object_type, "presentValue")
+            if datatype and issubclass(datatype, Real):
+                writable.append(objid)
+
+        if objids:
+            targets.append((address, device_id, objids, writable))
+
+    return targets
+
+
+def git_commit():
+    """Return the commit of the working tree, if there is one."""
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "describe", "--always", "--dirty"],
+                stderr=subprocess.DEVNULL,
+                cwd=sys.path[0] or None,
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_mix(mix):
+    """Parse a request mix like "rp=60,rpm=20,wp=10,whois=10"."""
+    result = {}
+    for part in mix.split(","):
+        kind, _, weight = part.partition("=")
+        if kind not in REQUEST_KINDS:
+            raise argparse.ArgumentTypeError("unknown request kind: {}".format(kind))
+        try:
+            result[kind] = float(weight or 1)
+        except ValueError:
+            raise argparse.ArgumentTypeError("invalid weight: {}".format(weight))
+    return result
+
+
+#
+#   __main__
+#
+
+
+def main():
+    global args
+
+    # parse the command line arguments
+    parser = ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+
+    # snapshot database name
+    parser.add_argument(
+        "dbname", type=str, help="snapshot database name",
+    )
+
+    # VLAN BACnet network number
+    parser.add_argument(
+        "net2", type=int, help="network number of the VLAN",
+    )
+
+    # list of device identifiers, first one is the router
+    parser.add_argument(
+        "devid", type=int, nargs="+", help="device identifiers",
+    )
+
+    # same topology options as replay.py
+    parser.add_argument(
+        "--topology", type=str, help="topology file of additional VLAN networks",
+    )
+    parser.add_argument(
+        "--site-topology",
+        action="store_true",
+        help="put devices on the networks recorded in the snapshot",
+    )
+
+    # load parameters
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        help="request mix, default: rp=60,rpm=20,wp=10,whois=10",
+        default="rp=60,rpm=20,wp=10,whois=10",
+    )
+    parser.add_argument(
+        "--rate", type=float, help="requests per second", default=100.0,
+    )
+    parser.add_argument(
+        "--duration", type=float, help="seconds to send requests", default=10.0,
+    )
+    parser.add_argument(
+        "--window", type=int, help="maximum outstanding requests", default=32,
+    )
+    parser.add_argument(
+        "--timeout", type=float, help="Who-Is timeout in seconds", default=5.0,
+    )
+    parser.add_argument(
+        "--seed", type=int, help="random seed for the requests", default=0,
+    )
+    parser.add_argument(
+        "--json", type=str, help="write the report to a JSON file",
+    )
+
+    # now parse the arguments
+    args = parser.parse_args()
+
+    if _debug:
+        _log.debug("initialization")
+    if _debug:
+        _log.debug("    - args: %r", args)
+
+    try:
+        # open the snapshot database, the replay applications need it
+        replay.snapshot = Snapshot(args.dbname)
+        replay.registry = DeviceRegistry(replay.snapshot)
+
+        topology = build_topology(args, CLIENT_NETWORK, args.net2)
+        if _debug:
+            _log.debug("    - topology: %r", topology)
+
+        # the client network has the router and the client
+        lan = Network(name=str(CLIENT_NETWORK), broadcast_address=LocalBroadcast())
+
+        router_app = ReplayApplication(args.devid[0])
+        router_node = Node(ROUTER_ADDRESS)
+        lan.add_node(router_node)
+        router_app.nsap.bind(router_node, CLIENT_NETWORK, ROUTER_ADDRESS)
+
+        replay.build_networks(router_app, topology)
+        deferred(router_app.nse.i_am_router_to_network)
+
+        client = LoadClient(4194302, lan)
+
+        targets = load_targets(topology, args.devid[0])
+        if not targets:
+            raise ConfigurationError("no objects with a present value")
+
+        generator = LoadGenerator(
+            client,
+            targets,
+            args.mix,
+            args.rate,
+            args.duration,
+            args.window,
+            args.timeout,
+            args.seed,
+        )
+    except ConfigurationError as err:
+        sys.stderr.write(f"configuration err: {err}\n")
+        sys.exit(1)
+
+    # let the start up I-Am messages settle down
+    deferred(FunctionTask(generator.start).install_task, delta=1.0)
+
+    _log.debug("running")
+
+    run()
+
+    _log.debug("fini")
+
+    # build the report
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "config": {
+            "devices": len(targets),
+            "objects": sum(len(target[2]) for target in targets),
+            "mix": args.mix,
+            "rate": args.rate,
+            "duration": args.duration,
+            "window": args.window,
+            "seed": args.seed,
+        },
+    }
+    report.update(generator.report())
+
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump(report, json_file, indent=2)
+            json_file.write("\n")
+
+    total = report["total"]
+    print(
+        "sent {} completed {} errors {} throttled {} in {:.1f}s, {:.1f}/s".format(
+            total["sent"],
+            total["completed"],
+            total["errors"],
+            total["throttled"],
+            total["duration"],
+            total["throughput"],
+        )
+    )
+    for kind, result in report["requests"].items():
+        print(
+            "{:6} {:7} ok {:5} err  p50 {} ms  p95 {} ms  p99 {} ms".format(
+                kind,
+                result["completed"],
+                result["errors"],
+                result["p50_ms"],
+                result["p95_ms"],
+                result["p99_ms"],
+            )
+        )
+
+    replay.snapshot.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/python3
+
+"""
+Snapshot Merge
+
+This application merges snapshot databases, like the ones captured in
+parallel from different places on the same site, into one database.  The
+rows are copied by SQLite with INSERT ... SELECT from each attached source.
+When more than one source has a value for the same property the policy
+decides which one is kept: with newest-wins the source files are merged in
+the order of their modification times so the most recent one wins, with
+prefer-source the preferred source wins and the others are merged in the
+order they are given.
+"""
+
+import os
+
+from bacpypes.debugging import ModuleLogger
+from bacpypes.consolelogging import ArgumentParser
+
+from db import Snapshot
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+# conflict policies
+NEWEST_WINS = "newest-wins"
+PREFER_SOURCE = "prefer-source"
+
+
+def merge_order(sources, policy, prefer=None):
+    """Return the sources in the order they are merged, the last one that
+    has a value for a property wins."""
+    if policy == NEWEST_WINS:
+        return sorted(sources, key=os.path.getmtime)
+    elif policy == PREFER_SOURCE:
+        return [source for source in sources if source != prefer] + [prefer]
+    else:
+        raise ValueError("unknown policy: %r" % (policy,))
+
+
+#
+#   __main__
+#
+
+
+def main():
+    # parse the command line arguments
+    parser = ArgumentParser(description=__doc__)
+
+    parser.add_argument("dbname", help="merged database file name")
+    parser.add_argument("sources", help="source database file names", nargs="+")
+
+    parser.add_argument(
+        "--policy",
+        help="conflict policy, default {}".format(NEWEST_WINS),
+        choices=(NEWEST_WINS, PREFER_SOURCE),
+        default=NEWEST_WINS,
+    )
+    parser.add_argument(
+        "--prefer", help="preferred source database file name for prefer-source"
+    )
+
+    args = parser.parse_args()
+
+    if _debug:
+        _log.debug("initialization")
+    if _debug:
+        _log.debug("    - args: %r", args)
+
+    if args.policy == PREFER_SOURCE:
+        if args.prefer is None:
+            parser.error("prefer-source requires --prefer")
+        if args.prefer not in args.sources:
+            parser.error("the preferred source must be one of the sources")
+    elif args.prefer is not None:
+        parser.error("--prefer requires the prefer-source policy")
+
+    for source in args.sources:
+        if not os.path.isfile(source):
+            parser.error("no such database: {}".format(source))
+
+    snapshot = Snapshot(args.dbname)
+
+    _log.debug("running")
+
+    for source in merge_order(args.sources, args.policy, args.prefer):
+        row_count = snapshot.load(source)
+        print("{} {} rows".format(source, row_count))
+
+    snapshot.update_names()
+
+    _log.debug("fini")
+
+    snapshot.close()
+
+
+if __name__ == "__main__":
+    main()
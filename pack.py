@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+
+"""
+Snapshot Pack
+
+This application compresses the values in a snapshot database with zstd
+and a dictionary trained on a sample of its own values, which is stored
+in the metadata table of the database.  Values are decompressed when they
+are read, and new values are compressed with the same dictionary.  The
+--decompress option puts the values back the way they were.
+
+The --layout option changes the layout of the database first, with the
+dedup layout each distinct value is stored once and the rows refer to it
+by its hash.
+"""
+
+import os
+
+from bacpypes.debugging import ModuleLogger
+from bacpypes.consolelogging import ArgumentParser
+
+from db import Snapshot, zstandard, ROWS_LAYOUT, DEDUP_LAYOUT
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+
+#
+#   __main__
+#
+
+
+def main():
+    # parse the command line arguments
+    parser = ArgumentParser(description=__doc__)
+
+    parser.add_argument("dbname", help="database file name")
+
+    parser.add_argument(
+        "--dict-size",
+        type=int,
+        default=16384,
+        help="dictionary size in bytes, default 16384",
+    )
+    parser.add_argument(
+        "--samples",
+        type=int,
+        default=100000,
+        help="number of values to train the dictionary with, default 100000",
+    )
+    parser.add_argument(
+        "--level", type=int, default=3, help="compression level, default 3"
+    )
+    parser.add_argument(
+        "--decompress", action="store_true", help="decompress the values"
+    )
+    parser.add_argument(
+        "--layout", help="change the layout", choices=(ROWS_LAYOUT, DEDUP_LAYOUT)
+    )
+
+    args = parser.parse_args()
+
+    if _debug:
+        _log.debug("initialization")
+    if _debug:
+        _log.debug("    - args: %r", args)
+
+    if zstandard is None:
+        parser.error("zstandard is required")
+    if not os.path.isfile(args.dbname):
+        parser.error("no such database: {}".format(args.dbname))
+
+    before = os.path.getsize(args.dbname)
+
+    snapshot = Snapshot(args.dbname)
+
+    _log.debug("running")
+
+    if args.layout:
+        snapshot.set_layout(args.layout)
+
+    if args.decompress:
+        snapshot.decompress()
+    else:
+        try:
+            snapshot.compress(args.dict_size, args.samples, args.level)
+        except zstandard.ZstdError as err:
+            parser.error("unable to train the dictionary: {}".format(err))
+
+    # give back the values that are no longer used and the free pages
+    snapshot.prune()
+    snapshot.connection.execute("vacuum")
+
+    _log.debug("fini")
+
+    snapshot.close()
+
+    after = os.path.getsize(args.dbname)
+    print("{} bytes, was {} bytes".format(after, before))
+
+
+if __name__ == "__main__":
+    main()
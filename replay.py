@@ -9,18 +9,33 @@ and write commands (and rtn when it's needed).
 """
 
 import sys
+import json
+import math
+import time
+import random
 import argparse
 
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from fnmatch import fnmatchcase
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 from bacpypes.debugging import bacpypes_debugging, ModuleLogger
 from bacpypes.consolelogging import ArgumentParser
 from bacpypes.consolecmd import ConsoleCmd
 
 from bacpypes.core import run, deferred, enable_sleeping
-from bacpypes.comm import bind
+from bacpypes.comm import PDUData, bind
+from bacpypes.task import FunctionTask, RecurringTask, TaskManager
 
 from bacpypes.iocb import IOCB
 
-from bacpypes.pdu import Address, LocalBroadcast, GlobalBroadcast
+from bacpypes.pdu import Address, LocalBroadcast, GlobalBroadcast, PDU
+from bacpypes.npdu import NPDU
 from bacpypes.netservice import NetworkServiceAccessPoint, NetworkServiceElement
 from bacpypes.bvllservice import (
     BIPSimple,
@@ -38,16 +53,26 @@ from bacpypes.service.object import (
     ReadWritePropertyServices,
     ReadWritePropertyMultipleServices,
 )
+from bacpypes.service.cov import (
+    ChangeOfValueServices,
+    Subscription,
+    criteria_type_map,
+)
+from bacpypes.errors import ExecutionError
 
 from bacpypes.vlan import Network, Node
 
 from bacpypes.apdu import (
+    APDU,
+    UnconfirmedRequestPDU,
     SimpleAckPDU,
     ReadPropertyRequest,
     ReadPropertyACK,
     WritePropertyRequest,
     WhoIsRequest,
     IAmRequest,
+    ReadRangeACK,
+    decode_max_apdu_length_accepted,
 )
 from bacpypes.primitivedata import (
     Null,
@@ -63,11 +88,22 @@ from bacpypes.primitivedata import (
     Date,
     Time,
     ObjectIdentifier,
+    TagList,
+)
+from bacpypes.constructeddata import Array, Any, AnyAtomic, ListOf, SequenceOfAny
+from bacpypes.basetypes import (
+    BinaryPV,
+    DateTime,
+    ErrorType,
+    LogRecord,
+    LogRecordLogDatum,
+    LogMultipleRecord,
+    LogData,
+    LogDataLogData,
 )
-from bacpypes.constructeddata import Array, Any, AnyAtomic
 from bacpypes.object import get_object_class, get_datatype
 
-from db import Snapshot
+from db import Snapshot, DeviceRegistry, TrendHistory
 
 # some debugging
 _debug = 0
@@ -77,6 +113,18 @@ _log = ModuleLogger(globals())
 args = None
 this_device = None
 this_application = None
+snapshot = None
+
+# device addresses and capabilities
+registry = None
+
+# captured trend log records
+trend_history = None
+
+# log buffers that can be read with ReadRange, and the size (in octets) of
+# the parts of the acknowledgement other than the records
+TREND_LOG_TYPES = ("trendLog", "trendLogMultiple")
+READ_RANGE_ACK_OVERHEAD = 24
 
 
 class ConfigurationError(RuntimeError):
@@ -379,6 +427,437 @@ class VLANConsoleCmd(ConsoleCmd):
         )
 
 
+#
+#   SubscriptionWheel
+#
+
+
+@bacpypes_debugging
+class SubscriptionWheel(RecurringTask):
+    """
+    A timer wheel with one second slots that is shared by all of the COV
+    subscriptions of the replayed devices, adding and removing a subscription
+    does not touch the task manager.  Lifetimes longer than the wheel wait
+    for the slot to come around again.
+    """
+
+    def __init__(self, size=3600):
+        if _debug:
+            SubscriptionWheel._debug("__init__ size=%r", size)
+        RecurringTask.__init__(self, 1000)
+
+        self.tick = 0
+        self.slots = [set() for _ in range(size)]
+
+        self.install_task()
+
+    def add(self, cov, delta):
+        if _debug:
+            SubscriptionWheel._debug("add %r %r", cov, delta)
+
+        cov._wheel_tick = self.tick + max(1, int(math.ceil(delta)))
+        self.slots[cov._wheel_tick % len(self.slots)].add(cov)
+
+    def remove(self, cov):
+        if _debug:
+            SubscriptionWheel._debug("remove %r", cov)
+
+        self.slots[cov._wheel_tick % len(self.slots)].discard(cov)
+
+    def process_task(self):
+        self.tick += 1
+
+        slot = self.slots[self.tick % len(self.slots)]
+        expired = [cov for cov in slot if cov._wheel_tick <= self.tick]
+        for cov in expired:
+            if _debug:
+                SubscriptionWheel._debug("    - expired: %r", cov)
+
+            slot.discard(cov)
+            cov.isScheduled = False
+            cov.process_task()
+
+
+#
+#   ReplaySubscription
+#
+
+
+@bacpypes_debugging
+class ReplaySubscription(Subscription):
+    """
+    A COV subscription that expires from the shared subscription wheel rather
+    than being a task of its own.
+    """
+
+    wheel = None
+
+    def install_task(self, when=None, delta=None):
+        if _debug:
+            ReplaySubscription._debug("install_task when=%r delta=%r", when, delta)
+
+        # the wheel is made with the first subscription
+        if ReplaySubscription.wheel is None:
+            ReplaySubscription.wheel = SubscriptionWheel()
+
+        current_time = TaskManager().get_time()
+        if delta is None:
+            delta = when - current_time
+
+        # the task time is used for the time remaining
+        self.taskTime = current_time + delta
+        self.wheel.add(self, delta)
+        self.isScheduled = True
+
+    def suspend_task(self):
+        if _debug:
+            ReplaySubscription._debug("suspend_task")
+
+        if self.isScheduled:
+            self.wheel.remove(self)
+            self.isScheduled = False
+
+
+#
+#   ReplayChangeOfValueServices
+#
+
+
+@bacpypes_debugging
+class ReplayChangeOfValueServices(ChangeOfValueServices):
+    """
+    Change of value services where the subscriptions are replay subscriptions.
+    Notifications are sent when a property changes, either from a write or
+    from the value dynamics.
+    """
+
+    def do_SubscribeCOVRequest(self, apdu):
+        if _debug:
+            ReplayChangeOfValueServices._debug("do_SubscribeCOVRequest %r", apdu)
+
+        self.subscribe_cov(apdu, None)
+
+    def do_SubscribeCOVPropertyRequest(self, apdu):
+        if _debug:
+            ReplayChangeOfValueServices._debug(
+                "do_SubscribeCOVPropertyRequest %r", apdu
+            )
+
+        self.subscribe_cov(apdu, apdu.covIncrement)
+
+    def subscribe_cov(self, apdu, cov_inc):
+        if _debug:
+            ReplayChangeOfValueServices._debug("subscribe_cov %r %r", apdu, cov_inc)
+
+        # extract the pieces
+        client_addr = apdu.pduSource
+        proc_id = apdu.subscriberProcessIdentifier
+        obj_id = apdu.monitoredObjectIdentifier
+        confirmed = apdu.issueConfirmedNotifications
+        lifetime = apdu.lifetime
+
+        # request is to cancel the subscription
+        cancel_subscription = (confirmed is None) and (lifetime is None)
+
+        # find the object
+        obj = self.get_object_id(obj_id)
+        if not obj:
+            raise ExecutionError(errorClass="object", errorCode="unknownObject")
+
+        # check to see if the object supports COV
+        if not obj._object_supports_cov:
+            raise ExecutionError(
+                errorClass="services", errorCode="covSubscriptionFailed"
+            )
+
+        # look for an algorithm already associated with this object, if there
+        # isn't one, make one and associate it with the object
+        cov_detection = self.cov_detections.get(obj, None)
+        if not cov_detection:
+            criteria_class = criteria_type_map.get(obj_id[0], None)
+            if not criteria_class:
+                raise ExecutionError(
+                    errorClass="services", errorCode="covSubscriptionFailed"
+                )
+
+            # objects captured without a COV increment report every change
+            if ("covIncrement" in criteria_class.properties_tracked) and (
+                obj._values.get("covIncrement") is None
+            ):
+                obj._values["covIncrement"] = 0.0
+
+            cov_detection = criteria_class(obj)
+            self.cov_detections[obj] = cov_detection
+        if _debug:
+            ReplayChangeOfValueServices._debug("    - cov_detection: %r", cov_detection)
+
+        # update the subscription if there is one, make one if there isn't
+        cov = cov_detection.cov_subscriptions.find(client_addr, proc_id, obj_id)
+        if cov:
+            if cancel_subscription:
+                self.cancel_subscription(cov)
+            else:
+                cov.renew_subscription(lifetime)
+        elif not cancel_subscription:
+            cov = ReplaySubscription(
+                obj, client_addr, proc_id, obj_id, confirmed, lifetime, cov_inc
+            )
+            self.add_subscription(cov)
+        if _debug:
+            ReplayChangeOfValueServices._debug("    - cov: %r", cov)
+
+        # success
+        self.response(SimpleAckPDU(context=apdu))
+
+        # new or renewed subscriptions get a notification
+        if not cancel_subscription:
+            deferred(cov_detection.send_cov_notifications, cov)
+
+
+#
+#   TrendLogBuffer
+#
+
+
+def log_timestamp(when):
+    """Return the DateTime of a log record from seconds since the epoch, the
+    date and time are not specified when it is None."""
+    if when is None:
+        return DateTime(date=(255, 255, 255, 255), time=(255, 255, 255, 255))
+
+    tm = time.localtime(when)
+    hundredths = min(int(round((when % 1.0) * 100)), 99)
+    return DateTime(
+        date=(tm.tm_year - 1900, tm.tm_mon, tm.tm_mday, tm.tm_wday + 1),
+        time=(tm.tm_hour, tm.tm_min, tm.tm_sec, hundredths),
+    )
+
+
+def log_datum(datum_class, kind, value_real, value_int, value_text):
+    """Return the datum of a log record from a row of the history."""
+    if kind in ("realValue", "timeChange"):
+        value = value_real
+    elif kind == "booleanValue":
+        value = bool(value_int)
+    elif kind in ("enumValue", "unsignedValue", "signedValue"):
+        value = value_int
+    elif kind in ("logStatus", "bitstringValue"):
+        value = [int(bit) for bit in value_text]
+    elif kind == "failure":
+        error_class, error_code = value_text.split(":")
+        value = ErrorType(errorClass=error_class, errorCode=error_code)
+    elif kind == "anyValue":
+        value = Any()
+        value.tagList.decode(PDUData(bytes.fromhex(value_text)))
+    else:
+        value = ()
+    return datum_class(**{kind: value})
+
+
+@bacpypes_debugging
+class TrendLogBuffer:
+    """The log buffer of a trend log or trend log multiple object, the
+    records are loaded from the history when it is first read and the log
+    records are built from the rows when they are returned."""
+
+    def __init__(self, objtype, rows):
+        if _debug:
+            TrendLogBuffer._debug("__init__ %r %r", objtype, len(rows))
+
+        self.multiple = objtype == "trendLogMultiple"
+        self.record_class = LogMultipleRecord if self.multiple else LogRecord
+
+        # the sequence numbers and times of the records for searching, and
+        # the history rows of each one
+        self.sequences = []
+        self.times = []
+        self.rows = []
+        for row in rows:
+            if self.sequences and (self.sequences[-1] == row[0]):
+                self.rows[-1].append(row)
+            else:
+                self.sequences.append(row[0])
+                self.times.append(row[2] or 0.0)
+                self.rows.append([row])
+
+    def __len__(self):
+        return len(self.sequences)
+
+    def record(self, i):
+        """Return the log record at a position in the buffer."""
+        rows = self.rows[i]
+        timestamp = log_timestamp(rows[0][2])
+
+        if not self.multiple:
+            _, _, _, kind, value_real, value_int, value_text, status_flags = rows[0]
+            record = LogRecord(
+                timestamp=timestamp,
+                logDatum=log_datum(
+                    LogRecordLogDatum, kind, value_real, value_int, value_text
+                ),
+            )
+            if status_flags is not None:
+                record.statusFlags = [(status_flags >> bit) & 1 for bit in range(4)]
+            return record
+
+        kind = rows[0][3]
+        if kind in ("logStatus", "timeChange"):
+            log_data = log_datum(LogData, *rows[0][3:7])
+        else:
+            log_data = LogData(
+                logData=LogData.choiceElements[1].klass(
+                    [
+                        log_datum(LogDataLogData, *row[3:7])
+                        for row in rows
+                        if row[3] != "logData"
+                    ]
+                )
+            )
+        return LogMultipleRecord(timestamp=timestamp, logData=log_data)
+
+    def select(self, range_spec):
+        """Return the (start, stop) positions of the records that match the
+        range of a ReadRange request, all of them when there is no range."""
+        count = len(self.sequences)
+        if range_spec is None:
+            return 0, count
+
+        if range_spec.byPosition is not None:
+            index = range_spec.byPosition.referenceIndex
+            if (index < 1) or (index > count):
+                return 0, 0
+            key, start, stop = range_spec.byPosition.count, index - 1, index
+        elif range_spec.bySequenceNumber is not None:
+            reference = range_spec.bySequenceNumber.referenceSequenceNumber
+            key = range_spec.bySequenceNumber.count
+            start = bisect_left(self.sequences, reference)
+            stop = bisect_right(self.sequences, reference)
+        else:
+            reference = range_spec.byTime.referenceTime
+            when = time.mktime(
+                (reference.date[0] + 1900, reference.date[1], reference.date[2])
+                + tuple(reference.time[:3])
+                + (0, 0, -1)
+            )
+            if reference.time[3] != 255:
+                when += reference.time[3] / 100.0
+            key = range_spec.byTime.count
+            start = stop = bisect_right(self.times, when)
+            if key < 0:
+                start = stop = bisect_left(self.times, when)
+
+        # a positive count starts at the reference, negative ones end there
+        if key >= 0:
+            return start, min(start + key, count)
+        return max(stop + key, 0), stop
+
+
+#
+#   ReplayReadRangeServices
+#
+
+
+@bacpypes_debugging
+class ReplayReadRangeServices:
+    """
+    ReadRange of the log buffers of trend log and trend log multiple
+    objects from the records that were captured, as many as fit in the
+    response.
+    """
+
+    def do_ReadRangeRequest(self, apdu):
+        if _debug:
+            ReplayReadRangeServices._debug("do_ReadRangeRequest %r", apdu)
+
+        # find the object
+        obj_id = apdu.objectIdentifier
+        obj = self.get_object_id(obj_id)
+        if not obj:
+            raise ExecutionError(errorClass="object", errorCode="unknownObject")
+
+        # only log buffers are lists of records
+        if (obj_id[0] not in TREND_LOG_TYPES) or (
+            apdu.propertyIdentifier != "logBuffer"
+        ):
+            raise ExecutionError(errorClass="services", errorCode="propertyIsNotAList")
+        if apdu.propertyArrayIndex is not None:
+            raise ExecutionError(
+                errorClass="property", errorCode="propertyIsNotAnArray"
+            )
+
+        # load the records the first time
+        log_buffer = self.log_buffers.get(obj_id)
+        if log_buffer is None:
+            log_buffer = self.log_buffers[obj_id] = TrendLogBuffer(
+                obj_id[0],
+                trend_history.records(self.device_id, "{}:{}".format(*obj_id)),
+            )
+
+        start, stop = log_buffer.select(apdu.range)
+        if _debug:
+            ReplayReadRangeServices._debug("    - start, stop: %r, %r", start, stop)
+
+        # the kind of range has the count, negative counts end at the reference
+        range_spec = apdu.range
+        reference = range_spec and (
+            range_spec.byPosition or range_spec.bySequenceNumber or range_spec.byTime
+        )
+        negative = (reference is not None) and (reference.count < 0)
+
+        # take records until the response is full, nearest the reference first
+        space = (
+            min(
+                decode_max_apdu_length_accepted(apdu.apduMaxResp),
+                self.localDevice.maxApduLengthAccepted,
+            )
+            - READ_RANGE_ACK_OVERHEAD
+        )
+        positions = range(start, stop)
+        if negative:
+            positions = reversed(positions)
+
+        records = []
+        for i in positions:
+            record = log_buffer.record(i)
+            tag_list = TagList()
+            record.encode(tag_list)
+            data = PDUData()
+            tag_list.encode(data)
+            space -= len(data.pduData)
+            if space < 0:
+                break
+            records.append((i, record))
+        if negative:
+            records.reverse()
+        more_items = len(records) < (stop - start)
+        if records:
+            start, stop = records[0][0], records[-1][0] + 1
+
+        # build the response
+        item_data = SequenceOfAny()
+        item_data.cast_in(
+            ListOf(log_buffer.record_class)([record for _, record in records])
+        )
+        resp = ReadRangeACK(
+            context=apdu,
+            objectIdentifier=obj_id,
+            propertyIdentifier="logBuffer",
+            resultFlags=[
+                int(bool(records) and (start == 0)),
+                int(bool(records) and (stop == len(log_buffer))),
+                int(more_items),
+            ],
+            itemCount=len(records),
+            itemData=item_data,
+        )
+        if records and (reference is not None) and (range_spec.byPosition is None):
+            resp.firstSequenceNumber = log_buffer.sequences[start]
+        if _debug:
+            ReplayReadRangeServices._debug("    - resp: %r", resp)
+
+        self.response(resp)
+
+
 #
 #   ReplayApplication
 #
@@ -390,6 +869,8 @@ class ReplayApplication(
     WhoIsIAmServices,
     ReadWritePropertyServices,
     ReadWritePropertyMultipleServices,
+    ReplayChangeOfValueServices,
+    ReplayReadRangeServices,
 ):
     def __init__(self, device_id, aseID=None):
         if _debug:
@@ -398,6 +879,9 @@ class ReplayApplication(
 
         # save our device identifier for searching later
         self.device_id = device_id
+
+        # object identifier: trend log buffer, loaded when it is read
+        self.log_buffers = {}
         device_object_id = "device:{}".format(device_id)
 
         # extract some pieces
@@ -418,7 +902,7 @@ class ReplayApplication(
             objectIdentifier=("device", device_id),
             vendorIdentifier=vendor_identifier,
         )
-        for d, o, p, v in snapshot.items(device_id, device_object_id):
+        for d, o, p, v in snapshot.items(device_id, device_object_id, cache=False):
             if _debug:
                 ReplayApplication._debug("    - item: %r", (d, o, p, v))
 
@@ -460,9 +944,10 @@ class ReplayApplication(
         # bind the top layers
         bind(self, self.asap, self.smap, self.nsap)
 
-        # look for objects and properties
+        # look for objects and properties, the values become the property
+        # values of the objects so they are not shared
         obj_prop_map = {}
-        for d, o, p, v in snapshot.items(device_id):
+        for d, o, p, v in snapshot.items(device_id, cache=False):
             if (o == "-") or (o == device_object_id):
                 continue
             if _debug:
@@ -588,13 +1073,598 @@ class VLANNode:
         self.rapp.nsap.bind(self.vlan_node)
 
 
+#
+#   WhoIsDispatcher
+#
+
+
+@bacpypes_debugging
+class WhoIsDispatcher:
+    """
+    Keep a sorted index of the device instances of the replayed applications
+    on each VLAN network and answer a Who-Is by asking only the matching
+    applications for an I-Am, optionally spread out over a random delay.
+    """
+
+    def __init__(self, jitter=0.0):
+        if _debug:
+            WhoIsDispatcher._debug("__init__ jitter=%r", jitter)
+
+        # maximum random delay before sending an I-Am
+        self.jitter = jitter
+
+        # network number to parallel lists of instances and applications
+        self.instances = {}
+        self.applications = {}
+
+    def add_application(self, network_number, rapp):
+        if _debug:
+            WhoIsDispatcher._debug("add_application %r %r", network_number, rapp)
+
+        device_instance = rapp.localDevice.objectIdentifier[1]
+
+        instances = self.instances.setdefault(network_number, [])
+        applications = self.applications.setdefault(network_number, [])
+
+        # keep the lists sorted by device instance
+        i = bisect_right(instances, device_instance)
+        instances.insert(i, device_instance)
+        applications.insert(i, rapp)
+
+    def who_is(self, network_number, low_limit, high_limit, address):
+        if _debug:
+            WhoIsDispatcher._debug(
+                "who_is %r %r %r %r", network_number, low_limit, high_limit, address
+            )
+
+        instances = self.instances.get(network_number)
+        if not instances:
+            return
+
+        # both limits or neither
+        if (low_limit is None) and (high_limit is None):
+            i, j = 0, len(instances)
+        elif (low_limit is None) or (high_limit is None):
+            if _debug:
+                WhoIsDispatcher._debug("    - missing limit")
+            return
+        else:
+            i = bisect_left(instances, low_limit)
+            j = bisect_right(instances, high_limit)
+        if _debug:
+            WhoIsDispatcher._debug("    - matches: %r", j - i)
+
+        for rapp in self.applications[network_number][i:j]:
+            if self.jitter:
+                task = FunctionTask(rapp.i_am, address=address)
+                task.install_task(delta=random.uniform(0.0, self.jitter))
+            else:
+                rapp.i_am(address=address)
+
+
+def decode_who_is(pdu):
+    """
+    Return the Who-Is request and its source if the PDU going around on a VLAN
+    is one, otherwise None.
+    """
+    npdu = NPDU()
+    npdu.decode(
+        PDU(
+            bytes(pdu.pduData), source=pdu.pduSource, destination=pdu.pduDestination
+        )
+    )
+    if npdu.npduNetMessage is not None:
+        return None
+
+    apdu = APDU()
+    apdu.decode(npdu)
+    if (apdu.apduType != UnconfirmedRequestPDU.pduType) or (
+        apdu.apduService != WhoIsRequest.serviceChoice
+    ):
+        return None
+
+    who_is = WhoIsRequest()
+    who_is.decode(apdu)
+
+    # the I-Am goes back to the original source
+    who_is.pduSource = npdu.npduSADR or npdu.pduSource
+
+    return who_is
+
+
+#
+#   ReplayNetwork
+#
+
+
+@bacpypes_debugging
+class ReplayNetwork(Network):
+    """
+    A VLAN where the broadcast Who-Is requests coming from the router are
+    given to a dispatcher rather than a copy being sent to every node.
+    """
+
+    def __init__(self, network_number, router_address, dispatcher=None):
+        if _debug:
+            ReplayNetwork._debug(
+                "__init__ %r %r dispatcher=%r",
+                network_number,
+                router_address,
+                dispatcher,
+            )
+        Network.__init__(
+            self, name=str(network_number), broadcast_address=LocalBroadcast()
+        )
+
+        self.network_number = network_number
+        self.router_address = router_address
+        self.dispatcher = dispatcher
+
+    def process_pdu(self, pdu):
+        if _debug:
+            ReplayNetwork._debug("process_pdu(%s) %r", self.name, pdu)
+
+        if (
+            self.dispatcher
+            and (pdu.pduDestination == self.broadcast_address)
+            and (pdu.pduSource == self.router_address)
+        ):
+            try:
+                who_is = decode_who_is(pdu)
+            except Exception as err:
+                if _debug:
+                    ReplayNetwork._debug("    - decoding error: %r", err)
+                who_is = None
+
+            if who_is:
+                if _debug:
+                    ReplayNetwork._debug("    - who_is: %r", who_is)
+                self.dispatcher.who_is(
+                    self.network_number,
+                    who_is.deviceInstanceRangeLowLimit,
+                    who_is.deviceInstanceRangeHighLimit,
+                    who_is.pduSource,
+                )
+                return
+
+        Network.process_pdu(self, pdu)
+
+
+#
+#   ValueDynamics
+#
+
+# kinds of present values
+ANALOG, BINARY, MULTISTATE = range(3)
+
+# models of how they change
+FROZEN, WALK, SINE, HISTORY = range(4)
+
+
+@bacpypes_debugging
+class ValueDynamics(RecurringTask):
+    """
+    Change the present values of the replayed objects every tick.  The state
+    of every point is kept in NumPy arrays indexed by the object slot so all
+    of the points are updated together, only the values that have changed
+    are given back to the objects.
+
+    The configuration is a JSON object with an optional interval (seconds),
+    seed, and a list of rules, the first rule that matches an object applies:
+
+        {"interval": 1.0, "rules": [
+            {"objects": "analogInput:*", "model": "sine", "amplitude": 5,
+             "period": 600},
+            {"devices": [2003], "objects": "binaryValue:*", "model": "walk",
+             "step": 0.2},
+            {"objects": "analogValue:1", "model": "history",
+             "values": [70.1, 70.4, 71.0]}
+        ]}
+    """
+
+    models = {"frozen": FROZEN, "walk": WALK, "sine": SINE, "history": HISTORY}
+
+    def __init__(self, config):
+        if _debug:
+            ValueDynamics._debug("__init__ %r", config)
+        if np is None:
+            raise ConfigurationError("value dynamics requires numpy")
+
+        self.interval = float(config.get("interval", 1.0))
+        if self.interval <= 0.0:
+            raise ConfigurationError("value dynamics interval must be positive")
+        RecurringTask.__init__(self, self.interval * 1000.0)
+
+        self.rules = config.get("rules", [])
+        for rule in self.rules:
+            if rule.get("model", "frozen") not in self.models:
+                raise ConfigurationError(
+                    "value dynamics model: {!r}".format(rule.get("model"))
+                )
+
+        self.random = np.random.default_rng(config.get("seed"))
+        self.tick = 0
+
+        # the objects by slot, the arrays are built when starting
+        self.objects = []
+        self._slots = []
+        self._history = []
+        self._history_length = 0
+
+    def match(self, device_id, obj):
+        """Return the first rule that applies to an object, or None."""
+        object_id = "{}:{}".format(*obj.objectIdentifier)
+        for rule in self.rules:
+            if ("devices" in rule) and (device_id not in rule["devices"]):
+                continue
+            if not fnmatchcase(object_id, rule.get("objects", "*")):
+                continue
+            return rule
+
+        return None
+
+    def add_application(self, rapp):
+        if _debug:
+            ValueDynamics._debug("add_application %r", rapp)
+
+        for obj in rapp.iter_objects():
+            rule = self.match(rapp.device_id, obj)
+            if not rule:
+                continue
+            model = self.models[rule.get("model", "frozen")]
+            if model == FROZEN:
+                continue
+
+            # figure out what kind of present value it has
+            datatype = get_datatype(obj.objectType, "presentValue")
+            if not datatype:
+                continue
+
+            present_value = obj._values.get("presentValue")
+            if present_value is None:
+                continue
+
+            if issubclass(datatype, (Real, Double)):
+                kind = ANALOG
+                value = float(present_value)
+                low = rule.get("low", -math.inf)
+                high = rule.get("high", math.inf)
+            elif issubclass(datatype, BinaryPV):
+                kind = BINARY
+                value = 1.0 if present_value == "active" else 0.0
+                low, high = 0.0, 1.0
+            elif obj.objectType.startswith("multiState"):
+                kind = MULTISTATE
+                value = float(present_value)
+                low = 1.0
+                high = float(obj._values.get("numberOfStates") or present_value)
+            else:
+                continue
+
+            # recorded samples are kept together, each slot has a window
+            values = rule.get("values", []) if model == HISTORY else []
+            if (model == HISTORY) and (not values):
+                continue
+
+            self._slots.append(
+                (
+                    kind,
+                    model,
+                    value,
+                    float(low),
+                    float(high),
+                    float(rule.get("step", 1.0)),
+                    float(rule.get("amplitude", 1.0)),
+                    2.0 * math.pi / float(rule.get("period", 60.0)),
+                    rule.get("phase"),
+                    self._history_length,
+                    len(values),
+                )
+            )
+            self._history.append(values)
+            self._history_length += len(values)
+            self.objects.append(obj)
+
+    def start(self):
+        if _debug:
+            ValueDynamics._debug("start")
+
+        (
+            kind,
+            model,
+            center,
+            low,
+            high,
+            step,
+            amplitude,
+            omega,
+            phase,
+            offset,
+            length,
+        ) = zip(*self._slots) if self._slots else ((),) * 11
+        del self._slots
+
+        self.kind = np.array(kind, dtype=np.int8)
+        self.center = np.array(center, dtype=np.float64)
+        self.state = self.center.copy()
+        self.low = np.array(low, dtype=np.float64)
+        self.high = np.array(high, dtype=np.float64)
+        self.step = np.array(step, dtype=np.float64)
+        self.amplitude = np.array(amplitude, dtype=np.float64)
+        self.omega = np.array(omega, dtype=np.float64) * self.interval
+        self.phase = np.array(
+            [
+                self.random.uniform(0.0, 2.0 * math.pi) if p is None else p
+                for p in phase
+            ],
+            dtype=np.float64,
+        )
+        self.history = np.array(
+            [sample for history in self._history for sample in history],
+            dtype=np.float64,
+        )
+        self.offset = np.array(offset, dtype=np.int64)
+        self.length = np.array(length, dtype=np.int64)
+        del self._history
+
+        # slots of each model and kind
+        model = np.array(model, dtype=np.int8)
+        self.walk_slots = np.flatnonzero(model == WALK)
+        self.sine_slots = np.flatnonzero(model == SINE)
+        self.history_slots = np.flatnonzero(model == HISTORY)
+        self.binary_slots = np.flatnonzero(self.kind == BINARY)
+        self.multistate_slots = np.flatnonzero(self.kind == MULTISTATE)
+
+        # what the objects have now
+        self.output = self.present(self.state)
+        if _debug:
+            ValueDynamics._debug("    - slots: %r", len(self.objects))
+
+        self.install_task()
+
+    def present(self, state):
+        """Map the continuous state to the values the objects present."""
+        output = state.copy()
+        output[self.binary_slots] = state[self.binary_slots] >= 0.5
+        output[self.multistate_slots] = np.rint(state[self.multistate_slots])
+        return output
+
+    def process_task(self):
+        if _debug:
+            ValueDynamics._debug("process_task")
+        self.tick += 1
+
+        state = self.state
+
+        slots = self.walk_slots
+        state[slots] += self.random.standard_normal(len(slots)) * self.step[slots]
+
+        slots = self.sine_slots
+        state[slots] = self.center[slots] + self.amplitude[slots] * np.sin(
+            self.omega[slots] * self.tick + self.phase[slots]
+        )
+
+        slots = self.history_slots
+        state[slots] = self.history[
+            self.offset[slots] + (self.tick % self.length[slots])
+        ]
+
+        np.clip(state, self.low, self.high, out=state)
+
+        # give the changed values to the objects
+        output = self.present(state)
+        changed = np.flatnonzero(output != self.output)
+        self.output = output
+        if _debug:
+            ValueDynamics._debug("    - changed: %r", len(changed))
+
+        self.update_objects(
+            changed.tolist(), output[changed].tolist(), self.kind[changed].tolist()
+        )
+
+    def update_objects(self, slots, values, kinds):
+        objects = self.objects
+        for slot, value, kind in zip(slots, values, kinds):
+            if kind == BINARY:
+                value = "active" if value else "inactive"
+            elif kind == MULTISTATE:
+                value = int(value)
+
+            obj = objects[slot]
+            if "presentValue" in obj._property_monitors:
+                obj.presentValue = value
+            else:
+                obj._values["presentValue"] = value
+
+
+#
+#   Topology
+#
+
+
+def load_topology(filename):
+    """
+    Read a topology file.  It is a JSON object where the keys are VLAN
+    network numbers and the values are either a list of device identifiers,
+    which are given addresses in sequence, or an object that maps node
+    addresses to device identifiers, for example:
+
+        {"30": [3001, 3002], "40": {"5": 4005, "6": 4006}}
+    """
+    if _debug:
+        _log.debug("load_topology %r", filename)
+
+    try:
+        with open(filename) as topology_file:
+            content = json.load(topology_file)
+    except (OSError, ValueError) as err:
+        raise ConfigurationError(f"topology file {filename}: {err}")
+
+    topology = OrderedDict()
+    for network_number, devices in content.items():
+        try:
+            network_number = int(network_number)
+            if isinstance(devices, dict):
+                node_list = [
+                    (Address(node_address), int(device_id))
+                    for node_address, device_id in devices.items()
+                ]
+            else:
+                node_list = [(None, int(device_id)) for device_id in devices]
+        except (TypeError, ValueError) as err:
+            raise ConfigurationError(f"topology file {filename}: {err}")
+
+        topology.setdefault(network_number, []).extend(node_list)
+
+    return topology
+
+
+def site_topology(device_ids, local_network, vlan_network):
+    """
+    Put the devices on the networks where they were found during discovery,
+    devices that were found on the local network of the snapshot application
+    (or have no address) go on the VLAN network.
+    """
+    if _debug:
+        _log.debug("site_topology %r %r %r", device_ids, local_network, vlan_network)
+
+    topology = OrderedDict()
+    for device_id in device_ids:
+        device_address = registry.address(device_id)
+        if _debug:
+            _log.debug("    - device_id, address: %r, %r", device_id, device_address)
+
+        if (
+            device_address
+            and (device_address.addrType == Address.remoteStationAddr)
+            and (device_address.addrNet != local_network)
+        ):
+            network_number = device_address.addrNet
+            node_address = Address(device_address.addrAddr)
+        else:
+            network_number = vlan_network
+            node_address = None
+
+        topology.setdefault(network_number, []).append((node_address, device_id))
+
+    return topology
+
+
+def build_topology(args, local_network, vlan_network):
+    """
+    Return an ordered dict of the VLAN network numbers and a list of the
+    (address, device identifier) tuples on the network, the first one is the
+    router node.
+    """
+    if _debug:
+        _log.debug("build_topology %r %r", local_network, vlan_network)
+
+    # there is always the VLAN network even if there are no devices on it
+    topology = OrderedDict([(vlan_network, [])])
+
+    if args.site_topology:
+        device_topology = site_topology(args.devid[1:], local_network, vlan_network)
+    else:
+        device_topology = {
+            vlan_network: [(None, device_id) for device_id in args.devid[1:]]
+        }
+
+    if args.topology:
+        file_topology = load_topology(args.topology)
+    else:
+        file_topology = {}
+
+    for partial_topology in (device_topology, file_topology):
+        for network_number, node_list in partial_topology.items():
+            topology.setdefault(network_number, []).extend(node_list)
+
+    if local_network in topology:
+        raise ConfigurationError(f"network {local_network} is the local network")
+
+    # check for devices that would be replayed more than once
+    device_ids = set([args.devid[0]])
+    for node_list in topology.values():
+        for _, device_id in node_list:
+            if device_id in device_ids:
+                raise ConfigurationError(f"device {device_id}: already replayed")
+            device_ids.add(device_id)
+
+    # fill in the addresses that are not already assigned
+    for network_number, node_list in topology.items():
+        used_addresses = set()
+        for node_address, device_id in node_list:
+            if node_address is None:
+                continue
+            if node_address in used_addresses:
+                raise ConfigurationError(
+                    f"network {network_number}: duplicate address {node_address}"
+                )
+            used_addresses.add(node_address)
+
+        # router is first, normally address 1, then the rest in sequence
+        address_list = []
+        next_address = 1
+        for node_address, device_id in [(None, None)] + node_list:
+            if node_address is None:
+                while Address(next_address) in used_addresses:
+                    next_address += 1
+                node_address = Address(next_address)
+                used_addresses.add(node_address)
+            address_list.append((node_address, device_id))
+
+        topology[network_number] = address_list
+
+    return topology
+
+
+def build_networks(router_app, topology, iam_jitter=0.0, dynamics=None):
+    """
+    Make a VLAN for each network in the topology, bind the router application
+    to each of them and make the replayed devices.  Return the list of
+    VLANNode objects.
+    """
+    if _debug:
+        _log.debug("build_networks %r %r", router_app, topology)
+
+    # the I-Am responses to broadcast Who-Is requests come from here
+    dispatcher = WhoIsDispatcher(iam_jitter)
+
+    vlan_nodes = []
+    for network_number, node_list in topology.items():
+        vlan = ReplayNetwork(network_number, node_list[0][0], dispatcher)
+
+        # create a node for the router, bind the router stack to the vlan
+        # network through this node
+        router_node = Node(node_list[0][0])
+        vlan.add_node(router_node)
+        router_app.nsap.bind(router_node, network_number)
+
+        # make some devices
+        for vlan_address, device_id in node_list[1:]:
+            _log.debug("    - vlan_address, device_id: %r, %r", vlan_address, device_id)
+
+            # make the replay application
+            vlan_app = VLANNode(vlan_address, device_id)
+            _log.debug("    - vlan_app: %r", vlan_app)
+
+            # add the node to the VLAN
+            vlan.add_node(vlan_app.vlan_node)
+            dispatcher.add_application(network_number, vlan_app.rapp)
+            if dynamics:
+                dynamics.add_application(vlan_app.rapp)
+
+            vlan_nodes.append(vlan_app)
+
+    return vlan_nodes
+
+
 #
 #   __main__
 #
 
 
 def main():
-    global args, snapshot, this_device, this_application
+    global args, snapshot, registry, trend_history, this_device, this_application
 
     # parse the command line arguments
     parser = ArgumentParser(
@@ -626,6 +1696,31 @@ def main():
         "devid", type=int, nargs="+", help="device identifiers",
     )
 
+    # add an option to read a topology file
+    parser.add_argument(
+        "--topology", type=str, help="topology file of additional VLAN networks",
+    )
+
+    # add an option to put devices on the networks they were found on
+    parser.add_argument(
+        "--site-topology",
+        action="store_true",
+        help="put devices on the networks recorded in the snapshot",
+    )
+
+    # add an option to spread out I-Am responses
+    parser.add_argument(
+        "--iam-jitter",
+        type=float,
+        help="maximum random delay of I-Am responses in seconds",
+        default=0.0,
+    )
+
+    # add an option to change present values
+    parser.add_argument(
+        "--dynamics", type=str, help="present value dynamics configuration file",
+    )
+
     # add an option to enable BBMD with BDT entries
     parser.add_argument(
         "--bbmd", type=str, nargs="+", help="enable BBMD with a list of peer addresses",
@@ -650,8 +1745,10 @@ def main():
         _log.debug("    - args: %r", args)
 
     try:
-        # open the snapshot database
+        # open the snapshot database and the device registry
         snapshot = Snapshot(args.dbname)
+        registry = DeviceRegistry(snapshot)
+        trend_history = TrendHistory(snapshot)
 
         # extract the address and networks
         local_address = Address(args.addr1)
@@ -661,37 +1758,37 @@ def main():
         # extract the first device identifier
         local_device_id = args.devid[0]
 
+        # figure out which devices go on which networks
+        topology = build_topology(args, local_network, vlan_network)
+        if _debug:
+            _log.debug("    - topology: %r", topology)
+
         # create the VLAN router, bind it to the local network
         router = VLANRouter(local_address, local_network, local_device_id)
 
-        # create a VLAN
-        vlan = Network(broadcast_address=LocalBroadcast())
-
-        # create a node for the router, address 1 on the VLAN
-        router_addr = Address(1)
-        router_node = Node(router_addr)
-        vlan.add_node(router_node)
-
         # console messages get directed to its application
         this_application = router.rapp
 
-        # bind the router stack to the vlan network through this node
-        router.rapp.nsap.bind(router_node, vlan_network)
-
-        # send network topology
-        deferred(router.rapp.nse.i_am_router_to_network)
+        # present values might change
+        if args.dynamics:
+            try:
+                with open(args.dynamics) as dynamics_file:
+                    dynamics = ValueDynamics(json.load(dynamics_file))
+            except (OSError, ValueError) as err:
+                raise ConfigurationError(f"dynamics file {args.dynamics}: {err}")
+            dynamics.add_application(router.rapp)
+        else:
+            dynamics = None
 
-        # make some devices
-        for i, device_id in enumerate(args.devid[1:]):
-            vlan_address = Address(i + 2)
-            _log.debug("    - vlan_address, device_id: %r, %r", vlan_address, device_id)
+        # make a VLAN for each network and the devices on them
+        build_networks(router.rapp, topology, args.iam_jitter, dynamics)
 
-            # make the replay application
-            vlan_app = VLANNode(vlan_address, device_id)
-            _log.debug("    - vlan_app: %r", vlan_app)
+        # start changing values
+        if dynamics:
+            dynamics.start()
 
-            # add the node to the VLAN
-            vlan.add_node(vlan_app.vlan_node)
+        # send network topology
+        deferred(router.rapp.nse.i_am_router_to_network)
     except ConfigurationError as err:
         sys.stderr.write(f"configuration err: {err}\n")
         sys.exit(1)
@@ -11,28 +11,58 @@ a sqlite3 database with the property values it finds.
 import sys
 import time
 import json
+import struct
+import threading
 
-from collections import defaultdict, OrderedDict
+from collections import defaultdict, deque, OrderedDict
+from fnmatch import fnmatchcase
 
 from bacpypes.debugging import bacpypes_debugging, ModuleLogger
 from bacpypes.consolelogging import ConfigArgumentParser
 from bacpypes.consolecmd import ConsoleCmd
 
-from bacpypes.pdu import Address, LocalBroadcast, GlobalBroadcast
-from bacpypes.comm import bind
+from bacpypes.pdu import Address, LocalBroadcast, RemoteBroadcast, GlobalBroadcast
+from bacpypes.comm import PDUData, bind
 from bacpypes.core import run, deferred, enable_sleeping
-from bacpypes.task import FunctionTask
+from bacpypes.task import FunctionTask, RecurringTask
 from bacpypes.iocb import IOCB, IOQController
 
 # application layer
-from bacpypes.primitivedata import Unsigned, ObjectIdentifier
-from bacpypes.constructeddata import Array, ArrayOf
-from bacpypes.basetypes import PropertyIdentifier, ServicesSupported
+from bacpypes.primitivedata import (
+    Tag,
+    Boolean,
+    Unsigned,
+    Integer,
+    Real,
+    Double,
+    BitString,
+    Enumerated,
+    ObjectIdentifier,
+    TagList,
+)
+from bacpypes.constructeddata import Array, ArrayOf, ListOf, Element
+from bacpypes.basetypes import (
+    PropertyIdentifier,
+    ServicesSupported,
+    DateTime,
+    LogData,
+    LogMultipleRecord,
+)
 from bacpypes.object import get_object_class, get_datatype, DeviceObject
 
 from bacpypes.app import ApplicationIOController
-from bacpypes.appservice import StateMachineAccessPoint, ApplicationServiceAccessPoint
+from bacpypes.appservice import (
+    StateMachineAccessPoint,
+    ApplicationServiceAccessPoint,
+    AWAIT_CONFIRMATION,
+)
 from bacpypes.apdu import (
+    ConfirmedRequestPDU,
+    ComplexAckPDU,
+    ErrorPDU,
+    RejectPDU,
+    AbortPDU,
+    AbortReason,
     WhoIsRequest,
     IAmRequest,
     ReadPropertyRequest,
@@ -41,6 +71,10 @@ from bacpypes.apdu import (
     PropertyReference,
     ReadAccessSpecification,
     ReadPropertyMultipleACK,
+    ReadRangeRequest,
+    Range,
+    RangeBySequenceNumber,
+    ReadRangeACK,
 )
 
 # network layer
@@ -64,7 +98,9 @@ from bacpypes.local.device import LocalDeviceObject
 from bacpypes.service.device import WhoIsIAmServices
 from bacpypes.service.object import ReadWritePropertyServices
 
-from db import Snapshot
+from db import Snapshot, ThreadedSnapshot
+from db import DeviceRegistry, RegisteredDevice, RegistryDeviceInfoCache
+from db import NetworkTopology, TimeSeries, TrendHistory
 
 # some debugging
 _debug = 0
@@ -76,17 +112,418 @@ this_device = None
 this_application = None
 snapshot = None
 
+# device addresses and capabilities
+registry = None
+
+# properties to read
+capture_profile = None
+
+# routers and the networks they reach
+topology = None
+
+# polled values
+time_series = None
+
+# trend log records
+trend_history = None
+
 # device information
 device_profile = defaultdict(DeviceObject)
 
 # print statements just for interactive
 interactive = sys.stdin.isatty()
 
+# requests in flight to the devices on a network start with a window of one
+# and grow up to the maximum, with a limit of requests in flight overall
+INITIAL_WINDOW = 1
+DEFAULT_MAX_WINDOW = 16
+MAX_ACTIVE = 256
+
+# priority classes of things to do, device information first so a skeleton
+# of the site (devices, object lists, object names) comes early
+DEVICE_PRIORITY = 0
+OBJECT_LIST_PRIORITY = 1
+NAME_PRIORITY = 2
+OTHER_PRIORITY = 3
+
+# properties read with the names
+NAME_PROPERTIES = ("objectName", "objectType", "propertyList")
+
+# items waiting this long (in seconds) are moved up a priority class so
+# they are not starved
+AGING_INTERVAL = 30.0
+
+# sizes (in octets) for fitting object list elements in a Read-Property-Multiple
+# acknowledgement, the smallest maximum APDU length is used when the maximum
+# for the device is not known
+MIN_APDU_LENGTH = 50
+OBJECT_LIST_ACK_OVERHEAD = 16
+OBJECT_LIST_ELEMENT_LENGTH = 12
+
+# time to wait for routers to answer (seconds), and the number of Who-Is
+# requests to networks that can be waiting for I-Am responses at once
+ROUTER_TIMEOUT = 3.0
+WHO_IS_ACTIVE_LIMIT = 8
+
+# polled properties when the configuration does not have them, the poller
+# wheel ticks once a second by default and each level of the wheel has slots
+# for 64 times the ticks of the level below
+POLL_PROPERTIES = ("presentValue", "statusFlags")
+DEFAULT_POLL_TICK = 1.0
+WHEEL_SLOTS = 64
+WHEEL_LEVELS = 4
+
+# sizes (in octets) for fitting polled values in a Read-Property-Multiple
+# acknowledgement
+POLL_ACK_OVERHEAD = 8
+POLL_OBJECT_LENGTH = 7
+POLL_PROPERTY_LENGTH = 10
+
+# the log buffers of these object types are read with ReadRange in pages of
+# records that fit in an acknowledgement, the records of a trend log
+# multiple are larger and the size depends on the number of items
+TREND_LOG_TYPES = ("trendLog", "trendLogMultiple")
+READ_RANGE_ACK_OVERHEAD = 24
+LOG_RECORD_LENGTH = 24
+LOG_MULTIPLE_RECORD_LENGTH = 64
+
+# pages of a log buffer that time out or are aborted are asked for again,
+# the ones that still fail are read by the next capture
+LOG_PAGE_RETRIES = 2
+
 # lists of things to do
 network_path_to_do_list = None
 who_is_to_do_list = None
 application_to_do_list = None
 
+# console commands waiting for the lists to make progress
+console_waits = None
+
+#
+#   Decoding
+#
+
+# (object type, property identifier, array index kind): datatype, the kind is
+# None for the whole property, 0 for the length and 1 for an element
+datatypes = {}
+
+
+def property_datatype(objtype, propid, index=None):
+    """Return the datatype to cast out a property value or an element of an
+    array property, None if it is not known."""
+    key = (objtype, propid, None if index is None else min(index, 1))
+    try:
+        return datatypes[key]
+    except KeyError:
+        pass
+
+    datatype = get_datatype(objtype, propid)
+
+    # special case for array parts, others are managed by cast_out
+    if datatype and (index is not None) and issubclass(datatype, Array):
+        datatype = Unsigned if index == 0 else datatype.subtype
+
+    datatypes[key] = datatype
+    return datatype
+
+
+def property_label(propid, index=None):
+    """Return the property identifier as it is saved in the snapshot."""
+    if index is None:
+        return str(propid)
+    return "{}[{}]".format(propid, index)
+
+
+def value_string(value):
+    """Return a value as a string to display."""
+    if hasattr(value, "dict_contents"):
+        return json.dumps(value.dict_contents(as_class=OrderedDict))
+    return str(value)
+
+
+def decode_value(objtype, propid, index, property_value):
+    """Return the decoded value and None, or None and a string describing
+    why it could not be decoded."""
+    datatype = property_datatype(objtype, propid, index)
+    if not datatype:
+        return None, "?"
+    try:
+        return property_value.cast_out(datatype), None
+    except Exception as err:
+        return None, "!" + str(err)
+
+
+def decode_results(apdu, display=None):
+    """Decode the results of a Read-Property-Multiple acknowledgement into
+    a list of (objid, propid, index, value), the value is None when it could
+    not be decoded and property access errors are skipped.  The values are
+    only turned into strings when there is a display function."""
+    rows = []
+    for result in apdu.listOfReadAccessResults:
+        objid = result.objectIdentifier
+        objtype = objid[0]
+
+        for element in result.listOfResults:
+            propid = element.propertyIdentifier
+            index = element.propertyArrayIndex
+            read_result = element.readResult
+
+            if read_result.propertyAccessError is not None:
+                if display:
+                    display(
+                        "{} ! {}".format(
+                            property_label(propid, index),
+                            read_result.propertyAccessError,
+                        )
+                    )
+                continue
+
+            value, error = decode_value(
+                objtype, propid, index, read_result.propertyValue
+            )
+            if display:
+                display(
+                    "{}: {}".format(
+                        property_label(propid, index), error or value_string(value)
+                    )
+                )
+
+            rows.append((objid, propid, index, value))
+
+    return rows
+
+
+def snapshot_rows(devid, rows):
+    """Generate the (item, value) rows for the snapshot from decoded rows."""
+    for objid, propid, index, value in rows:
+        yield (devid, "{}:{}".format(*objid), property_label(propid, index)), value
+
+
+# application tags of the polled values that are real numbers and integers
+real_tags = {Tag.realAppTag: Real, Tag.doubleAppTag: Double}
+integer_tags = {
+    Tag.booleanAppTag: Boolean,
+    Tag.unsignedAppTag: Unsigned,
+    Tag.integerAppTag: Integer,
+    Tag.enumeratedAppTag: Enumerated,
+}
+
+
+def sample_value(property_value):
+    """Return a (real, integer) pair for a polled value from its application
+    tag rather than its datatype, bit strings are integers with the first
+    bit the least significant.  Both are None for the other values."""
+    tags = property_value.tagList.tagList
+    if (len(tags) != 1) or (tags[0].tagClass != Tag.applicationTagClass):
+        return None, None
+    tag = tags[0]
+
+    if tag.tagNumber in real_tags:
+        return real_tags[tag.tagNumber](tag).value, None
+    if tag.tagNumber in integer_tags:
+        return None, int(integer_tags[tag.tagNumber](tag).value)
+    if tag.tagNumber == Tag.bitStringAppTag:
+        return None, sum(bit << i for i, bit in enumerate(BitString(tag).value))
+
+    return None, None
+
+
+def tag_length(data, i):
+    """Return the offset and length of the data of the tag at an offset of
+    some encoded octets, for tags with a one octet tag number."""
+    lvt = data[i] & 0x07
+    if lvt < 5:
+        return i + 1, lvt
+    length = data[i + 1]
+    if length < 254:
+        return i + 2, length
+    if length == 254:
+        return i + 4, int.from_bytes(data[i + 2 : i + 4], "big")
+    return i + 6, int.from_bytes(data[i + 2 : i + 6], "big")
+
+
+def poll_samples(data, points, when):
+    """Return the (point number, time, real, integer) samples from the
+    encoded results of a Read-Property-Multiple acknowledgement for some
+    polled points, like sample_value().  The results are in the order of
+    the request and a ValueError (or IndexError) is raised when they do not
+    line up with it, or a value is not a single application tag."""
+    samples = []
+    i = 0
+    for point in points:
+        # object identifier (context 0), opening tag 1
+        if (data[i] != 0x0C) or (data[i + 1 : i + 5] != point.encoded):
+            raise ValueError("object identifier expected")
+        if data[i + 5] != 0x1E:
+            raise ValueError("list of results expected")
+        i += 6
+
+        for number in point.numbers:
+            # property identifier (context 2)
+            if data[i] & 0xF8 != 0x28:
+                raise ValueError("property identifier expected")
+            i += 1 + (data[i] & 0x07)
+
+            # property access error, skip the class and code
+            if data[i] == 0x5E:
+                i, length = tag_length(data, i + 1)
+                i, length = tag_length(data, i + length)
+                if data[i + length] != 0x5F:
+                    raise ValueError("closing tag expected")
+                i += length + 1
+                continue
+
+            # property value, one application tag
+            if data[i] != 0x4E:
+                raise ValueError("property value expected")
+            tag = data[i + 1]
+            if tag & 0x08:
+                raise ValueError("application tag expected")
+            tag_number = tag >> 4
+            if tag_number == Tag.booleanAppTag:
+                i, length, value = i + 2, 0, (None, tag & 0x07)
+            else:
+                i, length = tag_length(data, i + 1)
+                value_data = data[i : i + length]
+                if tag_number == Tag.realAppTag:
+                    value = (struct.unpack(">f", value_data)[0], None)
+                elif tag_number == Tag.doubleAppTag:
+                    value = (struct.unpack(">d", value_data)[0], None)
+                elif tag_number in (Tag.unsignedAppTag, Tag.enumeratedAppTag):
+                    value = (None, int.from_bytes(value_data, "big"))
+                elif tag_number == Tag.integerAppTag:
+                    value = (None, int.from_bytes(value_data, "big", signed=True))
+                elif tag_number == Tag.bitStringAppTag:
+                    bits = "".join(format(octet, "08b") for octet in value_data[1:])
+                    bits = bits[: len(bits) - value_data[0]]
+                    value = (None, int(bits[::-1], 2) if bits else 0)
+                else:
+                    value = (None, None)
+            if data[i + length] != 0x4F:
+                raise ValueError("closing tag expected")
+            i += length + 1
+
+            samples.append((number, when) + value)
+
+        # closing tag 1
+        if data[i] != 0x1F:
+            raise ValueError("end of results expected")
+        i += 1
+
+    if i != len(data):
+        raise ValueError("extra results")
+
+    return samples
+
+
+@bacpypes_debugging
+class CapturedLogData(LogData):
+    """The log data of a trend log multiple record, the choice decoder looks
+    for a context tag rather than an opening tag for the list of items."""
+
+    def decode(self, taglist):
+        if _debug:
+            CapturedLogData._debug("decode %r", taglist)
+
+        tag = taglist.Peek()
+        if (
+            (tag is None)
+            or (tag.tagClass != Tag.openingTagClass)
+            or (tag.tagNumber != 1)
+        ):
+            LogData.decode(self, taglist)
+            return
+        taglist.Pop()
+
+        helper = self.choiceElements[1].klass()
+        helper.decode(taglist)
+
+        tag = taglist.Pop()
+        if (tag is None) or (tag.tagClass != Tag.closingTagClass):
+            raise ValueError("log data closing tag expected")
+
+        self.logStatus = None
+        self.logData = helper.value
+        self.timeChange = None
+
+
+class CapturedLogMultipleRecord(LogMultipleRecord):
+    sequenceElements = [
+        Element("timestamp", DateTime, 0),
+        Element("logData", CapturedLogData, 1),
+    ]
+
+
+# object type: datatype to cast out the records of a ReadRange acknowledgement
+log_buffer_types = {
+    "trendLog": get_datatype("trendLog", "logBuffer"),
+    "trendLogMultiple": ListOf(CapturedLogMultipleRecord),
+}
+
+
+def log_timestamp(timestamp):
+    """Return the time of a log record as seconds since the epoch, None when
+    the date or time is not specified."""
+    date, time_of_day = timestamp.date, timestamp.time
+    if (255 in date[:3]) or (255 in time_of_day[:3]):
+        return None
+    if (date[1] > 12) or (date[2] > 31):
+        return None
+    hundredths = time_of_day[3] if time_of_day[3] != 255 else 0
+    return time.mktime(
+        (date[0] + 1900, date[1], date[2]) + tuple(time_of_day[:3]) + (0, 0, -1)
+    ) + (hundredths / 100.0)
+
+
+def log_datum_row(datum):
+    """Return the (kind, value_real, value_int, value_text) of the datum of a
+    log record, the kind is the name of the choice, bit strings are strings
+    of ones and zeros and failures are 'class:code'."""
+    for element in datum.choiceElements:
+        value = getattr(datum, element.name)
+        if value is not None:
+            break
+    else:
+        return None, None, None, None
+
+    kind = element.name
+    if kind in ("realValue", "timeChange"):
+        return kind, value, None, None
+    if kind in ("booleanValue", "enumValue", "unsignedValue", "signedValue"):
+        return kind, None, int(value), None
+    if kind in ("logStatus", "bitstringValue"):
+        return kind, None, None, "".join(str(bit) for bit in value)
+    if kind == "failure":
+        return kind, None, None, "{}:{}".format(value.errorClass, value.errorCode)
+    if kind == "anyValue":
+        data = PDUData()
+        value.tagList.encode(data)
+        return kind, None, None, data.pduData.hex()
+    return kind, None, None, None
+
+
+def log_record_rows(sequence, record):
+    """Return the history rows of a trend log record, or of each item of the
+    log data of a trend log multiple record."""
+    when = log_timestamp(record.timestamp)
+
+    if isinstance(record, LogMultipleRecord):
+        log_data = record.logData
+        if log_data.logData is None:
+            return [(sequence, 0, when) + log_datum_row(log_data) + (None,)]
+        if not log_data.logData:
+            return [(sequence, 0, when, "logData", None, None, None, None)]
+        return [
+            (sequence, item, when) + log_datum_row(datum) + (None,)
+            for item, datum in enumerate(log_data.logData)
+        ]
+
+    status_flags = None
+    if record.statusFlags is not None:
+        status_flags = sum(bit << i for i, bit in enumerate(record.statusFlags))
+    return [(sequence, 0, when) + log_datum_row(record.logDatum) + (status_flags,)]
+
+
 #
 #   ToDoItem
 #
@@ -94,6 +531,10 @@ application_to_do_list = None
 
 @bacpypes_debugging
 class ToDoItem:
+
+    # priority class, lower goes first
+    priority = OTHER_PRIORITY
+
     def __init__(self, _thread=None, _delay=None):
         if _debug:
             ToDoItem._debug("__init__")
@@ -101,10 +542,18 @@ class ToDoItem:
         # basic status information
         self._completed = False
 
+        # when the item was first added to a list
+        self._queued = None
+
         # may depend on another item to complete, may have a delay
         self._thread = _thread
         self._delay = _delay
 
+        # when the request was given to the controller, and the network
+        # window it is counted in
+        self._launched = None
+        self._network = None
+
     def prepare(self):
         if _debug:
             ToDoItem._debug("prepare")
@@ -116,6 +565,67 @@ class ToDoItem:
         self._completed = True
 
 
+#
+#   ToDoQueue
+#
+
+
+@bacpypes_debugging
+class ToDoQueue:
+    """The pending items of a list, first in first out within each priority
+    class.  The next item is from the highest priority class unless the
+    first item of a lower class has been waiting long enough to be moved up
+    (aging)."""
+
+    def __init__(self):
+        if _debug:
+            ToDoQueue._debug("__init__")
+
+        self.queues = [deque() for _ in range(DEVICE_PRIORITY, OTHER_PRIORITY + 1)]
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, item):
+        if item._queued is None:
+            item._queued = time.time()
+        self.queues[item.priority].append(item)
+        self.count += 1
+
+    def extendleft(self, items):
+        """Put items back in front of the others of the same class, in
+        order."""
+        for item in reversed(items):
+            self.queues[item.priority].appendleft(item)
+            self.count += 1
+
+    def pop(self):
+        """Remove and return the next item that can be started, None if all
+        of them are waiting for other items to complete."""
+        now = time.time()
+
+        best = best_priority = None
+        for queue in self.queues:
+            # look for the first item that can be started
+            for i, item in enumerate(queue):
+                if (not item._thread) or item._thread._completed:
+                    break
+            else:
+                continue
+
+            priority = item.priority - int((now - item._queued) / AGING_INTERVAL)
+            if (best is None) or (priority < best_priority):
+                best, best_priority, best_queue, best_index = item, priority, queue, i
+
+        if best is None:
+            return None
+
+        del best_queue[best_index]
+        self.count -= 1
+        return best
+
+
 #
 #   ToDoList
 #
@@ -134,7 +644,7 @@ class ToDoList:
         self.active_limit = active_limit
 
         # no workers, nothing active
-        self.pending = []
+        self.pending = ToDoQueue()
         self.active = set()
 
         # launch already deferred
@@ -161,25 +671,34 @@ class ToDoList:
 
         # find some workers and launch them
         while self.pending and (len(self.active) < self.active_limit):
-            # look for the next to_do_item that can be started
-            for i, item in enumerate(self.pending):
-                if not item._thread:
-                    break
-                if item._thread._completed:
-                    break
-            else:
+            # take the next to_do_item that can be started
+            item = self.pending.pop()
+            if item is None:
                 if _debug:
                     ToDoList._debug("    - waiting")
                 break
             if _debug:
                 ToDoList._debug("    - item: %r", item)
 
-            # remove it from the pending list, add it to active
-            del self.pending[i]
+            # it might have to wait for something else
+            if not self.ready(item):
+                continue
+
+            # add it to active
             self.active.add(item)
+            item._launched = time.time()
 
-            # prepare it and capture the IOCB
-            iocb = item.prepare()
+            # prepare it and capture the IOCB, an item that cannot be
+            # prepared (like a device without an address) completes with
+            # the error
+            try:
+                iocb = item.prepare()
+                error = None
+            except Exception as err:
+                if _debug:
+                    ToDoList._debug("    - prepare error: %r", err)
+                iocb = IOCB()
+                error = err
             if _debug:
                 ToDoList._debug("    - iocb: %r", iocb)
 
@@ -191,7 +710,10 @@ class ToDoList:
             iocb.add_callback(self.complete)
 
             # submit it to our controller
-            self.controller.request_io(iocb)
+            if error:
+                iocb.abort(error)
+            else:
+                self.controller.request_io(iocb)
 
         # clear the deferred flag
         self.launch_deferred = False
@@ -202,6 +724,16 @@ class ToDoList:
         if (not self.active) and (not self.pending):
             self.idle()
 
+        # something might have changed for a waiting console command
+        if console_waits:
+            console_waits.check()
+
+    def ready(self, item):
+        """Return true if the item can be started now, otherwise the item
+        is kept by the list and put back in front of the pending items of its
+        priority class later."""
+        return True
+
     def complete(self, iocb):
         if _debug:
             ToDoList._debug("complete %r", iocb)
@@ -224,8 +756,12 @@ class ToDoList:
         if _debug:
             ToDoList._debug("_delay_complete %r %r", item, iocb)
 
-        # tell the item it completed, remove it from active
-        item.complete(iocb)
+        # tell the item it completed, remove it from active even when that
+        # fails so the list keeps going
+        try:
+            item.complete(iocb)
+        except Exception as err:
+            ToDoList._exception("complete error: %r", err)
         self.active.remove(item)
 
         # find another to_do_item
@@ -241,6 +777,70 @@ class ToDoList:
             ToDoList._debug("idle")
 
 
+#
+#   ConsoleWaits
+#
+
+
+@bacpypes_debugging
+class ConsoleWaits:
+    """The console commands run in their own thread and return as soon as
+    their requests are given to the lists, a wait command blocks the console
+    until a condition is true.  The conditions are checked in the
+    application thread each time a list has launched or completed items, so
+    they see the lists in a consistent state."""
+
+    def __init__(self):
+        if _debug:
+            ConsoleWaits._debug("__init__")
+
+        # (condition, event) pairs
+        self.waits = []
+
+    def add(self, condition, event):
+        if _debug:
+            ConsoleWaits._debug("add %r %r", condition, event)
+
+        self.waits.append((condition, event))
+        self.check()
+
+    def remove(self, event):
+        if _debug:
+            ConsoleWaits._debug("remove %r", event)
+
+        self.waits = [wait for wait in self.waits if wait[1] is not event]
+
+    def check(self):
+        if not self.waits:
+            return
+
+        waits = []
+        for condition, event in self.waits:
+            if condition():
+                if _debug:
+                    ConsoleWaits._debug("check %r: done", condition)
+                event.set()
+            else:
+                waits.append((condition, event))
+        self.waits = waits
+
+    def wait(self, condition, timeout=None):
+        """Called from the console thread, return true if the condition
+        became true before the timeout."""
+        if _debug:
+            ConsoleWaits._debug("wait %r %r", condition, timeout)
+
+        # the check is deferred so the requests given to the lists before
+        # the wait are queued first
+        event = threading.Event()
+        deferred(self.add, condition, event)
+
+        if not event.wait(timeout):
+            deferred(self.remove, event)
+            return event.is_set()
+        return True
+
+
 #
 #   DiscoverNetworkServiceElement
 #
@@ -281,6 +881,10 @@ class DiscoverNetworkServiceElement(NetworkServiceElement, IOQController):
             if interactive:
                 print("{} router to {}".format(npdu.pduSource, npdu.iartnNetworkList))
 
+            # pass it along to line up with active requests
+            if network_path_to_do_list:
+                network_path_to_do_list.received_i_am_router_to_network(npdu)
+
             # reference the request
             request = self.active_iocb.args[0]
             if isinstance(request, WhoIsRouterToNetwork):
@@ -314,6 +918,91 @@ class DiscoverNetworkServiceElement(NetworkServiceElement, IOQController):
         NetworkServiceElement.indication(self, adapter, npdu)
 
 
+#
+#   AdaptiveStateMachineAccessPoint
+#
+
+
+@bacpypes_debugging
+class AdaptiveStateMachineAccessPoint(StateMachineAccessPoint):
+    """The APDU timeout and number of retries of a request come from the
+    round trip time estimate of the device in the registry rather than the
+    same configured values for every device."""
+
+    def sap_indication(self, apdu):
+        if _debug:
+            AdaptiveStateMachineAccessPoint._debug("sap_indication %r", apdu)
+
+        StateMachineAccessPoint.sap_indication(self, apdu)
+        if not isinstance(apdu, ConfirmedRequestPDU) or not self.clientTransactions:
+            return
+
+        # the transaction just started is waiting with the configured timeout,
+        # segmented requests wait for segment acks and are left alone
+        tr = self.clientTransactions[-1]
+        if (tr.state != AWAIT_CONFIRMATION) or (tr.pdu_address != apdu.pduDestination):
+            return
+        if not isinstance(tr.device_info, RegisteredDevice):
+            return
+
+        tr.apduTimeout, tr.numberOfApduRetries = tr.device_info.apdu_timing(
+            tr.apduTimeout, tr.numberOfApduRetries
+        )
+        if _debug:
+            AdaptiveStateMachineAccessPoint._debug(
+                "    - timeout, retries: %r, %r", tr.apduTimeout, tr.numberOfApduRetries
+            )
+        tr.restart_timer(tr.apduTimeout)
+
+
+#
+#   DiscoverApplicationServiceAccessPoint
+#
+
+
+@bacpypes_debugging
+class DiscoverApplicationServiceAccessPoint(ApplicationServiceAccessPoint):
+    """The acknowledgement of a request with a true '_undecoded' attribute is
+    passed up as it is (a ComplexAckPDU) so the values can be picked out
+    without building all of the objects of the general decoder.  There is
+    only one request at a time to a device (see ApplicationIOController) so
+    it is found by the address and invoke ID."""
+
+    def __init__(self, *args, **kwargs):
+        if _debug:
+            DiscoverApplicationServiceAccessPoint._debug("__init__")
+        ApplicationServiceAccessPoint.__init__(self, *args, **kwargs)
+
+        # address: invoke ID of the request that is not decoded
+        self.undecoded = {}
+
+    def sap_indication(self, apdu):
+        if _debug:
+            DiscoverApplicationServiceAccessPoint._debug("sap_indication %r", apdu)
+
+        ApplicationServiceAccessPoint.sap_indication(self, apdu)
+        if not isinstance(apdu, ConfirmedRequestPDU):
+            return
+
+        if getattr(apdu, "_undecoded", False):
+            self.undecoded[apdu.pduDestination] = apdu.apduInvokeID
+        else:
+            self.undecoded.pop(apdu.pduDestination, None)
+
+    def confirmation(self, apdu):
+        if _debug:
+            DiscoverApplicationServiceAccessPoint._debug("confirmation %r", apdu)
+
+        if isinstance(apdu, ComplexAckPDU) and (
+            self.undecoded.get(apdu.pduSource) == apdu.apduInvokeID
+        ):
+            del self.undecoded[apdu.pduSource]
+            self.sap_response(apdu)
+            return
+
+        ApplicationServiceAccessPoint.confirmation(self, apdu)
+
+
 #
 #   DiscoverApplication
 #
@@ -351,11 +1040,11 @@ class DiscoverApplication(
             self.localAddress = Address(localAddress)
 
         # include a application decoder
-        self.asap = ApplicationServiceAccessPoint()
+        self.asap = DiscoverApplicationServiceAccessPoint()
 
         # pass the device object to the state machine access point so it
         # can know if it should support segmentation
-        self.smap = StateMachineAccessPoint(localDevice)
+        self.smap = AdaptiveStateMachineAccessPoint(localDevice)
 
         # the segmentation state machines need access to the same device
         # information cache as the application
@@ -411,6 +1100,9 @@ class DiscoverApplication(
 
 @bacpypes_debugging
 class WhoIsToDo(ToDoItem):
+
+    priority = DEVICE_PRIORITY
+
     def __init__(self, addr, lolimit, hilimit):
         if _debug:
             WhoIsToDo._debug("__init__ %r %r %r", addr, lolimit, hilimit)
@@ -469,8 +1161,19 @@ class WhoIsToDo(ToDoItem):
                 device_instance, "-", "segmentationSupported"
             ] = apdu.segmentationSupported
 
-            # read stuff
-            ReadServicesSupported(device_instance)
+            # update the registry
+            registry.update(
+                device_instance,
+                address=apdu.pduSource,
+                maxApduLengthAccepted=apdu.maxAPDULengthAccepted,
+                segmentationSupported=apdu.segmentationSupported,
+                vendorID=apdu.vendorID,
+                lastSeen=time.time(),
+            )
+
+            # read stuff, the services supported are known from a previous run
+            if registry.supports_rpm(device_instance) is None:
+                ReadServicesSupported(device_instance)
             ReadObjectList(device_instance)
 
         # pass along
@@ -478,611 +1181,1813 @@ class WhoIsToDo(ToDoItem):
 
 
 #
-#   WhoIsToDoList
+#   WhoIsRouterToNetworkToDo
 #
 
 
 @bacpypes_debugging
-class WhoIsToDoList(ToDoList):
-    def received_i_am(self, apdu):
+class WhoIsRouterToNetworkToDo(ToDoItem):
+    def __init__(self, addr=None, net=None):
         if _debug:
-            WhoIsToDoList._debug("received_i_am %r", apdu)
-
-        # line it up with an active item
-        for item in self.active:
-            if _debug:
-                WhoIsToDoList._debug("    - item: %r", item)
-
-            # check the source against the request
-            if item.addr.addrType == Address.localBroadcastAddr:
-                if apdu.pduSource.addrType != Address.localStationAddr:
-                    if _debug:
-                        WhoIsToDoList._debug("    - not a local station")
-                    continue
-
-            elif item.addr.addrType == Address.localStationAddr:
-                if apdu.pduSource != item.addr:
-                    if _debug:
-                        WhoIsToDoList._debug("    - not from station")
-                    continue
+            WhoIsRouterToNetworkToDo._debug("__init__ %r %r", addr, net)
+        ToDoItem.__init__(self)
 
-            elif item.addr.addrType == Address.remoteBroadcastAddr:
-                if apdu.pduSource.addrType != Address.remoteStationAddr:
-                    if _debug:
-                        WhoIsToDoList._debug("    - not a remote station")
-                    continue
-                if apdu.pduSource.addrNet != item.addr.addrNet:
-                    if _debug:
-                        WhoIsToDoList._debug("    - not from remote net")
-                    continue
+        # save the parameters
+        self.addr = addr
+        self.net = net
 
-            elif item.addr.addrType == Address.remoteStationAddr:
-                if apdu.pduSource != item.addr:
-                    if _debug:
-                        WhoIsToDoList._debug("    - not correct remote station")
-                    continue
+        # make a placeholder for responses
+        self.i_am_router_responses = []
 
-            # check the range restriction
-            device_instance = apdu.iAmDeviceIdentifier[1]
-            if (item.lolimit is not None) and (device_instance < item.lolimit):
-                if _debug:
-                    WhoIsToDoList._debug("    - lo limit")
-                continue
-            if (item.hilimit is not None) and (device_instance > item.hilimit):
-                if _debug:
-                    WhoIsToDoList._debug("    - hi limit")
-                continue
+        # give it to the list
+        network_path_to_do_list.append(self)
 
-            # debug in case something kicked it out
-            if _debug:
-                WhoIsToDoList._debug("    - passed")
+    def prepare(self):
+        if _debug:
+            WhoIsRouterToNetworkToDo._debug("prepare(%r %r)", self.addr, self.net)
 
-            # save this response
-            item.i_am_responses.append(apdu)
+        # build a request
+        request = WhoIsRouterToNetwork()
+        request.pduDestination = self.addr or LocalBroadcast()
+        if self.net is not None:
+            request.wirtnNetwork = self.net
+        if _debug:
+            WhoIsRouterToNetworkToDo._debug("    - request: %r", request)
 
-    def idle(self):
+        # build an IOCB, all of the routers that answer in time are saved
+        iocb = IOCB(request)
+        iocb.set_timeout(ROUTER_TIMEOUT)
         if _debug:
-            WhoIsToDoList._debug("idle")
+            WhoIsRouterToNetworkToDo._debug("    - iocb: %r", iocb)
 
+        return iocb
 
-#
-#   ApplicationToDoList
-#
+    def complete(self, iocb):
+        if _debug:
+            WhoIsRouterToNetworkToDo._debug("complete %r", iocb)
 
+        # process the responses
+        for npdu in self.i_am_router_responses:
+            topology.add_routes(npdu.pduSource, npdu.iartnNetworkList)
 
-@bacpypes_debugging
-class ApplicationToDoList(ToDoList):
-    def __init__(self):
-        if _debug:
-            ApplicationToDoList._debug("__init__")
-        global this_application
+            # read the routing table of each router once
+            if npdu.pduSource not in network_path_to_do_list.routers:
+                network_path_to_do_list.routers.add(npdu.pduSource)
+                InitializeRoutingTableToDo(npdu.pduSource)
 
-        ToDoList.__init__(self, this_application)
+        # pass along
+        ToDoItem.complete(self, iocb)
 
 
 #
-#   ReadPropertyToDo
+#   InitializeRoutingTableToDo
 #
 
 
 @bacpypes_debugging
-class ReadPropertyToDo(ToDoItem):
-    def __init__(self, devid, objid, propid, index=None):
+class InitializeRoutingTableToDo(ToDoItem):
+    def __init__(self, router):
         if _debug:
-            ReadPropertyToDo._debug(
-                "__init__ %r %r %r index=%r", devid, objid, propid, index
-            )
+            InitializeRoutingTableToDo._debug("__init__ %r", router)
         ToDoItem.__init__(self)
 
         # save the parameters
-        self.devid = devid
-        self.objid = objid
-        self.propid = propid
-        self.index = index
+        self.router = router
 
         # give it to the list
-        application_to_do_list.append(self)
+        network_path_to_do_list.append(self)
 
     def prepare(self):
         if _debug:
-            ReadPropertyToDo._debug(
-                "prepare(%r %r %r)", self.devid, self.objid, self.propid
-            )
-
-        # map the devid identifier to an address from the database
-        addr = snapshot[self.devid, "-", "address"]
-        if not addr:
-            raise ValueError("unknown device")
-        if _debug:
-            ReadPropertyToDo._debug("    - addr: %r", addr)
-
-        # build a request
-        request = ReadPropertyRequest(
-            destination=addr,
-            objectIdentifier=self.objid,
-            propertyIdentifier=self.propid,
-        )
+            InitializeRoutingTableToDo._debug("prepare(%r)", self.router)
 
-        if self.index is not None:
-            request.propertyArrayIndex = self.index
+        # build an empty request, the router returns its routing table
+        request = InitializeRoutingTable()
+        request.pduDestination = self.router
         if _debug:
-            ReadPropertyToDo._debug("    - request: %r", request)
+            InitializeRoutingTableToDo._debug("    - request: %r", request)
 
-        # make an IOCB
+        # build an IOCB
         iocb = IOCB(request)
+        iocb.set_timeout(ROUTER_TIMEOUT)
         if _debug:
-            ReadPropertyToDo._debug("    - iocb: %r", iocb)
+            InitializeRoutingTableToDo._debug("    - iocb: %r", iocb)
 
         return iocb
 
     def complete(self, iocb):
         if _debug:
-            ReadPropertyToDo._debug("complete %r", iocb)
+            InitializeRoutingTableToDo._debug("complete %r", iocb)
 
-        # do something for error/reject/abort
+        # the response is the routing table
         if iocb.ioError:
             if interactive:
-                print("{} error: {}".format(self.propid, iocb.ioError))
+                print("{} routing table error: {}".format(self.router, iocb.ioError))
+        else:
+            topology.set_routing_table(
+                self.router,
+                [(rte.rtDNET, rte.rtPortID, rte.rtPortInfo) for rte in iocb.ioResponse],
+            )
 
-            # do something more
-            self.returned_error(iocb.ioError)
+        # pass along
+        ToDoItem.complete(self, iocb)
 
-        # do something for success
-        elif iocb.ioResponse:
-            apdu = iocb.ioResponse
 
-            # should be an ack
-            if not isinstance(apdu, ReadPropertyACK):
-                if _debug:
-                    ReadPropertyToDo._debug("    - not an ack")
-                return
+#
+#   WhatIsNetworkNumberToDo
+#
 
-            # find the datatype
-            datatype = get_datatype(apdu.objectIdentifier[0], apdu.propertyIdentifier)
-            if _debug:
-                ReadPropertyToDo._debug("    - datatype: %r", datatype)
-            if not datatype:
-                raise TypeError("unknown datatype")
 
-            # special case for array parts, others are managed by cast_out
-            if issubclass(datatype, Array) and (apdu.propertyArrayIndex is not None):
-                if apdu.propertyArrayIndex == 0:
-                    datatype = Unsigned
-                else:
-                    datatype = datatype.subtype
-                if _debug:
-                    ReadPropertyToDo._debug("    - datatype: %r", datatype)
+@bacpypes_debugging
+class WhatIsNetworkNumberToDo(ToDoItem):
+    def __init__(self, addr=None):
+        if _debug:
+            WhatIsNetworkNumberToDo._debug("__init__ %r", addr)
+        ToDoItem.__init__(self)
 
-            try:
-                value = apdu.propertyValue.cast_out(datatype)
-                if _debug:
-                    ReadPropertyToDo._debug("    - value: %r", value)
+        # save the parameters
+        self.addr = addr
 
-                # convert the value to a string
-                if hasattr(value, "dict_contents"):
-                    dict_contents = value.dict_contents(as_class=OrderedDict)
-                    str_value = json.dumps(dict_contents)
-                else:
-                    str_value = str(value)
-            except Exception as err:
-                str_value = "!" + str(err)
+        # give it to the list
+        network_path_to_do_list.append(self)
 
-            if interactive:
-                print(str_value)
+    def prepare(self):
+        if _debug:
+            WhatIsNetworkNumberToDo._debug("prepare(%r)", self.addr)
 
-            # make a pretty property identifier
-            str_prop = apdu.propertyIdentifier
-            if apdu.propertyArrayIndex is not None:
-                str_prop += "[{}]".format(apdu.propertyArrayIndex)
+        # build a request
+        request = WhatIsNetworkNumber()
+        request.pduDestination = self.addr or LocalBroadcast()
+        if _debug:
+            WhatIsNetworkNumberToDo._debug("    - request: %r", request)
 
-            # save it in the snapshot
-            snapshot[
-                self.devid, "{}:{}".format(*apdu.objectIdentifier), str_prop
-            ] = value
+        # build an IOCB, the first answer completes it
+        iocb = IOCB(request)
+        iocb.set_timeout(ROUTER_TIMEOUT)
+        if _debug:
+            WhatIsNetworkNumberToDo._debug("    - iocb: %r", iocb)
 
-            # do something more
-            self.returned_value(value)
+        return iocb
 
-        # do something with nothing?
-        else:
-            if _debug:
-                ReadPropertyToDo._debug("    - ioError or ioResponse expected")
+    def complete(self, iocb):
+        if _debug:
+            WhatIsNetworkNumberToDo._debug("complete %r", iocb)
 
-    def returned_error(self, error):
+        if iocb.ioError and interactive:
+            print("network number error: {}".format(iocb.ioError))
+
+        # pass along
+        ToDoItem.complete(self, iocb)
+
+
+#
+#   NetworkPathToDoList
+#
+
+
+@bacpypes_debugging
+class NetworkPathToDoList(ToDoList):
+    def __init__(self, controller):
         if _debug:
-            ReadPropertyToDo._debug("returned_error %r", error)
+            NetworkPathToDoList._debug("__init__ %r", controller)
+        ToDoList.__init__(self, controller)
 
-    def returned_value(self, value):
+        # routers that have been asked for their routing table
+        self.routers = set()
+
+        # device instance range limits of the Who-Is sweep after the routers
+        # have been found, None for no sweep
+        self.who_is_limits = None
+
+    def received_i_am_router_to_network(self, npdu):
         if _debug:
-            ReadPropertyToDo._debug("returned_value %r", value)
+            NetworkPathToDoList._debug("received_i_am_router_to_network %r", npdu)
+
+        # line it up with an active item
+        for item in self.active:
+            if isinstance(item, WhoIsRouterToNetworkToDo):
+                item.i_am_router_responses.append(npdu)
+
+    def idle(self):
+        if _debug:
+            NetworkPathToDoList._debug("idle")
+
+        if self.who_is_limits is None:
+            return
+        lolimit, hilimit = self.who_is_limits
+        self.who_is_limits = None
+
+        # look for devices on the local network and each network that can be
+        # reached rather than a global broadcast
+        WhoIsToDo(LocalBroadcast(), lolimit, hilimit)
+        for net in topology.networks():
+            if interactive:
+                print("who-is network {}".format(net))
+            WhoIsToDo(RemoteBroadcast(net), lolimit, hilimit)
 
 
 #
-#   ReadServicesSupported
+#   WhoIsToDoList
 #
 
 
 @bacpypes_debugging
-class ReadServicesSupported(ReadPropertyToDo):
-    def __init__(self, devid):
+class WhoIsToDoList(ToDoList):
+    def __init__(self, controller, active_limit=1):
         if _debug:
-            ReadServicesSupported._debug("__init__ %r", devid)
-        ReadPropertyToDo.__init__(
-            self, devid, ("device", devid), "protocolServicesSupported"
-        )
+            WhoIsToDoList._debug("__init__ %r %r", controller, active_limit)
+        ToDoList.__init__(self, controller, active_limit)
 
-    def returned_value(self, value):
+        # device instances that have been seen
+        self.i_am_devices = set()
+
+    def received_i_am(self, apdu):
         if _debug:
-            ReadServicesSupported._debug("returned_value %r", value)
+            WhoIsToDoList._debug("received_i_am %r", apdu)
 
-        # build a value
-        services_supported = ServicesSupported(value)
-        print(
-            "{} supports rpm: {}".format(
-                self.devid, services_supported["readPropertyMultiple"]
-            )
-        )
+        # count it for the console
+        self.i_am_devices.add(apdu.iAmDeviceIdentifier[1])
+        if console_waits:
+            console_waits.check()
 
-        # device profile
-        devobj = device_profile[self.devid]
-        devobj.protocolServicesSupported = services_supported
+        # line it up with an active item
+        for item in self.active:
+            if _debug:
+                WhoIsToDoList._debug("    - item: %r", item)
+
+            # check the source against the request
+            if item.addr.addrType == Address.localBroadcastAddr:
+                if apdu.pduSource.addrType != Address.localStationAddr:
+                    if _debug:
+                        WhoIsToDoList._debug("    - not a local station")
+                    continue
+
+            elif item.addr.addrType == Address.localStationAddr:
+                if apdu.pduSource != item.addr:
+                    if _debug:
+                        WhoIsToDoList._debug("    - not from station")
+                    continue
+
+            elif item.addr.addrType == Address.remoteBroadcastAddr:
+                if apdu.pduSource.addrType != Address.remoteStationAddr:
+                    if _debug:
+                        WhoIsToDoList._debug("    - not a remote station")
+                    continue
+                if apdu.pduSource.addrNet != item.addr.addrNet:
+                    if _debug:
+                        WhoIsToDoList._debug("    - not from remote net")
+                    continue
+
+            elif item.addr.addrType == Address.remoteStationAddr:
+                if apdu.pduSource != item.addr:
+                    if _debug:
+                        WhoIsToDoList._debug("    - not correct remote station")
+                    continue
+
+            # check the range restriction
+            device_instance = apdu.iAmDeviceIdentifier[1]
+            if (item.lolimit is not None) and (device_instance < item.lolimit):
+                if _debug:
+                    WhoIsToDoList._debug("    - lo limit")
+                continue
+            if (item.hilimit is not None) and (device_instance > item.hilimit):
+                if _debug:
+                    WhoIsToDoList._debug("    - hi limit")
+                continue
+
+            # debug in case something kicked it out
+            if _debug:
+                WhoIsToDoList._debug("    - passed")
+
+            # save this response, one item gets it
+            item.i_am_responses.append(apdu)
+            break
+
+    def idle(self):
+        if _debug:
+            WhoIsToDoList._debug("idle")
 
 
 #
-#   ReadObjectList
+#   NetworkWindow
 #
 
 
 @bacpypes_debugging
-class ReadObjectList(ReadPropertyToDo):
-    def __init__(self, devid):
+class NetworkWindow:
+    """The requests in flight to the devices on a BACnet network are limited
+    by a window that grows by one for each window of answers and is cut in
+    half when a request times out or is aborted (AIMD), so the router in
+    front of a slow trunk is not given more than it can buffer."""
+
+    def __init__(self, net, max_window):
         if _debug:
-            ReadObjectList._debug("__init__ %r", devid)
-        ReadPropertyToDo.__init__(self, devid, ("device", devid), "objectList")
+            NetworkWindow._debug("__init__ %r %r", net, max_window)
 
-    def returned_error(self, error):
+        self.net = net
+        self.max_window = max_window
+        self.window = float(INITIAL_WINDOW)
+
+        # number of requests in flight, and requests waiting for room in
+        # priority order
+        self.active = 0
+        self.parked = ToDoQueue()
+
+        # requests launched before the last decrease do not decrease it again
+        self.decreased = 0.0
+
+    def full(self):
+        return self.active >= int(self.window)
+
+    def increase(self):
+        self.window = min(self.window + 1.0 / self.window, self.max_window)
+
+    def decrease(self, launched):
+        if launched < self.decreased:
+            return
+        self.window = max(self.window / 2.0, 1.0)
+        self.decreased = time.time()
         if _debug:
-            ReadObjectList._debug("returned_error %r", error)
+            NetworkWindow._debug("decrease %r: %r", self.net, self.window)
 
-        # try reading the length of the list
-        ReadObjectListLen(self.devid)
 
-    def returned_value(self, value):
+#
+#   ApplicationToDoList
+#
+
+
+@bacpypes_debugging
+class ApplicationToDoList(ToDoList):
+    def __init__(self, max_window=DEFAULT_MAX_WINDOW):
         if _debug:
-            ReadObjectList._debug("returned_value %r", value)
+            ApplicationToDoList._debug("__init__ max_window=%r", max_window)
+        global this_application
 
-        # update the device profile
-        devobj = device_profile[self.devid]
-        devobj.objectList = ArrayOf(ObjectIdentifier)(value)
+        ToDoList.__init__(self, this_application, active_limit=MAX_ACTIVE)
 
-        # loop through the list
-        for objid in value:
-            # check to see if it is a known object type
-            if not get_object_class(objid[0]):
-                continue
+        # network number: NetworkWindow, the local network is None
+        self.max_window = max_window
+        self.networks = {}
 
-            # read the properties of the object
-            ReadObjectProperties(self.devid, objid)
+        # one request at a time to each device, the application would queue
+        # them anyway, and the requests waiting for the device in priority
+        # order
+        self.busy_devices = set()
+        self.parked_devices = defaultdict(ToDoQueue)
+
+        # number of items for each device that have not completed
+        self.device_items = defaultdict(int)
+
+    def append(self, item):
+        devid = getattr(item, "devid", None)
+        if devid is not None:
+            self.device_items[devid] += 1
+
+        ToDoList.append(self, item)
+
+    def network(self, devid):
+        """Return the window of the network of a device, None if the address
+        of the device is not known."""
+        addr = registry.address(devid)
+        if addr is None:
+            return None
+
+        net = addr.addrNet if addr.addrType == Address.remoteStationAddr else None
+        network = self.networks.get(net)
+        if not network:
+            network = self.networks[net] = NetworkWindow(net, self.max_window)
+        return network
+
+    def ready(self, item):
+        devid = getattr(item, "devid", None)
+        if devid is None:
+            return True
+
+        # wait for the device
+        if devid in self.busy_devices:
+            self.parked_devices[devid].append(item)
+            return False
+
+        # wait for room on the network
+        network = self.network(devid)
+        if network is not None:
+            if network.full():
+                network.parked.append(item)
+                return False
+            network.active += 1
+
+        self.busy_devices.add(devid)
+        item._network = network
+        return True
+
+    def complete(self, iocb):
+        if _debug:
+            ApplicationToDoList._debug("complete %r", iocb)
+
+        # the round trip time of the request to the device
+        item = iocb._to_do_item
+        devid = getattr(item, "devid", None)
+        if devid is not None:
+            rtt = time.time() - item._launched
+            error = iocb.ioError
+            network = item._network
+
+            if isinstance(error, AbortPDU) and (
+                error.apduAbortRejectReason == AbortReason.noResponse
+            ):
+                registry.no_response(devid)
+                if network:
+                    network.decrease(item._launched)
+            elif isinstance(error, AbortPDU):
+                if network:
+                    network.decrease(item._launched)
+            elif iocb.ioResponse or isinstance(error, (ErrorPDU, RejectPDU)):
+                # an answer that took longer than the first timeout could be
+                # for a retry, the sample is ambiguous (Karn's algorithm)
+                timeout, _ = registry.apdu_timing(
+                    devid, this_device.apduTimeout, this_device.numberOfApduRetries
+                )
+                if rtt * 1000.0 < timeout:
+                    registry.round_trip(devid, rtt)
+                if network:
+                    network.increase()
+
+            # give back the device and the room on the network, the items
+            # that were waiting go to the front of the line
+            self.busy_devices.discard(devid)
+            parked = self.parked_devices.get(devid)
+            if parked:
+                self.pending.extendleft([parked.pop()])
+                if not parked:
+                    del self.parked_devices[devid]
+            if network:
+                network.active -= 1
+                room = min(int(network.window) - network.active, len(network.parked))
+                if room > 0:
+                    self.pending.extendleft(
+                        [network.parked.pop() for _ in range(room)]
+                    )
+
+        # pass along
+        ToDoList.complete(self, iocb)
+
+    def _delay_complete(self, item, iocb):
+        # the items it makes are counted before it is
+        try:
+            ToDoList._delay_complete(self, item, iocb)
+        finally:
+            devid = getattr(item, "devid", None)
+            if devid is not None:
+                self.device_items[devid] -= 1
+                if not self.device_items[devid]:
+                    del self.device_items[devid]
 
 
 #
-#   ReadPropertyMultipleToDo
+#   ReadPropertyToDo
 #
 
 
 @bacpypes_debugging
-class ReadPropertyMultipleToDo(ToDoItem):
-    def __init__(self, devid, objid, proplist):
+class ReadPropertyToDo(ToDoItem):
+    def __init__(self, devid, objid, propid, index=None):
         if _debug:
-            ReadPropertyMultipleToDo._debug("__init__ %r %r %r", devid, objid, proplist)
+            ReadPropertyToDo._debug(
+                "__init__ %r %r %r index=%r", devid, objid, propid, index
+            )
         ToDoItem.__init__(self)
 
         # save the parameters
         self.devid = devid
         self.objid = objid
-        self.proplist = proplist
+        self.propid = propid
+        self.index = index
+
+        # names come before the other properties
+        if (self.priority == OTHER_PRIORITY) and (propid in NAME_PROPERTIES):
+            self.priority = NAME_PRIORITY
 
         # give it to the list
         application_to_do_list.append(self)
 
     def prepare(self):
         if _debug:
-            ReadPropertyMultipleToDo._debug(
-                "prepare(%r %r %r)", self.devid, self.objid, self.proplist
+            ReadPropertyToDo._debug(
+                "prepare(%r %r %r)", self.devid, self.objid, self.propid
             )
 
-        # map the devid identifier to an address from the database
-        addr = snapshot[self.devid, "-", "address"]
+        # map the devid identifier to an address from the registry
+        addr = registry.address(self.devid)
         if not addr:
             raise ValueError("unknown device")
         if _debug:
-            ReadPropertyMultipleToDo._debug("    - addr: %r", addr)
-
-        prop_reference_list = [
-            PropertyReference(propertyIdentifier=propid) for propid in self.proplist
-        ]
+            ReadPropertyToDo._debug("    - addr: %r", addr)
 
-        # build a read access specification
-        read_access_spec = ReadAccessSpecification(
-            objectIdentifier=self.objid, listOfPropertyReferences=prop_reference_list
+        # build a request
+        request = ReadPropertyRequest(
+            destination=addr,
+            objectIdentifier=self.objid,
+            propertyIdentifier=self.propid,
         )
 
-        # build the request
-        request = ReadPropertyMultipleRequest(
-            destination=addr, listOfReadAccessSpecs=[read_access_spec]
-        )
+        if self.index is not None:
+            request.propertyArrayIndex = self.index
         if _debug:
-            ReadPropertyMultipleToDo._debug("    - request: %r", request)
+            ReadPropertyToDo._debug("    - request: %r", request)
 
         # make an IOCB
         iocb = IOCB(request)
         if _debug:
-            ReadPropertyMultipleToDo._debug("    - iocb: %r", iocb)
+            ReadPropertyToDo._debug("    - iocb: %r", iocb)
 
         return iocb
 
     def complete(self, iocb):
         if _debug:
-            ReadPropertyMultipleToDo._debug("complete %r", iocb)
+            ReadPropertyToDo._debug("complete %r", iocb)
 
         # do something for error/reject/abort
         if iocb.ioError:
             if interactive:
-                print(str(iocb.ioError))
+                print("{} error: {}".format(self.propid, iocb.ioError))
+
+            # do something more
+            self.returned_error(iocb.ioError)
+
+        # do something for success
+        elif iocb.ioResponse:
+            apdu = iocb.ioResponse
+
+            # should be an ack
+            if not isinstance(apdu, ReadPropertyACK):
+                if _debug:
+                    ReadPropertyToDo._debug("    - not an ack")
+                return
+
+            # find the datatype
+            objtype = apdu.objectIdentifier[0]
+            if not property_datatype(
+                objtype, apdu.propertyIdentifier, apdu.propertyArrayIndex
+            ):
+                raise TypeError("unknown datatype")
+
+            value, error = decode_value(
+                objtype,
+                apdu.propertyIdentifier,
+                apdu.propertyArrayIndex,
+                apdu.propertyValue,
+            )
+            if _debug:
+                ReadPropertyToDo._debug("    - value, error: %r, %r", value, error)
+
+            if interactive:
+                print(error or value_string(value))
+
+            # a value that could not be decoded is an error
+            if error:
+                self.returned_error(error)
+                return
+
+            # save it in the snapshot
+            snapshot[
+                self.devid,
+                "{}:{}".format(*apdu.objectIdentifier),
+                property_label(apdu.propertyIdentifier, apdu.propertyArrayIndex),
+            ] = value
+
+            # do something more
+            self.returned_value(value)
+
+        # do something with nothing?
+        else:
+            if _debug:
+                ReadPropertyToDo._debug("    - ioError or ioResponse expected")
+
+    def returned_error(self, error):
+        if _debug:
+            ReadPropertyToDo._debug("returned_error %r", error)
+
+    def returned_value(self, value):
+        if _debug:
+            ReadPropertyToDo._debug("returned_value %r", value)
+
+
+#
+#   ReadServicesSupported
+#
+
+
+@bacpypes_debugging
+class ReadServicesSupported(ReadPropertyToDo):
+
+    priority = DEVICE_PRIORITY
+
+    def __init__(self, devid):
+        if _debug:
+            ReadServicesSupported._debug("__init__ %r", devid)
+        ReadPropertyToDo.__init__(
+            self, devid, ("device", devid), "protocolServicesSupported"
+        )
+
+    def returned_value(self, value):
+        if _debug:
+            ReadServicesSupported._debug("returned_value %r", value)
+
+        # build a value
+        services_supported = ServicesSupported(value)
+        print(
+            "{} supports rpm: {}".format(
+                self.devid, services_supported["readPropertyMultiple"]
+            )
+        )
+
+        # device profile
+        devobj = device_profile[self.devid]
+        devobj.protocolServicesSupported = services_supported
+
+        # remember it for the next time
+        registry.update(
+            self.devid, rpm=bool(services_supported["readPropertyMultiple"])
+        )
+
+
+#
+#   ReadObjectList
+#
+
+
+@bacpypes_debugging
+class ReadObjectList(ReadPropertyToDo):
+
+    priority = OBJECT_LIST_PRIORITY
+
+    def __init__(self, devid):
+        if _debug:
+            ReadObjectList._debug("__init__ %r", devid)
+        ReadPropertyToDo.__init__(self, devid, ("device", devid), "objectList")
+
+    def returned_error(self, error):
+        if _debug:
+            ReadObjectList._debug("returned_error %r", error)
+
+        # try reading the length of the list
+        ReadObjectListLen(self.devid)
+
+    def returned_value(self, value):
+        if _debug:
+            ReadObjectList._debug("returned_value %r", value)
+
+        # update the device profile
+        devobj = device_profile[self.devid]
+        devobj.objectList = ArrayOf(ObjectIdentifier)(value)
+
+        # loop through the list
+        for objid in value:
+            # check to see if it is a known object type
+            if not get_object_class(objid[0]):
+                continue
+
+            # read the properties of the object
+            ReadObjectProperties(self.devid, objid)
+
+
+#
+#   ReadPropertyMultipleToDo
+#
+
+
+@bacpypes_debugging
+class ReadPropertyMultipleToDo(ToDoItem):
+    def __init__(self, devid, objid, proplist):
+        if _debug:
+            ReadPropertyMultipleToDo._debug("__init__ %r %r %r", devid, objid, proplist)
+        ToDoItem.__init__(self)
+
+        # save the parameters
+        self.devid = devid
+        self.objid = objid
+        self.proplist = proplist
+
+        # names come before the other properties
+        if (self.priority == OTHER_PRIORITY) and all(
+            propid in NAME_PROPERTIES for propid in proplist
+        ):
+            self.priority = NAME_PRIORITY
+
+        # give it to the list
+        application_to_do_list.append(self)
+
+    def prepare(self):
+        if _debug:
+            ReadPropertyMultipleToDo._debug(
+                "prepare(%r %r %r)", self.devid, self.objid, self.proplist
+            )
+
+        # map the devid identifier to an address from the registry
+        addr = registry.address(self.devid)
+        if not addr:
+            raise ValueError("unknown device")
+        if _debug:
+            ReadPropertyMultipleToDo._debug("    - addr: %r", addr)
+
+        # properties may be (propid, index) for array elements
+        prop_reference_list = []
+        for propid in self.proplist:
+            if isinstance(propid, tuple):
+                propid, index = propid
+                prop_reference = PropertyReference(
+                    propertyIdentifier=propid, propertyArrayIndex=index
+                )
+            else:
+                prop_reference = PropertyReference(propertyIdentifier=propid)
+            prop_reference_list.append(prop_reference)
+
+        # build a read access specification
+        read_access_spec = ReadAccessSpecification(
+            objectIdentifier=self.objid, listOfPropertyReferences=prop_reference_list
+        )
+
+        # build the request
+        request = ReadPropertyMultipleRequest(
+            destination=addr, listOfReadAccessSpecs=[read_access_spec]
+        )
+        if _debug:
+            ReadPropertyMultipleToDo._debug("    - request: %r", request)
+
+        # make an IOCB
+        iocb = IOCB(request)
+        if _debug:
+            ReadPropertyMultipleToDo._debug("    - iocb: %r", iocb)
+
+        return iocb
+
+    def complete(self, iocb):
+        if _debug:
+            ReadPropertyMultipleToDo._debug("complete %r", iocb)
+
+        # do something for error/reject/abort
+        if iocb.ioError:
+            if interactive:
+                print(str(iocb.ioError))
+
+            # do something more
+            self.returned_error(iocb.ioError)
+
+        # do something for success
+        elif iocb.ioResponse:
+            apdu = iocb.ioResponse
+
+            # should be an ack
+            if not isinstance(apdu, ReadPropertyMultipleACK):
+                if _debug:
+                    ReadPropertyMultipleToDo._debug("    - not an ack")
+                return
+
+            # decode the values, only make strings to print them
+            values = decode_results(apdu, print if interactive else None)
+            if _debug:
+                ReadPropertyMultipleToDo._debug("    - values: %r", values)
+
+            # save them in the snapshot together
+            snapshot.update(snapshot_rows(self.devid, values))
+
+            # do something more
+            self.returned_value(values)
+
+        # do something with nothing?
+        else:
+            if _debug:
+                ReadPropertyMultipleToDo._debug("    - ioError or ioResponse expected")
+
+    def returned_error(self, error):
+        if _debug:
+            ReadPropertyMultipleToDo._debug("returned_error %r", error)
+
+    def returned_value(self, values):
+        """The values are a list of (objid, propid, index, value)."""
+        if _debug:
+            ReadPropertyMultipleToDo._debug("returned_value %r", values)
+
+
+#
+#   ReadAccessToDo
+#
+
+
+@bacpypes_debugging
+class ReadAccessToDo(ReadPropertyMultipleToDo):
+    """Read-Property-Multiple with a list of read access specifications
+    that has already been built, which can be for more than one object."""
+
+    def __init__(self, devid, read_access_spec_list):
+        if _debug:
+            ReadAccessToDo._debug("__init__ %r %r", devid, read_access_spec_list)
+
+        # save the parameters
+        self.read_access_spec_list = read_access_spec_list
+
+        ReadPropertyMultipleToDo.__init__(self, devid, None, None)
+
+    def prepare(self):
+        if _debug:
+            ReadAccessToDo._debug("prepare(%r)", self.devid)
+
+        # map the devid identifier to an address from the registry
+        addr = registry.address(self.devid)
+        if not addr:
+            raise ValueError("unknown device")
+        if _debug:
+            ReadAccessToDo._debug("    - addr: %r", addr)
+
+        # build the request
+        request = ReadPropertyMultipleRequest(
+            destination=addr, listOfReadAccessSpecs=self.read_access_spec_list
+        )
+        if _debug:
+            ReadAccessToDo._debug("    - request: %r", request)
+
+        # make an IOCB
+        iocb = IOCB(request)
+        if _debug:
+            ReadAccessToDo._debug("    - iocb: %r", iocb)
+
+        return iocb
+
+
+#
+#   ReadObjectListLen
+#
+
+
+@bacpypes_debugging
+class ReadObjectListLen(ReadPropertyToDo):
+
+    priority = OBJECT_LIST_PRIORITY
+
+    def __init__(self, devid):
+        if _debug:
+            ReadObjectListLen._debug("__init__ %r", devid)
+        ReadPropertyToDo.__init__(self, devid, ("device", devid), "objectList", 0)
+
+    def returned_error(self, error):
+        if _debug:
+            ReadObjectListLen._debug("returned_error %r", error)
+
+    def returned_value(self, value):
+        if _debug:
+            ReadObjectListLen._debug("returned_value %r", value)
+
+        # start with an empty list
+        devobj = device_profile[self.devid]
+        devobj.objectList = ArrayOf(ObjectIdentifier)()
+
+        # read the items in batches if it's an option
+        if registry.supports_rpm(self.devid) and (not args.disable_rpm):
+            batch_size = object_list_batch_size(self.devid)
+            if _debug:
+                ReadObjectListLen._debug("    - batch_size: %r", batch_size)
+
+            for first in range(1, value + 1, batch_size):
+                ReadObjectListBatch(
+                    self.devid, first, min(first + batch_size - 1, value)
+                )
+        else:
+            # read each of the individual items
+            for i in range(1, value + 1):
+                ReadObjectListElement(self.devid, i)
+
+
+#
+#   ReadObjectListBatch
+#
+
+
+def max_apdu_length(devid):
+    """Return the largest response from the device, limited by its maximum
+    APDU length and ours."""
+    device_info = registry.get(devid)
+    max_apdu = (
+        device_info.maxApduLengthAccepted
+        if device_info and device_info.maxApduLengthAccepted
+        else MIN_APDU_LENGTH
+    )
+    return min(int(max_apdu), this_device.maxApduLengthAccepted)
+
+
+def object_list_batch_size(devid):
+    """Return the number of object list elements that fit in a response
+    from the device."""
+    max_apdu = max_apdu_length(devid)
+    return max(1, (max_apdu - OBJECT_LIST_ACK_OVERHEAD) // OBJECT_LIST_ELEMENT_LENGTH)
+
+
+@bacpypes_debugging
+class ReadObjectListBatch(ReadPropertyMultipleToDo):
+
+    priority = OBJECT_LIST_PRIORITY
+
+    def __init__(self, devid, first, last):
+        if _debug:
+            ReadObjectListBatch._debug("__init__ %r %r %r", devid, first, last)
+
+        self.first = first
+        self.last = last
+
+        ReadPropertyMultipleToDo.__init__(
+            self,
+            devid,
+            ("device", devid),
+            [("objectList", i) for i in range(first, last + 1)],
+        )
+
+    def returned_error(self, error):
+        if _debug:
+            ReadObjectListBatch._debug("returned_error %r", error)
+
+        # read the items of this batch one at a time
+        for i in range(self.first, self.last + 1):
+            ReadObjectListElement(self.devid, i)
+
+    def returned_value(self, values):
+        if _debug:
+            ReadObjectListBatch._debug("returned_value %r", values)
+
+        devobj = device_profile[self.devid]
+        for _, _, _, objid in values:
+            if objid is None:
+                continue
+
+            # update the list
+            devobj.objectList.append(objid)
+
+            # start reading the properties of the object right away
+            if get_object_class(objid[0]):
+                ReadObjectProperties(self.devid, objid)
+
+
+#
+#   ReadObjectListElement
+#
+
+
+@bacpypes_debugging
+class ReadObjectListElement(ReadPropertyToDo):
+
+    priority = OBJECT_LIST_PRIORITY
+
+    def __init__(self, devid, indx):
+        if _debug:
+            ReadObjectListElement._debug("__init__ %r", devid, indx)
+        ReadPropertyToDo.__init__(self, devid, ("device", devid), "objectList", indx)
+
+    def returned_error(self, error):
+        if _debug:
+            ReadObjectListElement._debug("returned_error %r", error)
+
+    def returned_value(self, value):
+        if _debug:
+            ReadObjectListElement._debug("returned_value %r", value)
+
+        # update the list
+        devobj = device_profile[self.devid]
+        devobj.objectList.append(value)
+
+        # check to see if it is a known object type
+        if not get_object_class(value[0]):
+            return
+
+        # read the properties of the object
+        ReadObjectProperties(self.devid, value)
+
+
+#
+#   CaptureProfile
+#
+
+
+@bacpypes_debugging
+class CaptureProfile:
+    """The properties to read for each object type.  The definition maps
+    object types to a list of property identifiers and '*' matches the other
+    object types, a list with 'all' reads all of the properties and the
+    objects of types that do not match are not read."""
+
+    def __init__(self, name, definition):
+        if _debug:
+            CaptureProfile._debug("__init__ %r %r", name, definition)
+
+        self.name = name
+        self.definition = definition
+
+        # object type: list of properties or None for all of them
+        self.cache = {}
+
+    def properties(self, objtype):
+        """Return the list of properties of an object type to read, None to
+        read all of them."""
+        if objtype in self.cache:
+            return self.cache[objtype]
+
+        propids = self.definition.get(objtype, self.definition.get("*", []))
+        if "all" in propids:
+            properties = None
+        else:
+            properties = [propid for propid in propids if get_datatype(objtype, propid)]
+        if _debug:
+            CaptureProfile._debug("    - %r: %r", objtype, properties)
+
+        self.cache[objtype] = properties
+        return properties
+
+
+# read everything when there is no profile
+FULL_PROFILE = CaptureProfile("full", {"*": ["all"]})
+
+
+def load_profiles(filename):
+    """
+    Read a capture profile file.  It is a JSON object where the keys are the
+    profile names and the values are profile definitions, for example:
+
+        {"inventory": {"*": ["objectName", "objectType", "description"],
+                       "device": ["objectName", "vendorName", "modelName"]},
+         "points": {"analogInput": ["objectName", "presentValue", "units"],
+                    "binaryInput": ["objectName", "presentValue"]}}
+    """
+    if _debug:
+        _log.debug("load_profiles %r", filename)
+
+    try:
+        with open(filename) as profiles_file:
+            content = json.load(profiles_file)
+    except (OSError, ValueError) as err:
+        raise ValueError(f"profiles file {filename}: {err}")
+
+    if not isinstance(content, dict):
+        raise ValueError(f"profiles file {filename}: object expected")
+
+    profiles = {}
+    for name, definition in content.items():
+        if not isinstance(definition, dict) or not all(
+            isinstance(propids, list) and all(isinstance(p, str) for p in propids)
+            for propids in definition.values()
+        ):
+            raise ValueError(
+                f"profiles file {filename}: {name}: lists of properties expected"
+            )
+        profiles[name] = CaptureProfile(name, definition)
+
+    return profiles
+
+
+#
+#   ReadObjectProperties
+#
+
+
+@bacpypes_debugging
+def ReadObjectProperties(devid, objid):
+    if _debug:
+        ReadObjectProperties._debug("ReadObjectProperties %r %r", devid, objid)
+    global args
+
+    # the profile has the properties to read
+    properties = capture_profile.properties(objid[0])
+    if _debug:
+        ReadObjectProperties._debug("    - properties: %r", properties)
+    if properties == []:
+        return
+
+    # log buffers are read in pages with ReadRange
+    if (objid[0] in TREND_LOG_TYPES) and (
+        (properties is None) or ("logBuffer" in properties)
+    ):
+        ReadTrendLog(devid, objid)
+        if properties is not None:
+            properties = [propid for propid in properties if propid != "logBuffer"]
+            if not properties:
+                return
+
+    # the registry knows if the device supports it
+    supports_rpm = registry.supports_rpm(devid)
+    if _debug:
+        ReadObjectProperties._debug("    - supports rpm: %r", supports_rpm)
+
+    # read all the properties at once if it's an option, with the names and
+    # types first so a skeleton of the site comes early
+    if supports_rpm and (not args.disable_rpm):
+        if properties is None:
+            names, properties = ["objectName", "objectType"], ["all"]
+        else:
+            names = [propid for propid in properties if propid in NAME_PROPERTIES]
+            properties = [
+                propid for propid in properties if propid not in NAME_PROPERTIES
+            ]
+        if names:
+            ReadPropertyMultipleToDo(devid, objid, names)
+        if properties:
+            ReadPropertyMultipleToDo(devid, objid, properties)
+    elif properties is None:
+        ReadObjectPropertyList(devid, objid)
+    else:
+        for propid in properties:
+            ReadPropertyToDo(devid, objid, propid)
+
+
+#
+#   ReadObjectPropertyList
+#
+
+
+@bacpypes_debugging
+class ReadObjectPropertyList(ReadPropertyToDo):
+    def __init__(self, devid, objid):
+        if _debug:
+            ReadObjectPropertyList._debug("__init__ %r", devid)
+        ReadPropertyToDo.__init__(self, devid, objid, "propertyList")
+
+    def returned_error(self, error):
+        if _debug:
+            ReadObjectPropertyList._debug("returned_error %r", error)
+
+        # get the class
+        object_class = get_object_class(self.objid[0])
+        if _debug:
+            ReadObjectPropertyList._debug("    - object_class: %r", object_class)
+
+        # get a list of properties, including optional ones
+        object_properties = list(object_class._properties.keys())
+        if _debug:
+            ReadObjectPropertyList._debug(
+                "    - object_properties: %r", object_properties
+            )
+
+        # dont bother reading the property list, it already failed
+        if "propertyList" in object_properties:
+            object_properties.remove("propertyList")
+
+        # try to read all the properties
+        for propid in object_properties:
+            ReadPropertyToDo(self.devid, self.objid, propid)
+
+    def returned_value(self, value):
+        if _debug:
+            ReadObjectPropertyList._debug("returned_value %r", value)
+
+        # add the other properties that are always present but not
+        # returned in property list
+        value.extend(("objectName", "objectType", "objectIdentifier"))
+
+        # read each of the individual properties
+        for propid in value:
+            ReadPropertyToDo(self.devid, self.objid, propid)
+
+
+#
+#   ReadTrendLog
+#
+
+
+def log_page_size(devid, objtype):
+    """Return the number of log records that fit in a ReadRange
+    acknowledgement from the device."""
+    record_length = (
+        LOG_MULTIPLE_RECORD_LENGTH
+        if objtype == "trendLogMultiple"
+        else LOG_RECORD_LENGTH
+    )
+    max_apdu = max_apdu_length(devid)
+    return max(1, (max_apdu - READ_RANGE_ACK_OVERHEAD) // record_length)
+
+
+def queue_log_pages(devid, objid, ranges, newest=None):
+    """Queue the pages of the (first, last) ranges of sequence numbers of a
+    log buffer, the page that ends at the newest record continues past it
+    for the records added since."""
+    page_size = log_page_size(devid, objid[0])
+    for first, last in ranges:
+        for start in range(first, last + 1, page_size):
+            end = min(start + page_size - 1, last)
+            ReadLogBuffer(devid, objid, start, None if end == newest else end)
+
+
+@bacpypes_debugging
+def ReadTrendLog(devid, objid):
+    """Capture the records of the log buffer of a trend log that have not
+    been captured, the ones newer than the last one in the history and the
+    gaps left by pages that could not be read."""
+    if _debug:
+        ReadTrendLog._debug("ReadTrendLog %r %r", devid, objid)
+
+    # the record counts tell where the buffer starts and ends so all of the
+    # pages can be queued at once, otherwise read one page after another
+    if registry.supports_rpm(devid) and (not args.disable_rpm):
+        ReadLogCounts(devid, objid)
+    else:
+        ReadLogRemainder(devid, objid)
+
+
+@bacpypes_debugging
+def ReadLogRemainder(devid, objid):
+    """Without the record counts, read the gaps between the records that
+    have been captured and then the records after the last one."""
+    if _debug:
+        ReadLogRemainder._debug("ReadLogRemainder %r %r", devid, objid)
+
+    log_objid = "{}:{}".format(*objid)
+    last = trend_history.last_sequence(devid, log_objid)
+    if _debug:
+        ReadLogRemainder._debug("    - last: %r", last)
+
+    queue_log_pages(devid, objid, trend_history.missing(devid, log_objid))
+    ReadLogBuffer(devid, objid, (last or 0) + 1)
+
+
+#
+#   ReadLogCounts
+#
+
+
+@bacpypes_debugging
+class ReadLogCounts(ReadPropertyMultipleToDo):
+    def __init__(self, devid, objid):
+        if _debug:
+            ReadLogCounts._debug("__init__ %r %r", devid, objid)
+
+        ReadPropertyMultipleToDo.__init__(
+            self, devid, objid, ["recordCount", "totalRecordCount"]
+        )
+
+    def returned_error(self, error):
+        if _debug:
+            ReadLogCounts._debug("returned_error %r", error)
+
+        ReadLogRemainder(self.devid, self.objid)
+
+    def returned_value(self, values):
+        if _debug:
+            ReadLogCounts._debug("returned_value %r", values)
+
+        counts = {propid: value for _, propid, _, value in values}
+        record_count = counts.get("recordCount")
+        newest = counts.get("totalRecordCount")
+        if (record_count is None) or (newest is None):
+            ReadLogRemainder(self.devid, self.objid)
+            return
+        if not record_count:
+            return
+
+        # the sequence number of the oldest record in the buffer, when the
+        # log has been reset since the last capture the old records are
+        # archived and all of them are read, otherwise the ones that have
+        # not been captured
+        log_objid = "{}:{}".format(*self.objid)
+        oldest = newest - record_count + 1
+        last = trend_history.last_sequence(self.devid, log_objid)
+        if (last is not None) and (last > newest):
+            trend_history.reset(self.devid, log_objid)
+        ranges = trend_history.missing(self.devid, log_objid, oldest, newest)
+        if _debug:
+            ReadLogCounts._debug("    - ranges: %r", ranges)
+
+        queue_log_pages(self.devid, self.objid, ranges, newest)
+
+
+#
+#   ReadLogBuffer
+#
+
+
+@bacpypes_debugging
+class ReadLogBuffer(ToDoItem):
+    """Read a page of the log buffer of a trend log by sequence number, from
+    the first record to the last one or as many as fit in a response when
+    there is no last one.  When the device returns fewer records than asked
+    for the rest are read with another page.  The records are written when
+    the last page of the log completes."""
+
+    # (devid, objid): number of pages that have not completed
+    pages = defaultdict(int)
+
+    def __init__(self, devid, objid, first, last=None, attempt=0):
+        if _debug:
+            ReadLogBuffer._debug(
+                "__init__ %r %r %r %r attempt=%r", devid, objid, first, last, attempt
+            )
+        ToDoItem.__init__(self)
+
+        # save the parameters
+        self.devid = devid
+        self.objid = objid
+        self.first = first
+        self.last = last
+        self.attempt = attempt
+        ReadLogBuffer.pages[devid, objid] += 1
+
+        # the number of records asked for
+        self.count = None
+
+        # give it to the list
+        application_to_do_list.append(self)
+
+    def prepare(self):
+        if _debug:
+            ReadLogBuffer._debug(
+                "prepare(%r %r %r %r)", self.devid, self.objid, self.first, self.last
+            )
+
+        # map the devid identifier to an address from the registry
+        addr = registry.address(self.devid)
+        if not addr:
+            raise ValueError("unknown device")
+
+        self.count = log_page_size(self.devid, self.objid[0])
+        if self.last is not None:
+            self.count = min(self.count, self.last - self.first + 1)
+
+        # build the request
+        request = ReadRangeRequest(
+            destination=addr,
+            objectIdentifier=self.objid,
+            propertyIdentifier="logBuffer",
+            range=Range(
+                bySequenceNumber=RangeBySequenceNumber(
+                    referenceSequenceNumber=self.first, count=self.count
+                )
+            ),
+        )
+        if _debug:
+            ReadLogBuffer._debug("    - request: %r", request)
+
+        # make an IOCB
+        iocb = IOCB(request)
+        if _debug:
+            ReadLogBuffer._debug("    - iocb: %r", iocb)
+
+        return iocb
+
+    def complete(self, iocb):
+        if _debug:
+            ReadLogBuffer._debug("complete %r", iocb)
+
+        apdu = iocb.ioResponse
+
+        # do something for error/reject/abort, ask again for pages that
+        # were not answered
+        if iocb.ioError:
+            if interactive:
+                print("{} log buffer error: {}".format(self.objid, iocb.ioError))
+            if isinstance(iocb.ioError, (AbortPDU, TimeoutError)) and (
+                self.attempt < LOG_PAGE_RETRIES
+            ):
+                ReadLogBuffer(
+                    self.devid, self.objid, self.first, self.last, self.attempt + 1
+                )
+
+        elif isinstance(apdu, ReadRangeACK):
+            self.returned_records(apdu)
+
+        # write the records of the log together, the pages queued above are
+        # counted before this one is finished
+        key = (self.devid, self.objid)
+        ReadLogBuffer.pages[key] -= 1
+        if not ReadLogBuffer.pages[key]:
+            del ReadLogBuffer.pages[key]
+            trend_history.flush()
+
+        # pass along
+        ToDoItem.complete(self, iocb)
+
+    def returned_records(self, apdu):
+        if _debug:
+            ReadLogBuffer._debug("returned_records %r", apdu.itemCount)
+        if not apdu.itemCount:
+            return
+
+        # decode the records
+        try:
+            records = apdu.itemData.cast_out(log_buffer_types[self.objid[0]])
+        except Exception as err:
+            if interactive:
+                print("{} log buffer decoding error: {}".format(self.objid, err))
+            return
+
+        # save them together, they have consecutive sequence numbers
+        sequence = apdu.firstSequenceNumber
+        rows = []
+        for record in records:
+            rows.extend(log_record_rows(sequence, record))
+            sequence += 1
+        trend_history.add(self.devid, "{}:{}".format(*self.objid), rows)
+
+        if interactive:
+            print(
+                "{} records {}-{}".format(
+                    self.objid, apdu.firstSequenceNumber, sequence - 1
+                )
+            )
+
+        # the rest of this page when they did not fit, or the records past
+        # the last page when there might be more
+        more_items = apdu.resultFlags[2] or (apdu.itemCount >= self.count)
+        if more_items and ((self.last is None) or (sequence <= self.last)):
+            ReadLogBuffer(self.devid, self.objid, sequence, self.last)
+
+
+#
+#   TimingWheel
+#
+
+
+@bacpypes_debugging
+class TimingWheel:
+    """A hierarchical timing wheel of things that are due at a tick.  The
+    first level has a slot for each of the next ticks, each slot of the
+    levels above covers all of the slots of the level below, and when the
+    ticks come around to a slot its things are moved down to the level
+    below.  Adding and advancing do not depend on how many things there
+    are.  The things have a 'due' attribute."""
+
+    def __init__(self, slots=WHEEL_SLOTS, levels=WHEEL_LEVELS):
+        if _debug:
+            TimingWheel._debug("__init__ slots=%r levels=%r", slots, levels)
+
+        self.slots = slots
+        self.tick = 0
+        self.levels = [[[] for _ in range(slots)] for _ in range(levels)]
+
+        # the farthest tick that fits
+        self.horizon = slots ** levels - 1
+
+    def add(self, thing, due):
+        """Add a thing that is due at a tick, at least the next one."""
+        due = min(max(due, self.tick + 1), self.tick + self.horizon)
+        thing.due = due
+        self._place(thing)
+
+    def _place(self, thing):
+        delta = thing.due - self.tick
+        span = 1
+        for level in self.levels:
+            if delta < span * self.slots:
+                level[(thing.due // span) % self.slots].append(thing)
+                return
+            span *= self.slots
+
+    def advance(self):
+        """Move to the next tick and return the list of things that are
+        due."""
+        self.tick += 1
+
+        # move the things in the upper level slots down, from the top
+        for level in range(len(self.levels) - 1, 0, -1):
+            span = self.slots ** level
+            if self.tick % span:
+                continue
+
+            index = (self.tick // span) % self.slots
+            things = self.levels[level][index]
+            self.levels[level][index] = []
+            for thing in things:
+                self._place(thing)
+
+        index = self.tick % self.slots
+        things = self.levels[0][index]
+        self.levels[0][index] = []
+
+        return things
+
 
-            # do something more
-            self.returned_error(iocb.ioError)
+#
+#   PollPoint
+#
 
-        # do something for success
-        elif iocb.ioResponse:
-            apdu = iocb.ioResponse
 
-            # should be an ack
-            if not isinstance(apdu, ReadPropertyMultipleACK):
-                if _debug:
-                    ReadPropertyMultipleToDo._debug("    - not an ack")
-                return
+class PollPoint:
+    """An object to poll, the properties to read and the time series point
+    number of each, the interval in ticks and the number of requests for it
+    that have not completed.  The read access specification is encoded once
+    for the requests, and the encoded object identifier is to check the
+    results."""
+
+    __slots__ = (
+        "devid",
+        "objid",
+        "encoded",
+        "request_data",
+        "properties",
+        "numbers",
+        "interval",
+        "due",
+        "busy",
+    )
 
-            # loop through the results
-            for result in apdu.listOfReadAccessResults:
-                # here is the object identifier
-                objectIdentifier = result.objectIdentifier
-                if _debug:
-                    ReadPropertyMultipleToDo._debug(
-                        "    - objectIdentifier: %r", objectIdentifier
-                    )
+    def __init__(self, devid, objid, properties, numbers, interval):
+        self.devid = devid
+        self.objid = objid
+        self.properties = properties
+        self.numbers = numbers
+        self.interval = interval
+        self.due = None
+        self.busy = 0
 
-                # now come the property values per object
-                for element in result.listOfResults:
-                    # get the property and array index
-                    propertyIdentifier = element.propertyIdentifier
-                    if _debug:
-                        ReadPropertyMultipleToDo._debug(
-                            "    - propertyIdentifier: %r", propertyIdentifier
-                        )
-                    propertyArrayIndex = element.propertyArrayIndex
-                    if _debug:
-                        ReadPropertyMultipleToDo._debug(
-                            "    - propertyArrayIndex: %r", propertyArrayIndex
-                        )
+        tag = Tag()
+        ObjectIdentifier(objid).encode(tag)
+        self.encoded = tag.tagData
 
-                    # here is the read result
-                    readResult = element.readResult
+        read_access_spec = ReadAccessSpecification(
+            objectIdentifier=objid,
+            listOfPropertyReferences=[
+                PropertyReference(propertyIdentifier=propid) for propid in properties
+            ],
+        )
+        tag_list = TagList()
+        read_access_spec.encode(tag_list)
+        data = PDUData()
+        tag_list.encode(data)
+        self.request_data = bytes(data.pduData)
 
-                    property_label = str(propertyIdentifier)
-                    if propertyArrayIndex is not None:
-                        property_label += "[" + str(propertyArrayIndex) + "]"
 
-                    # check for an error
-                    if readResult.propertyAccessError is not None:
-                        if interactive:
-                            print(
-                                "{} ! {}".format(
-                                    property_label, readResult.propertyAccessError
-                                )
-                            )
+#
+#   PollRequest
+#
 
-                    else:
-                        # here is the value
-                        value = None
-                        propertyValue = readResult.propertyValue
-
-                        # find the datatype
-                        datatype = get_datatype(objectIdentifier[0], propertyIdentifier)
-                        if _debug:
-                            ReadPropertyMultipleToDo._debug(
-                                "    - datatype: %r", datatype
-                            )
-                        if not datatype:
-                            str_value = "?"
-                        else:
-                            # special case for array parts, others are managed by cast_out
-                            if issubclass(datatype, Array) and (
-                                propertyArrayIndex is not None
-                            ):
-                                if propertyArrayIndex == 0:
-                                    datatype = Unsigned
-                                else:
-                                    datatype = datatype.subtype
-                                if _debug:
-                                    ReadPropertyMultipleToDo._debug(
-                                        "    - datatype: %r", datatype
-                                    )
-
-                            try:
-                                value = propertyValue.cast_out(datatype)
-                                if _debug:
-                                    ReadPropertyMultipleToDo._debug(
-                                        "    - value: %r", value
-                                    )
-
-                                # convert the value to a string
-                                if hasattr(value, "dict_contents"):
-                                    dict_contents = value.dict_contents(
-                                        as_class=OrderedDict
-                                    )
-                                    str_value = json.dumps(dict_contents)
-                                else:
-                                    str_value = str(value)
-                            except Exception as err:
-                                str_value = "!" + str(err)
-
-                        if interactive:
-                            print("{}: {}".format(propertyIdentifier, str_value))
-
-                        # save it in the snapshot
-                        snapshot[
-                            self.devid,
-                            "{}:{}".format(*objectIdentifier),
-                            str(propertyIdentifier),
-                        ] = value
 
-        # do something with nothing?
-        else:
-            if _debug:
-                ReadPropertyMultipleToDo._debug("    - ioError or ioResponse expected")
+class PollRequest(ReadPropertyMultipleRequest):
+    """A Read-Property-Multiple request for some polled points made from
+    their encoded read access specifications.  The acknowledgement is not
+    decoded (see DiscoverApplicationServiceAccessPoint)."""
 
-    def returned_error(self, error):
-        if _debug:
-            ReadPropertyMultipleToDo._debug("returned_error %r", error)
+    _undecoded = True
 
-    def returned_value(self, value):
-        if _debug:
-            ReadPropertyMultipleToDo._debug("returned_value %r", value)
+    def __init__(self, points, **kwargs):
+        ReadPropertyMultipleRequest.__init__(self, **kwargs)
+        self.points = points
+
+    def encode(self, apdu):
+        apdu.update(self)
+        apdu.put_data(b"".join(point.request_data for point in self.points))
 
 
 #
-#   ReadObjectListLen
+#   PollToDo
 #
 
 
 @bacpypes_debugging
-class ReadObjectListLen(ReadPropertyToDo):
-    def __init__(self, devid):
-        if _debug:
-            ReadObjectListLen._debug("__init__ %r", devid)
-        ReadPropertyToDo.__init__(self, devid, ("device", devid), "objectList", 0)
-
-    def returned_error(self, error):
-        if _debug:
-            ReadObjectListLen._debug("returned_error %r", error)
+class PollToDo(ToDoItem):
+    """Read the properties of some polled objects of a device with one
+    Read-Property-Multiple request, or one property of one object with a
+    Read-Property request when the device does not support it, and add the
+    values to the time series."""
 
-    def returned_value(self, value):
+    def __init__(self, devid, points, propid=None):
         if _debug:
-            ReadObjectListLen._debug("returned_value %r", value)
+            PollToDo._debug("__init__ %r %r %r", devid, len(points), propid)
+        ToDoItem.__init__(self)
 
-        # start with an empty list
-        devobj = device_profile[self.devid]
-        devobj.objectList = ArrayOf(ObjectIdentifier)()
+        # save the parameters
+        self.devid = devid
+        self.points = points
+        self.propid = propid
 
-        # read each of the individual items
-        for i in range(1, value + 1):
-            ReadObjectListElement(self.devid, i)
+        # the points are being read
+        for point in points:
+            point.busy += 1
 
+        # give it to the list
+        application_to_do_list.append(self)
 
-#
-#   ReadObjectListElement
-#
+    def prepare(self):
+        if _debug:
+            PollToDo._debug("prepare(%r)", self.devid)
 
+        # map the devid identifier to an address from the registry
+        addr = registry.address(self.devid)
+        if not addr:
+            raise ValueError("unknown device")
 
-@bacpypes_debugging
-class ReadObjectListElement(ReadPropertyToDo):
-    def __init__(self, devid, indx):
+        # build the request
+        if self.propid:
+            request = ReadPropertyRequest(
+                destination=addr,
+                objectIdentifier=self.points[0].objid,
+                propertyIdentifier=self.propid,
+            )
+        else:
+            request = PollRequest(self.points, destination=addr)
         if _debug:
-            ReadObjectListElement._debug("__init__ %r", devid, indx)
-        ReadPropertyToDo.__init__(self, devid, ("device", devid), "objectList", indx)
+            PollToDo._debug("    - request: %r", request)
 
-    def returned_error(self, error):
+        # make an IOCB
+        iocb = IOCB(request)
         if _debug:
-            ReadObjectListElement._debug("returned_error %r", error)
+            PollToDo._debug("    - iocb: %r", iocb)
 
-    def returned_value(self, value):
+        return iocb
+
+    def complete(self, iocb):
         if _debug:
-            ReadObjectListElement._debug("returned_value %r", value)
+            PollToDo._debug("complete %r", iocb)
 
-        # update the list
-        devobj = device_profile[self.devid]
-        devobj.objectList.append(value)
+        for point in self.points:
+            point.busy -= 1
 
-        # check to see if it is a known object type
-        if not get_object_class(value[0]):
-            return
+        now = time.time()
+        apdu = iocb.ioResponse
 
-        # read the properties of the object
-        ReadObjectProperties(self.devid, value)
+        # do something for error/reject/abort
+        if iocb.ioError:
+            if interactive:
+                print("{} poll error: {}".format(self.devid, iocb.ioError))
+
+        # one property of one object
+        elif isinstance(apdu, ReadPropertyACK):
+            point = self.points[0]
+            number = point.numbers[point.properties.index(self.propid)]
+            time_series.extend(
+                [(number, now) + sample_value(apdu.propertyValue)]
+            )
 
+        # the results are in the order of the request
+        elif isinstance(apdu, ComplexAckPDU):
+            try:
+                rows = poll_samples(apdu.pduData, self.points, now)
+            except (ValueError, IndexError, struct.error) as err:
+                if _debug:
+                    PollToDo._debug("    - decode the long way: %r", err)
+                rows = self.decoded_samples(apdu, now)
+            time_series.extend(rows)
 
-#
-#   ReadObjectProperties
-#
+        # pass along
+        ToDoItem.complete(self, iocb)
 
+    def decoded_samples(self, apdu, now):
+        """Return the samples from an acknowledgement that is not what
+        poll_samples() expects, like a property with an array index."""
+        ack = ReadPropertyMultipleACK()
+        try:
+            ack.decode(apdu)
+        except Exception as err:
+            if interactive:
+                print("{} poll decoding error: {}".format(self.devid, err))
+            return []
 
-@bacpypes_debugging
-def ReadObjectProperties(devid, objid):
-    if _debug:
-        ReadObjectProperties._debug("ReadObjectProperties %r %r", devid, objid)
-    global args
+        rows = []
+        for point, result in zip(self.points, ack.listOfReadAccessResults):
+            for number, element in zip(point.numbers, result.listOfResults):
+                read_result = element.readResult
+                if read_result.propertyAccessError is None:
+                    rows.append((number, now) + sample_value(read_result.propertyValue))
+        return rows
 
-    # get the profile, it contains the protocol services supported
-    devobj = device_profile[devid]
-    supports_rpm = devobj.protocolServicesSupported["readPropertyMultiple"]
-    if _debug:
-        ReadObjectProperties._debug("    - supports rpm: %r", supports_rpm)
 
-    # read all the properties at once if it's an option
-    if supports_rpm and (not args.disable_rpm):
-        ReadPropertyMultipleToDo(devid, objid, ["all"])
-    else:
-        ReadObjectPropertyList(devid, objid)
+def poll_batch_size(devid, property_count):
+    """Return the number of objects with some properties that fit in a
+    response from the device."""
+    max_apdu = max_apdu_length(devid)
+    object_length = POLL_OBJECT_LENGTH + POLL_PROPERTY_LENGTH * property_count
+    return max(1, (max_apdu - POLL_ACK_OVERHEAD) // object_length)
 
 
 #
-#   ReadObjectPropertyList
+#   Poller
 #
 
 
 @bacpypes_debugging
-class ReadObjectPropertyList(ReadPropertyToDo):
-    def __init__(self, devid, objid):
-        if _debug:
-            ReadObjectPropertyList._debug("__init__ %r", devid)
-        ReadPropertyToDo.__init__(self, devid, objid, "propertyList")
+class Poller(RecurringTask):
+    """Poll the properties of the objects in the snapshot that have a present
+    value.  Each tick the objects that are due are read with one request for
+    each device (or as many as it takes to fit in the responses), objects
+    that are still being read from the last time are skipped, and the
+    samples are written to the time series together.
+
+    The configuration is a JSON object with an optional tick (seconds) and a
+    list of rules, the first rule that matches an object applies and the
+    objects that do not match are not polled:
+
+        {"tick": 1.0, "rules": [
+            {"objects": "analogInput:*", "interval": 10},
+            {"devices": [2003], "objects": "binaryValue:*", "interval": 5,
+             "properties": ["presentValue"]}
+        ]}
+    """
+
+    def __init__(self, config):
+        if _debug:
+            Poller._debug("__init__ %r", config)
+
+        self.tick = float(config.get("tick", DEFAULT_POLL_TICK))
+        if self.tick <= 0.0:
+            raise ValueError("poll tick must be positive")
+        RecurringTask.__init__(self, self.tick * 1000.0)
+
+        self.rules = config.get("rules", [])
+        for rule in self.rules:
+            if float(rule.get("interval", 0.0)) <= 0.0:
+                raise ValueError("poll interval must be positive: {!r}".format(rule))
+
+        self.wheel = TimingWheel()
+        self.points = []
+
+    def match(self, devid, objid):
+        """Return the first rule that applies to an object, or None."""
+        for rule in self.rules:
+            if ("devices" in rule) and (devid not in rule["devices"]):
+                continue
+            if not fnmatchcase(objid, rule.get("objects", "*")):
+                continue
+            return rule
 
-    def returned_error(self, error):
-        if _debug:
-            ReadObjectPropertyList._debug("returned_error %r", error)
+        return None
 
-        # get the class
-        object_class = get_object_class(self.objid[0])
+    def load(self):
+        """Find the objects to poll in the snapshot and put them in the
+        wheel."""
         if _debug:
-            ReadObjectPropertyList._debug("    - object_class: %r", object_class)
+            Poller._debug("load")
 
-        # get a list of properties, including optional ones
-        object_properties = list(object_class._properties.keys())
-        if _debug:
-            ReadObjectPropertyList._debug(
-                "    - object_properties: %r", object_properties
-            )
+        for devid, objid, _, _ in snapshot.raw_items(propid="presentValue"):
+            devid = int(devid)
+            rule = self.match(devid, objid)
+            if not rule:
+                continue
+            if registry.address(devid) is None:
+                if _debug:
+                    Poller._debug("    - no address: %r", devid)
+                continue
 
-        # dont bother reading the property list, it already failed
-        if "propertyList" in object_properties:
-            object_properties.remove("propertyList")
+            objid_value = ObjectIdentifier(objid).value
+            properties = tuple(
+                propid
+                for propid in rule.get("properties", POLL_PROPERTIES)
+                if get_datatype(objid_value[0], propid)
+            )
+            if not properties:
+                continue
 
-        # try to read all the properties
-        for propid in object_properties:
-            ReadPropertyToDo(self.devid, self.objid, propid)
+            self.points.append(
+                PollPoint(
+                    devid,
+                    objid_value,
+                    properties,
+                    tuple(time_series.point(devid, objid, p) for p in properties),
+                    max(1, int(round(float(rule["interval"]) / self.tick))),
+                )
+            )
+        time_series.flush()
 
-    def returned_value(self, value):
+        # the objects of a device with the same interval are due together
+        for point in self.points:
+            self.wheel.add(point, point.devid % point.interval)
         if _debug:
-            ReadObjectPropertyList._debug("returned_value %r", value)
+            Poller._debug("    - points: %r", len(self.points))
 
-        # add the other properties that are always present but not
-        # returned in property list
-        value.extend(("objectName", "objectType", "objectIdentifier"))
+        return len(self.points)
 
-        # read each of the individual properties
-        for propid in value:
-            ReadPropertyToDo(self.devid, self.objid, propid)
+    def process_task(self):
+        # group the objects that are due by device
+        devices = defaultdict(list)
+        for point in self.wheel.advance():
+            if point.busy:
+                if _debug:
+                    Poller._debug("    - overrun: %r %r", point.devid, point.objid)
+            else:
+                devices[point.devid].append(point)
+            self.wheel.add(point, point.due + point.interval)
+
+        for devid, points in devices.items():
+            if registry.supports_rpm(devid) and (not args.disable_rpm):
+                size = poll_batch_size(
+                    devid, max(len(point.properties) for point in points)
+                )
+                for i in range(0, len(points), size):
+                    PollToDo(devid, points[i : i + size])
+            else:
+                for point in points:
+                    for propid in point.properties:
+                        PollToDo(devid, [point], propid)
+
+        # write the samples that came in since the last tick
+        time_series.flush()
+
+
+def load_poll_configuration(filename):
+    """Read a poll configuration file, see Poller."""
+    if _debug:
+        _log.debug("load_poll_configuration %r", filename)
+
+    try:
+        with open(filename) as config_file:
+            config = json.load(config_file)
+    except (OSError, ValueError) as err:
+        raise ValueError(f"poll configuration file {filename}: {err}")
+
+    if not isinstance(config, dict) or not isinstance(config.get("rules", []), list):
+        raise ValueError(f"poll configuration file {filename}: rules expected")
+
+    return config
 
 
 #
@@ -1107,33 +3012,32 @@ class DiscoverConsoleCmd(ConsoleCmd):
         wirtn [ <addr> ] [ <net> ]
 
         Send a Who-Is-Router-To-Network message.  If <addr> is not specified
-        the message is locally broadcast.
+        the message is locally broadcast.  The routers that answer are saved
+        and asked for their routing tables.
         """
         args = args.split()
         if _debug:
             DiscoverConsoleCmd._debug("do_wirtn %r", args)
 
-        # build a request
+        # parse parameters
         try:
-            request = WhoIsRouterToNetwork()
+            addr = net = None
             if not args:
-                request.pduDestination = LocalBroadcast()
+                pass
             elif args[0].isdigit():
-                request.pduDestination = LocalBroadcast()
-                request.wirtnNetwork = int(args[0])
+                net = int(args[0])
             else:
-                request.pduDestination = Address(args[0])
+                addr = Address(args[0])
                 if len(args) > 1:
-                    request.wirtnNetwork = int(args[1])
+                    net = int(args[1])
         except Exception:
             print("invalid arguments")
             return
 
-        # give it to the network service element
-        this_application.nse.request(this_application.nsap.local_adapter, request)
-
-        # sleep for responses
-        time.sleep(3.0)
+        # make an item, the responses are collected while the console goes on
+        item = WhoIsRouterToNetworkToDo(addr, net)
+        if _debug:
+            DiscoverConsoleCmd._debug("    - item: %r", item)
 
     def do_irt(self, args):
         """
@@ -1146,16 +3050,17 @@ class DiscoverConsoleCmd(ConsoleCmd):
         if _debug:
             DiscoverConsoleCmd._debug("do_irt %r", args)
 
-        # build a request
+        # parse parameters
         try:
-            request = InitializeRoutingTable()
-            request.pduDestination = Address(args[0])
+            addr = Address(args[0])
         except Exception:
             print("invalid arguments")
             return
 
-        # give it to the network service element
-        this_application.nse.request(this_application.nsap.local_adapter, request)
+        # make an item
+        item = InitializeRoutingTableToDo(addr)
+        if _debug:
+            DiscoverConsoleCmd._debug("    - item: %r", item)
 
     def do_winn(self, args):
         """
@@ -1168,22 +3073,48 @@ class DiscoverConsoleCmd(ConsoleCmd):
         if _debug:
             DiscoverConsoleCmd._debug("do_winn %r", args)
 
-        # build a request
+        # parse parameters
         try:
-            request = WhatIsNetworkNumber()
-            if len(args) > 0:
-                request.pduDestination = Address(args[0])
-            else:
-                request.pduDestination = LocalBroadcast()
+            addr = Address(args[0]) if args else None
         except Exception:
             print("invalid arguments")
             return
 
-        # give it to the network service element
-        this_application.nse.request(this_application.nsap.local_adapter, request)
+        # make an item
+        item = WhatIsNetworkNumberToDo(addr)
+        if _debug:
+            DiscoverConsoleCmd._debug("    - item: %r", item)
+
+    def do_discover(self, args):
+        """
+        discover [ <lolimit> <hilimit> ]
+
+        Find the routers and read their routing tables, then send a Who-Is
+        Request to the local network and to each of the networks that can
+        be reached.
+        """
+        args = args.split()
+        if _debug:
+            DiscoverConsoleCmd._debug("do_discover %r", args)
+
+        try:
+            # parse parameters
+            if len(args) == 2:
+                lolimit = int(args[0])
+                hilimit = int(args[1])
+            else:
+                lolimit = hilimit = None
+
+            # sweep after the network path items are done
+            network_path_to_do_list.who_is_limits = (lolimit, hilimit)
+
+            # make an item
+            item = WhoIsRouterToNetworkToDo()
+            if _debug:
+                DiscoverConsoleCmd._debug("    - item: %r", item)
 
-        # sleep for responses
-        time.sleep(3.0)
+        except Exception as err:
+            DiscoverConsoleCmd._exception("exception: %r", err)
 
     def do_whois(self, args):
         """
@@ -1307,7 +3238,9 @@ class DiscoverConsoleCmd(ConsoleCmd):
                 DiscoverConsoleCmd._debug("    - devid: %r", devid)
                 DiscoverConsoleCmd._debug("    - addr: %r", addr)
 
-            # map the devid identifier to an address from the database
+            # map the devid identifier to an address in the registry, the
+            # requests to the device look it up there
+            deferred(registry.update, devid, address=addr)
             deferred(snapshot.__setitem__, (devid, "-", "address"), addr)
 
         except Exception as error:
@@ -1354,8 +3287,8 @@ class DiscoverConsoleCmd(ConsoleCmd):
                 DiscoverConsoleCmd._debug("    - devid: %r", devid)
             i += 1
 
-            # map the devid identifier to an address from the database
-            addr = snapshot[devid, "-", "address"]
+            # map the devid identifier to an address from the registry
+            addr = registry.address(devid)
             if not addr:
                 raise ValueError("unknown device")
             if _debug:
@@ -1412,138 +3345,68 @@ class DiscoverConsoleCmd(ConsoleCmd):
             if not read_access_spec_list:
                 raise RuntimeError("at least one read access specification required")
 
-            # build the request
-            request = ReadPropertyMultipleRequest(
-                listOfReadAccessSpecs=read_access_spec_list
-            )
-            request.pduDestination = Address(addr)
+            # make an item, the values are saved when it completes
+            item = ReadAccessToDo(devid, read_access_spec_list)
             if _debug:
-                DiscoverConsoleCmd._debug("    - request: %r", request)
+                DiscoverConsoleCmd._debug("    - item: %r", item)
 
-            # make an IOCB
-            iocb = IOCB(request)
-            if _debug:
-                DiscoverConsoleCmd._debug("    - iocb: %r", iocb)
+        except Exception as error:
+            DiscoverConsoleCmd._exception("exception: %r", error)
 
-            # give it to the application
-            this_application.request_io(iocb)
+    def do_wait(self, args):
+        """
+        wait idle [ <secs> ]
+        wait device <devid> [ <secs> ]
+        wait iams <count> [ <secs> ]
 
-            # wait for it to complete
-            iocb.wait()
+        Wait until there is nothing left to do, until the requests for a
+        device have completed, or until I-Am responses have been received
+        from a number of devices, with an optional timeout.
+        """
+        args = args.split()
+        if _debug:
+            DiscoverConsoleCmd._debug("do_wait %r", args)
 
-            # do something for success
-            if iocb.ioResponse:
-                apdu = iocb.ioResponse
+        try:
+            what = args[0]
+            if what == "idle":
+                to_do_lists = (
+                    network_path_to_do_list,
+                    who_is_to_do_list,
+                    application_to_do_list,
+                )
 
-                # should be an ack
-                if not isinstance(apdu, ReadPropertyMultipleACK):
-                    if _debug:
-                        DiscoverConsoleCmd._debug("    - not an ack")
-                    return
+                def condition():
+                    return not any(
+                        to_do_list.active or to_do_list.pending
+                        for to_do_list in to_do_lists
+                    )
 
-                # loop through the results
-                for result in apdu.listOfReadAccessResults:
-                    # here is the object identifier
-                    objectIdentifier = result.objectIdentifier
-                    if _debug:
-                        DiscoverConsoleCmd._debug(
-                            "    - objectIdentifier: %r", objectIdentifier
-                        )
+                del args[0]
+            elif what == "device":
+                devid = int(args[1])
 
-                    # now come the property values per object
-                    for element in result.listOfResults:
-                        # get the property and array index
-                        propertyIdentifier = element.propertyIdentifier
-                        if _debug:
-                            DiscoverConsoleCmd._debug(
-                                "    - propertyIdentifier: %r", propertyIdentifier
-                            )
-                        propertyArrayIndex = element.propertyArrayIndex
-                        if _debug:
-                            DiscoverConsoleCmd._debug(
-                                "    - propertyArrayIndex: %r", propertyArrayIndex
-                            )
-
-                        # here is the read result
-                        readResult = element.readResult
-
-                        property_label = str(propertyIdentifier)
-                        if propertyArrayIndex is not None:
-                            property_label += "[" + str(propertyArrayIndex) + "]"
-
-                        # check for an error
-                        if readResult.propertyAccessError is not None:
-                            if interactive:
-                                print(
-                                    "{} ! {}".format(
-                                        property_label, readResult.propertyAccessError
-                                    )
-                                )
-
-                        else:
-                            # here is the value
-                            value = None
-                            propertyValue = readResult.propertyValue
-
-                            # find the datatype
-                            datatype = get_datatype(
-                                objectIdentifier[0], propertyIdentifier
-                            )
-                            if _debug:
-                                DiscoverConsoleCmd._debug(
-                                    "    - datatype: %r", datatype
-                                )
-                            if not datatype:
-                                str_value = "?"
-                            else:
-                                # special case for array parts, others are managed by cast_out
-                                if issubclass(datatype, Array) and (
-                                    propertyArrayIndex is not None
-                                ):
-                                    if propertyArrayIndex == 0:
-                                        datatype = Unsigned
-                                    else:
-                                        datatype = datatype.subtype
-                                    if _debug:
-                                        DiscoverConsoleCmd._debug(
-                                            "    - datatype: %r", datatype
-                                        )
-
-                                try:
-                                    value = propertyValue.cast_out(datatype)
-                                    if _debug:
-                                        DiscoverConsoleCmd._debug(
-                                            "    - value: %r", value
-                                        )
-
-                                    # convert the value to a string
-                                    if hasattr(value, "dict_contents"):
-                                        dict_contents = value.dict_contents(
-                                            as_class=OrderedDict
-                                        )
-                                        str_value = json.dumps(dict_contents)
-                                    else:
-                                        str_value = str(value)
-                                except Exception as err:
-                                    str_value = "!" + str(err)
-
-                            if interactive:
-                                print("{}: {}".format(property_label, str_value))
-
-                            # save it in the snapshot
-                            snapshot[
-                                devid,
-                                "{}:{}".format(*objectIdentifier),
-                                str(propertyIdentifier),
-                            ] = value
-
-            # do something for error/reject/abort
-            if iocb.ioError:
-                if interactive:
-                    print(str(iocb.ioError))
+                def condition():
+                    return devid not in application_to_do_list.device_items
 
+                del args[:2]
+            elif what == "iams":
+                count = int(args[1])
+
+                def condition():
+                    return len(who_is_to_do_list.i_am_devices) >= count
+
+                del args[:2]
+            else:
+                raise ValueError("idle, device, or iams expected")
+
+            timeout = float(args[0]) if args else None
         except Exception as error:
-            DiscoverConsoleCmd._exception("exception: %r", error)
+            print("invalid arguments: {}".format(error))
+            return
+
+        if not console_waits.wait(condition, timeout):
+            print("timeout")
 
 
 #
@@ -1552,7 +3415,7 @@ class DiscoverConsoleCmd(ConsoleCmd):
 
 
 def main():
-    global args, this_device, this_application, snapshot, who_is_to_do_list, application_to_do_list
+    global args, this_device, this_application, snapshot, registry, capture_profile, topology, network_path_to_do_list, who_is_to_do_list, application_to_do_list, console_waits, time_series, trend_history
 
     # parse the command line arguments
     parser = ConfigArgumentParser(description=__doc__)
@@ -1574,6 +3437,39 @@ def main():
         default=None,
     )
 
+    # the properties to read
+    parser.add_argument(
+        "--profiles", type=str, help="capture profiles file",
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        help="capture profile, default is full (all of the properties)",
+        default="full",
+    )
+
+    # limit the requests in flight to each network
+    parser.add_argument(
+        "--max-window",
+        type=int,
+        help="maximum requests in flight to the devices on a network, default %d"
+        % (DEFAULT_MAX_WINDOW,),
+        default=DEFAULT_MAX_WINDOW,
+    )
+
+    # poll the objects in the snapshot
+    parser.add_argument(
+        "--poll", type=str, help="poll configuration file",
+    )
+
+    # write to the database from a separate thread
+    parser.add_argument(
+        "--threaded",
+        help="write to the database from a separate thread",
+        action="store_true",
+        default=None,
+    )
+
     args = parser.parse_args()
 
     if _debug:
@@ -1581,6 +3477,26 @@ def main():
     if _debug:
         _log.debug("    - args: %r", args)
 
+    # pick a capture profile
+    profiles = {FULL_PROFILE.name: FULL_PROFILE}
+    if args.profiles:
+        try:
+            profiles.update(load_profiles(args.profiles))
+        except ValueError as err:
+            parser.error(str(err))
+    if args.profile not in profiles:
+        parser.error(f"unknown profile: {args.profile}")
+    capture_profile = profiles[args.profile]
+
+    # check the poll configuration
+    if args.poll:
+        try:
+            poller = Poller(load_poll_configuration(args.poll))
+        except ValueError as err:
+            parser.error(str(err))
+    else:
+        poller = None
+
     # make a device object
     this_device = LocalDeviceObject(ini=args.ini)
     if _debug:
@@ -1595,18 +3511,44 @@ def main():
 
     # make a simple application
     this_application = DiscoverApplication(
-        this_device, args.ini.address, bbmdAddress, bbmdTTL
+        this_device,
+        args.ini.address,
+        bbmdAddress,
+        bbmdTTL,
+        deviceInfoCache=RegistryDeviceInfoCache(),
     )
     if _debug:
         _log.debug("    - this_application: %r", this_application)
 
     # open/create the database
-    snapshot = Snapshot(args.dbname)
+    if args.threaded:
+        snapshot = ThreadedSnapshot(args.dbname)
+    else:
+        snapshot = Snapshot(args.dbname)
+
+    # load the device registry, the application knows about the devices
+    registry = DeviceRegistry(snapshot)
+    registry.seed(this_application.deviceInfoCache)
+
+    # the routers found before
+    topology = NetworkTopology(snapshot)
 
     # special lists
-    # network_path_to_do_list = NetworkPathToDoList(this_application.nse)
-    who_is_to_do_list = WhoIsToDoList(this_application)
-    application_to_do_list = ApplicationToDoList()
+    network_path_to_do_list = NetworkPathToDoList(this_application.nse)
+    who_is_to_do_list = WhoIsToDoList(this_application, WHO_IS_ACTIVE_LIMIT)
+    application_to_do_list = ApplicationToDoList(args.max_window)
+    console_waits = ConsoleWaits()
+
+    # captured trend log records
+    trend_history = TrendHistory(snapshot)
+
+    # start polling
+    if poller:
+        time_series = TimeSeries(snapshot)
+        count = poller.load()
+        if interactive:
+            print("polling {} objects".format(count))
+        poller.install_task()
 
     # make a console
     this_console = DiscoverConsoleCmd()
@@ -1621,7 +3563,12 @@ def main():
 
     _log.debug("fini")
 
-    # close the database
+    # save the round trip times, samples and log records, and close the
+    # database
+    registry.close()
+    if time_series:
+        time_series.close()
+    trend_history.close()
     snapshot.close()
 
 
@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+
+"""
+Snapshot Split
+
+This application copies the devices that match a device identifier list or
+range, like a building of a site capture, from a snapshot database into a
+new one that can be given to replay.py.  The rows are copied by SQLite with
+INSERT ... SELECT from the attached source.
+"""
+
+import os
+
+from bacpypes.debugging import ModuleLogger
+from bacpypes.consolelogging import ArgumentParser
+
+from db import Snapshot, parse_ranges
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+
+#
+#   __main__
+#
+
+
+def main():
+    # parse the command line arguments
+    parser = ArgumentParser(description=__doc__)
+
+    parser.add_argument("source", help="source database file name")
+    parser.add_argument("dbname", help="new database file name")
+    parser.add_argument(
+        "devid", help="device identifiers, a list and ranges like 2000-2099,3000"
+    )
+
+    args = parser.parse_args()
+
+    if _debug:
+        _log.debug("initialization")
+    if _debug:
+        _log.debug("    - args: %r", args)
+
+    if not os.path.isfile(args.source):
+        parser.error("no such database: {}".format(args.source))
+    try:
+        parse_ranges(args.devid)
+    except ValueError as err:
+        parser.error(str(err))
+
+    snapshot = Snapshot(args.dbname)
+
+    _log.debug("running")
+
+    row_count = snapshot.load(args.source, args.devid)
+    print("{} rows".format(row_count))
+
+    snapshot.update_names()
+
+    _log.debug("fini")
+
+    snapshot.close()
+
+
+if __name__ == "__main__":
+    main()